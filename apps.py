@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class CollectorConfig(AppConfig):
     name = 'collector'
+
+    def ready(self):
+        # Connect signals for invalidate cached devices and reference objects
+        from collector import cache
@@ -0,0 +1,245 @@
+from collections import OrderedDict
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_save, post_delete
+from dcim.models import Device, DeviceRole, DeviceType, Manufacturer, Platform
+from extras.models import CustomField, CustomFieldValue
+from virtualization.models import Cluster, ClusterType
+from collector import regexes
+from collector.settings import *
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger('collector')
+
+# Objects are invalidated by signals on changes in this process,
+# changes from other processes are seen after REFERENCE_CACHE_TTL seconds
+
+_lock = threading.RLock()
+
+# Reference objects: {(model, name): (time, object)}
+_references = {}
+
+# Vendors index: (time, list of (normalized name, Manufacturer)), found vendors: {normalized name: Manufacturer}
+_vendors = None
+_found_vendors = {}
+
+# Devices LRU: {hostname: (time, DeviceProfile)}
+_devices = OrderedDict()
+
+_spaces_regex = re.compile(r'\s+')
+
+
+def _normalize(name):
+    return _spaces_regex.sub(' ', str(name)).strip().lower()
+
+
+def _is_fresh(cached_time):
+    return time.time() - cached_time < REFERENCE_CACHE_TTL
+
+
+def get_reference(model, name):
+    """ Get a reference object (platform, role, etc) by name
+
+        :param model: Django model class
+        :param name: String
+        :return: model object
+    """
+    key = (model, name)
+    cached = _references.get(key)
+    if cached and _is_fresh(cached[0]):
+        return cached[1]
+    obj = model.objects.get(name=name)
+    with _lock:
+        _references[key] = (time.time(), obj)
+    return obj
+
+
+def _get_vendors_index():
+    global _vendors
+    with _lock:
+        if _vendors is None or not _is_fresh(_vendors[0]):
+            # Same order as Manufacturer ordering - first match is same as first object of query
+            _vendors = (time.time(), [(_normalize(man.name), man) for man in Manufacturer.objects.order_by('name')])
+            _found_vendors.clear()
+        return _vendors[1]
+
+
+def get_vendor(vendor_name):
+    """ Find Manufacturer, which name contains vendor name (or its alias from VENDOR_ALIASES)
+        If it is not found - returns NoName manufacturer
+
+        :param vendor_name: String
+        :rtype: object NetBox Manufacturer
+    """
+    index = _get_vendors_index()
+    name = _normalize(vendor_name)
+    name = _normalize(VENDOR_ALIASES.get(name, name))
+    try:
+        return _found_vendors[name]
+    except KeyError:
+        pass
+
+    man = next((man for man_name, man in index if name in man_name), None)
+    if man:
+        logger.debug("Found a vendor %s - return it", vendor_name)
+    else:
+        logger.debug("Cannot a vendor %s - will be a NoName", vendor_name)
+        # TODO: Add a check for NoName is exists or create it
+        man = get_reference(Manufacturer, "--- NoName ---")
+    with _lock:
+        if len(_found_vendors) >= VENDOR_CACHE_SIZE:
+            _found_vendors.clear()
+        _found_vendors[name] = man
+    return man
+
+
+class DeviceProfile(object):
+    """ Facts of device, which are needed for every sync of it
+    """
+
+    def __init__(self, device):
+        self.device = device
+        # Vendor by platform or type
+        if device.platform:
+            self.vendor = device.platform.name
+        else:
+            self.vendor = device.device_type.manufacturer.name
+        self.cluster = device.cluster
+        self._iface_regex = None
+
+    @property
+    def iface_regex(self):
+        """ Compiled regex of "Interfaces filter" custom field
+        """
+        if self._iface_regex is None:
+            # Custom fields are read only for interfaces syncing
+            iface_filter = self.device.cf().get('Interfaces filter')
+            try:
+                self._iface_regex = re.compile(iface_filter)
+                problems = regexes.check(iface_filter)
+                if problems:
+                    logger.warning("Interface filter of %s can be slow - %s", self.device.name, "; ".join(problems))
+            except Exception as e:
+                logger.warning("Cannot parse regex for interface filter: %s", e)
+                self._iface_regex = re.compile('.*')
+        return self._iface_regex
+
+
+def _add_profile(profile, now):
+    _devices[profile.device.name] = (now, profile)
+    _devices.move_to_end(profile.device.name)
+    while len(_devices) > DEVICE_CACHE_SIZE:
+        _devices.popitem(last=False)
+
+
+def get_profiles(hostnames):
+    """ Get a profiles of devices
+        Not cached devices are fetched by one query
+
+        :param hostnames: list of hostnames
+        :return: dict {hostname: DeviceProfile}
+    """
+    profiles = {}
+    missed = set()
+    with _lock:
+        for hostname in set(hostnames):
+            cached = _devices.get(hostname)
+            if cached and _is_fresh(cached[0]):
+                _devices.move_to_end(hostname)
+                profiles[hostname] = cached[1]
+            else:
+                missed.add(hostname)
+
+    if missed:
+        now = time.time()
+        found = Device.objects.filter(name__in=missed).select_related('platform', 'device_type__manufacturer',
+                                                                      'cluster')
+        with _lock:
+            for device in found:
+                profiles[device.name] = DeviceProfile(device)
+                _add_profile(profiles[device.name], now)
+    return profiles
+
+
+def get_devices(hostnames):
+    """ Get a devices objects from Netbox
+
+        :param hostnames: list of hostnames
+        :return: dict {hostname: object NetBox Device}
+    """
+    return {hostname: profile.device for hostname, profile in get_profiles(hostnames).items()}
+
+
+def get_profile(device):
+    """ Get a profile of device object
+
+        :param device: object NetBox Device
+        :return: DeviceProfile
+    """
+    with _lock:
+        cached = _devices.get(device.name)
+        if cached and cached[1].device is device and _is_fresh(cached[0]):
+            return cached[1]
+    # Device was got not from cache
+    profile = DeviceProfile(device)
+    with _lock:
+        _add_profile(profile, time.time())
+    return profile
+
+
+def invalidate_device(device):
+    """ Drop device from cache
+
+        :param device: object NetBox Device
+    """
+    _invalidate_device_id(device.pk, device.name)
+
+
+def _invalidate_device_id(pk, name=None):
+    with _lock:
+        for hostname, (_, cached) in list(_devices.items()):
+            if cached.device.pk == pk or hostname == name:
+                del _devices[hostname]
+
+
+def clear():
+    """ Drop all cached objects
+    """
+    global _vendors
+    with _lock:
+        _references.clear()
+        _vendors = None
+        _found_vendors.clear()
+        _devices.clear()
+
+
+def _device_changed(sender, instance, **kwargs):
+    invalidate_device(instance)
+
+
+def _reference_changed(sender, instance, **kwargs):
+    # Devices keep a related platform, type and manufacturer objects - drop it too
+    clear()
+
+
+def _devices_changed(sender, instance, **kwargs):
+    with _lock:
+        _devices.clear()
+
+
+def _custom_field_value_changed(sender, instance, **kwargs):
+    if instance.obj_type_id == ContentType.objects.get_for_model(Device).pk:
+        _invalidate_device_id(instance.obj_id)
+
+
+for _signal, _action in ((post_save, 'save'), (post_delete, 'delete')):
+    _signal.connect(_device_changed, sender=Device, dispatch_uid='collector_device_' + _action)
+    _signal.connect(_devices_changed, sender=Cluster, dispatch_uid='collector_cluster_' + _action)
+    _signal.connect(_devices_changed, sender=CustomField, dispatch_uid='collector_customfield_' + _action)
+    _signal.connect(_custom_field_value_changed, sender=CustomFieldValue,
+                    dispatch_uid='collector_customfieldvalue_' + _action)
+    for _model in (Manufacturer, Platform, DeviceRole, DeviceType, ClusterType):
+        _signal.connect(_reference_changed, sender=_model,
+                        dispatch_uid='collector_{}_{}'.format(_model.__name__.lower(), _action))
@@ -0,0 +1,107 @@
+from functools import partial
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from extras.constants import OBJECTCHANGE_ACTION_CREATE, OBJECTCHANGE_ACTION_UPDATE
+from extras.models import ObjectChange
+from utilities.utils import serialize_object
+from collector.settings import *
+import logging
+import threading
+import uuid
+
+logger = logging.getLogger('collector')
+
+# Objects, which are saved by bulk queries, do not send post_save signals,
+# so NetBox does not write it into changelog. Changes of these objects are collected while syncing
+# and written into changelog by one query after commit of device transaction
+
+# Author of changes, made by current thread
+_author = threading.local()
+
+
+def set_author(user=None, request_id=None):
+    """ Set author of changes, made by current thread
+
+    :param user: object User, None for queued jobs
+    :param request_id: UUID of request, new one if None
+    """
+    _author.user = user
+    _author.request_id = request_id or uuid.uuid4()
+
+
+def get_job_request_id(job_id):
+    """ Request id of queued job - same for all processes, which sync hosts of this job
+
+    :param job_id: Int
+    :return: UUID
+    """
+    return uuid.uuid5(uuid.NAMESPACE_URL, 'collector/jobs/{}'.format(job_id))
+
+
+def _get_author():
+    if getattr(_author, 'request_id', None) is None:
+        set_author()
+    return _author.user, _author.request_id
+
+
+def _write_changes(changes, user, request_id):
+    """ Write changes into changelog by one query
+
+    :param changes: list of tuples (object, action, related object)
+    :param user: object User or None
+    :param request_id: UUID
+    """
+    records = []
+    for obj, action, related in changes:
+        if obj.pk is None:
+            # Not all databases return ids from bulk insert
+            logger.debug("Cannot write changelog of %s without id", obj)
+            continue
+        records.append(ObjectChange(
+            user=user,
+            user_name=user.username if user else CHANGELOG_USERNAME,
+            request_id=request_id,
+            action=action,
+            changed_object_type=ContentType.objects.get_for_model(obj),
+            changed_object_id=obj.pk,
+            related_object_type=ContentType.objects.get_for_model(related) if related else None,
+            related_object_id=related.pk if related else None,
+            object_repr=str(obj)[:200],
+            object_data=serialize_object(obj),
+        ))
+    try:
+        ObjectChange.objects.bulk_create(records)
+    except Exception as e:
+        logger.error("Cannot write %s changes into changelog: %s", len(records), e)
+
+
+class ChangeLog(object):
+    """ Changes of objects, saved by bulk queries
+    """
+
+    def __init__(self):
+        self.changes = []
+
+    def created(self, objects, related=None):
+        """
+        :param objects: list of created objects
+        :param related: parent object, like a device of interface
+        """
+        self.changes.extend((obj, OBJECTCHANGE_ACTION_CREATE, related) for obj in objects)
+
+    def updated(self, objects, related=None):
+        """
+        :param objects: list of updated objects
+        :param related: parent object, like a device of interface
+        """
+        self.changes.extend((obj, OBJECTCHANGE_ACTION_UPDATE, related) for obj in objects)
+
+    def commit(self):
+        """ Write changes into changelog after commit of current transaction
+            If transaction is rolled back - nothing is written
+        """
+        if not CHANGELOG_ENABLED or not self.changes:
+            return
+        user, request_id = _get_author()
+        transaction.on_commit(partial(_write_changes, self.changes, user, request_id))
+        self.changes = []
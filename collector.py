@@ -1,102 +1,290 @@
-from dcim.models import Device, Interface, InventoryItem, Manufacturer, Platform, DeviceRole,Cable
+from dcim.models import Device, Interface, InventoryItem, Platform, DeviceRole,Cable
 from virtualization.models import Cluster, VirtualMachine, ClusterType
 from ipam.models import IPAddress
-from textfsm import clitable
+from collector.models import SyncDigest
+from collector import cache, changelog, ingest, metrics, parsers, regexes
+from textfsm import clitable, texttable
 from netaddr import IPNetwork
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import transaction
+from django.utils import timezone
 from dcim.constants import *
 from collector.settings import *
 from math import pow
-import ast
+from collections import OrderedDict
+from itertools import chain, islice
+import copy
+import hashlib
 import logging
+import os
 # import json
 import re
+import threading
+import time
+import textfsm
 
 
-# Class dummies for see the changes into objects
-class __TempVm:
-    def __init__(self, name):
-        self.name = name
-        self.status = DEVICE_STATUS_OFFLINE
-        self.cluster_id = None
-        self.platform_id = None
-        self.role_id = None
-        self.memory = 0
-        self.vcpus = 0
-        self.comments = ""
-        self.disk = 0
-
-    def __str__(self):
-        return self.name
+# Init logginig settings
+logger = logging.getLogger('collector')
+logging.config.dictConfig(LOGGING_CONFIG)
 
 
-class __TempDevice:
-    pass
+# Compiled TextFSM templates: {path: (mtime, TextFSM object)}
+_templates = {}
+_templates_lock = threading.Lock()
 
 
-def _diff_objects(source, dest):
+def _clone_template(fsm):
+    """ Make a copy of compiled template for one parse
 
-    src_param = source.__dict__
-    dst_param = dest.__dict__
+        States and rules are not changed while parsing and are shared with original,
+        values and its options keep a parsing state, so only they are copied
 
-    logger.debug("First object parameters is: {}".format(src_param))
+        :param fsm: TextFSM object
+        :return: TextFSM object
+    """
+    clone = copy.copy(fsm)
+    clone.values = []
+    for value in fsm.values:
+        value_copy = copy.copy(value)
+        value_copy.fsm = clone
+        value_copy.options = []
+        for option in value.options:
+            option_copy = copy.copy(option)
+            option_copy.value = value_copy
+            value_copy.options.append(option_copy)
+        clone.values.append(value_copy)
+    clone.Reset()
+    return clone
+
+
+def _get_template(path):
+    """ Get compiled TextFSM template from cache
+
+        Template file is read and compiled only once per process
+        or when it was changed
+
+        :param path: String, path to template file
+        :return: TextFSM object, ready for parsing
+    """
+    mtime = os.path.getmtime(path)
+    cached = _templates.get(path)
+    if cached is None or cached[0] != mtime:
+        with _templates_lock:
+            cached = _templates.get(path)
+            if cached is None or cached[0] != mtime:
+                logger.info("Compiling template %s", path)
+                with open(path) as template_file:
+                    cached = (mtime, textfsm.TextFSM(template_file))
+                for state, rule, problems in regexes.check_template(cached[1]):
+                    logger.warning("Template %s, state %s: rule %s can be slow - %s", path, state, rule,
+                                   "; ".join(problems))
+                _templates[path] = cached
+    return _clone_template(cached[1])
+
+
+def _parse_text(fsm, text):
+    """ Same as TextFSM.ParseText, but with limits for a broken or hostile output
+
+        Too long lines are cut to MAX_LINE_LENGTH, so one line cannot make
+        a backtracking of template regexes too long.
+        Parsing is stopped with error, if it takes more than PARSE_TIME_LIMIT seconds -
+        time is checked between lines, a match of one line is not interrupted
+
+        :param fsm: TextFSM object
+        :param text: String, command output
+        :return: list of records
+    """
+    deadline = time.perf_counter() + PARSE_TIME_LIMIT if PARSE_TIME_LIMIT else None
+    for number, line in enumerate(text.splitlines() if text else [], 1):
+        if MAX_LINE_LENGTH and len(line) > MAX_LINE_LENGTH:
+            logger.warning("Line %s is longer than %s chars - cut it", number, MAX_LINE_LENGTH)
+            line = line[:MAX_LINE_LENGTH]
+        # Same as TextFSM.ParseText does for every line
+        fsm._CheckLine(line)
+        if fsm._cur_state_name in ('End', 'EOF'):
+            break
+        if deadline and time.perf_counter() > deadline:
+            raise textfsm.TextFSMError("Parsing takes more than {} seconds - stopped on line {}".format(
+                PARSE_TIME_LIMIT, number))
+    # Only finishes parsing - appends last record on EOF
+    return fsm.ParseText('')
+
+
+class CollectorTable(clitable.CliTable):
+    """ CliTable with a precompiled dispatch of index file rows
+
+        Index rows are compiled once on index reading,
+        lookups of (vendor, command) -> (template, function) are memoized.
+        Templates with a native parser in "Parser" column are parsed by it
+    """
 
-    diff_fields = set(src_param) ^ set(dst_param)
+    def __init__(self, index_file=None, template_dir=None):
+        self.index_mtime = None
+        self._dispatch_rows = []
+        self._dispatch_cache = {}
+        self._native_parsers = {}
+        super(CollectorTable, self).__init__(index_file, template_dir)
+
+    def ReadIndex(self, index_file=None):
+        """ Read index file and compile dispatch rows from it
+        """
+        super(CollectorTable, self).ReadIndex(index_file)
+        self.index_mtime = os.path.getmtime(self.index_path)
+
+        rows = []
+        native_parsers = {}
+        # Compiled table have same rows as original, but with compiled regexes
+        for row, compiled in zip(self.index.index, self.index.compiled):
+            rows.append((compiled['Vendor'], compiled['Command'], row['Template'], row['Function']))
+            parser_name = row.get('Parser')
+            if parser_name:
+                native_parser = getattr(parsers, parser_name, None)
+                if native_parser:
+                    native_parsers[row['Template']] = native_parser
+                else:
+                    logger.error("Cannot find native parser %s for template %s", parser_name, row['Template'])
+        self._dispatch_rows = rows
+        self._dispatch_cache = {}
+        self._native_parsers = native_parsers
 
-    result_dict = {key: dst_param.get(key) for key in dst_param if key not in diff_fields}
+    @property
+    def index_path(self):
+        return os.path.join(self.template_dir, self.index_file)
 
-    logger.debug("Second object parameters is: {}".format(result_dict))
+    def reload_index(self):
+        """ Re-read index file if it was changed since last read
 
-    if result_dict == src_param:
-        return 1
-    else:
-        return 0
+            :return: True if index was reloaded
+        """
+        try:
+            mtime = os.path.getmtime(self.index_path)
+        except OSError as e:
+            logger.error("Cannot check index file %s: %s", self.index_path, e)
+            return False
+        if mtime == self.index_mtime:
+            return False
+
+        logger.info("Index file %s was changed - reloading it", self.index_path)
+        with self._lock:
+            # Index is shared between all tables, drop it only if nobody reload it yet
+            if self.INDEX.get(self.index_path) is self.index:
+                del self.INDEX[self.index_path]
+            self.ReadIndex()
+        return True
+
+    def ParseCmd(self, cmd_input, attributes=None, templates=None):
+        """ Same as CliTable.ParseCmd, but uses cached compiled templates
+            instead of reading template files on every parse
+        """
+        self.raw = cmd_input
+
+        if not templates:
+            row_idx = self.index.GetRowMatch(attributes)
+            if row_idx:
+                templates = self.index.index[row_idx]['Template']
+            else:
+                raise clitable.CliTableError('No template found for attributes: "%s"' % attributes)
+
+        template_files = [os.path.join(self.template_dir, name) for name in templates.split(':')]
+
+        # Re-initialise the table.
+        self.Reset()
+        self._keys = set()
+        self.table = self._ParseCmdItem(self.raw, template_file=template_files[0])
+
+        # Add additional columns from any additional tables.
+        for template_file in template_files[1:]:
+            self.extend(self._ParseCmdItem(self.raw, template_file=template_file), set(self._keys))
+
+    def _ParseCmdItem(self, cmd_input, template_file=None):
+        """ Parse command output with cached template
+
+            :param cmd_input: String, command output
+            :param template_file: String, path to template file
+            :return: TextTable object
+        """
+        fsm = _get_template(template_file)
+        if not self._keys:
+            self._keys = set(fsm.GetValuesByAttrib('Key'))
+
+        table = texttable.TextTable()
+        table.header = fsm.header
+
+        for record in _parse_text(fsm, cmd_input):
+            table.Append(record)
+        return table
+
+    def ParseRecords(self, cmd_input, attributes=None, templates=None):
+        """ Parse command output into list of dicts {value name: value}
+
+            Unlike ParseCmd, values are not converted into strings,
+            so List values with named groups are returned as list of dicts
+
+            :param cmd_input: String, command output
+            :param attributes: dict, attributes for find template in index
+            :param templates: String, template from index file
+            :return: list of dicts
+        """
+        if not templates or ':' in templates:
+            # Results of many templates should be merged by table
+            with metrics.stage('parse'):
+                self.ParseCmd(cmd_input, attributes, templates)
+            with metrics.stage('convert'):
+                keys = self.header.values
+                return [dict(zip(keys, row)) for row in self]
+
+        self.raw = cmd_input
+        native_parser = self._native_parsers.get(templates) if NATIVE_PARSERS else None
+        if native_parser:
+            with metrics.stage('parse'):
+                return native_parser(cmd_input)
+
+        with metrics.stage('parse'):
+            fsm = _get_template(os.path.join(self.template_dir, templates))
+            records = _parse_text(fsm, cmd_input)
+        with metrics.stage('convert'):
+            keys = fsm.header
+            return [dict(zip(keys, record)) for record in records]
+
+    def get_dispatch(self, vendor, command):
+        """ Find template and process function name for vendor and command
+
+            :param vendor: String
+            :param command: String
+            :return: tuple (template, function name) or (None, None)
+        """
+        key = (vendor, command)
+        try:
+            return self._dispatch_cache[key]
+        except KeyError:
+            pass
 
+        result = (None, None)
+        for vendor_regex, command_regex, template, function in self._dispatch_rows:
+            if vendor_regex.match(vendor) and command_regex.match(command):
+                result = (template, function)
+                break
 
-# Init logginig settings
-logger = logging.getLogger('collector')
-logging.config.dictConfig(LOGGING_CONFIG)
+        if len(self._dispatch_cache) >= DISPATCH_CACHE_SIZE:
+            self._dispatch_cache.clear()
+        self._dispatch_cache[key] = result
+        return result
 
 
 def _get_process_function(parser, attrs):
-    """ 'Velosiped' for return function name from index file
-        I believe, will possible make it as another simple method
-        But now I cannot know how =\
+    """ Return template and process function for command from index file
 
-        :param parser: cli_table object
+        :param parser: CollectorTable object
         :param attrs: dict {"Command": "some_command", "Vendor": some_vendor}
-        :return: function or None
-    """
-    index = parser.index.index
-    keys = index.header.values
-    out = [dict(zip(keys, row)) for row in index]
-    command = attrs['Command']
-    vendor = attrs['Vendor']
-
-    for item in out:
-        if re.match(item['Vendor'], vendor) and re.match(item['Command'], command):
-            # Tries to find function to process this command
-            func = globals().get(item['Function'])
-            logger.info("Function is %s", func)
-            return func
-
-
-def _get_vendor(vendor_name):
-    """ Check if this Vendor present on Netbox
-
-        :param vendor_name: String
-        :rtype: object NetBox Manufacturer
+        :return: tuple (template, function) or (None, None)
     """
-    vendor_name = str(vendor_name).strip()
-    man = Manufacturer.objects.filter(name__icontains=vendor_name)
-    if man:
-        # Get only first...
-        logger.debug("Found a vendor {} - return it".format(vendor_name))
-        return man[0]
-    else:
-        logger.debug("Cannot a vendor {} - will be a NoName".format(vendor_name))
-        # TODO: Add a check for NoName is exists or create it
-        man = Manufacturer.objects.get(name = "--- NoName ---")
-        return man
+    with metrics.stage('dispatch'):
+        template, function = parser.get_dispatch(attrs['Vendor'], attrs['Command'])
+        # Tries to find function to process this command
+        func = globals().get(function) if function else None
+    logger.info("Function is %s", func)
+    return template, func
 
 
 def _get_device(hostname):
@@ -105,83 +293,203 @@ def _get_device(hostname):
     :param hostname: String hostname
     :return:  object NetBox Device
     """
-    try:
-        device = Device.objects.get(name=hostname)
-        return device
-    except Exception as e:
-        logger.error("Cannot get device. Error is: ".format(e))
-        return None
+    device = cache.get_devices([hostname]).get(hostname)
+    if not device:
+        logger.error("Cannot get device %s", hostname)
+    return device
+
+
+# Split interface name into type and number (Ethernet0/1 -> Ethernet, 0/1)
+_iface_name_regex = re.compile(r'([a-z\-]+)([\d/\.]+)', re.I)
 
 
-def _compare_interfaces(src_iface, dst_iface):
-    ''' This function compare shortest interface name
-        with longest interface name.
+def _split_interface_name(if_name):
+    """ Split interface name into lowercase type and number
 
         EXAMPLE:
-        eth0/1 should match Ethernet0/1
-    '''
-    regex = '([a-z\-]+)([\d/\.]+)'
-    regex = re.compile(regex, re.I)
+        Ethernet0/1 -> ('ethernet', '0/1')
+
+        :param if_name: String
+        :return: tuple (type, number) or None
+    """
+    match = _iface_name_regex.match(if_name)
+    if not match:
+        return None
+    iface_type, number = match.groups()
+    return iface_type.lower(), number
+
+
+def _interfaces_index(interfaces):
+    """ Make index for find interface by exact or short name
+
+        Short names of interface is all prefixes of its type with same number,
+        so eth0/1 and Ethernet0/1 both will match Ethernet0/1.
+        Prefix of several types (like a Eth for Ethernet0/1 and Eth-Trunk0/1) matches nothing
+
+        :param interfaces: list of NetBox Interface
+        :return: dict {name or (short type, number): Interface or None}
+    """
+    index = {}
+    types = []
+    for iface in interfaces:
+        parts = _split_interface_name(iface.name)
+        if parts:
+            iface_type, number = parts
+            types.append((parts, iface))
+            for i in range(1, len(iface_type)):
+                key = (iface_type[:i], number)
+                index[key] = None if key in index else iface
+    # Whole types and exact names have priority
+    for parts, iface in types:
+        index[parts] = iface
+    for iface in interfaces:
+        index[iface.name] = iface
+    return index
+
+
+def _connect_interfaces(interfaces):
+    """ Get ifaces connections from ifaces descriptions
+        Description should be like "server_asset_tag|port"
+
+        Servers and its interfaces are fetched once for all interfaces
+
+        :param interfaces: list of NetBox Interface
+        :return: count of new connections
+    """
+    links = []
+    for interface in interfaces:
+        asset_tag, separator, server_port = (interface.description or '').partition('|')
+        if not separator or not asset_tag:
+            logger.info("Incorrect or None description on interface %s - cannot connect anything", interface.name,
+                        extra={'device': interface.device_id})
+            continue
+        if interface.cable_id:
+            logger.debug("Interface %s already have a cable", interface.name, extra={'device': interface.device_id})
+            continue
+        links.append((interface, asset_tag, server_port))
+
+    if not links:
+        return 0
+
+    servers = {}
+    for server in Device.objects.filter(asset_tag__in=set(asset_tag for _, asset_tag, _ in links)):
+        servers[server.asset_tag] = server
+
+    server_ifaces = {}
+    for iface in Interface.objects.filter(device__in=list(servers.values())):
+        server_ifaces.setdefault(iface.device_id, []).append(iface)
+    indexes = {device_id: _interfaces_index(ifaces) for device_id, ifaces in server_ifaces.items()}
+
+    count = 0
+    used_ports = set()
+    for interface, asset_tag, server_port in links:
+        server = servers.get(asset_tag)
+        if not server:
+            logger.warning("Cannot find server by AssetTag %s", asset_tag)
+            continue
+
+        index = indexes.get(server.pk, {})
+        port = index.get(server_port) or index.get(_split_interface_name(server_port))
+        if not port:
+            logger.warning("Cannot found interface %s on server %s", server_port, server.name)
+            continue
+        if port.cable_id or port.pk in used_ports:
+            logger.debug("Interface %s on server %s already have a cable", port.name, server.name)
+            continue
+
+        cable = Cable()
+        cable.termination_a = interface
+        cable.termination_b = port
+        try:
+            # Savepoint - error of one cable should not break transaction of device
+            with transaction.atomic():
+                cable.save()
+        except Exception as e:
+            logger.error("Cannot do a connection %s to %s on %s - error is %s", interface.name, server.name,
+                         server_port, e)
+            continue
+        used_ports.add(port.pk)
+        count += 1
+        logger.info("Successfully connected interface %s to server %s on port %s", interface.name, server.name,
+                    port.name)
+    return count
+
+
+def _has_field(obj, field_name):
     try:
-        src_name, src_number = regex.match(src_iface).groups()
-        dst_name, dst_number = regex.match(dst_iface).groups()
-    except:
+        obj._meta.get_field(field_name)
+        return True
+    except FieldDoesNotExist:
         return False
 
-    nameMatch = src_name.lower().startswith(dst_name.lower())
-    return ((src_number == dst_number) and nameMatch)
-
 
-def _connect_interface(interface):
-    ''' Get iface connection from iface description
-        Description should be like "server|port"
-    '''
-    desc_regex = "^(.*)+\|(.*)+"
-    desc_regex = re.compile(desc_regex)
+def _update_fields(obj, values):
+    """ Set a new values into object fields and find changed fields
+        Values are converted into field type before compare.
+        If something was changed, "last_updated" of change logged models is changed too -
+        bulk_update() and save(update_fields) do not fill auto_now fields, which are not listed
 
-    iface_descr = interface.description
+        :param obj: Django model object
+        :param values: dict {field name: new value}
+        :return: list of changed fields names
+    """
+    changed = []
+    for field_name, value in values.items():
+        field = obj._meta.get_field(field_name)
+        try:
+            value = field.to_python(value)
+        except ValidationError:
+            pass
+        if getattr(obj, field.attname) != value:
+            setattr(obj, field.attname, value)
+            changed.append(field.name)
+    if changed and _has_field(obj, 'last_updated'):
+        obj.last_updated = timezone.now()
+        changed.append('last_updated')
+    return changed
+
+
+def _save_changes(obj, values):
+    """ Update object fields and save it only if something was changed
+
+        :param obj: Django model object
+        :param values: dict {field name: new value}
+        :return: list of changed fields names
+    """
+    changed = _update_fields(obj, values)
+    if changed:
+        obj.save(update_fields=changed)
+    return changed
 
-    if desc_regex.match(iface_descr):
-        asset_tag, server_port = iface_descr.split('|')
 
-        server = Device.objects.filter(asset_tag = asset_tag)
-        if server:
-            server = server[0]
-            server_name = server.name
+def _bulk_update(model, changed_objects):
+    """ Save only changed fields of objects
+        Objects are saved without signals, as bulk_update does - changes are written by changelog
 
-            # Find and compare ports
-            for iface in server.interfaces.all():
-                if _compare_interfaces(iface.name, server_port):
-                    port = iface
-                else:
-                    port = None
-
-            port = server.interfaces.filter(name = server_port)
-            if port:
-                cable = Cable()
-                cable.termination_a = interface
-                cable.termination_b = port[0]
-                try:
-                    cable.save()
-                except Exception as e:
-                    logger.error("Cannot do a connection {} to {} on {} - error is {}".format(interface.name, server_name, server_port, e))
-                    return
-                logger.info("Successfully connected interface {} to server {} on port {}".format(interface.name, server_name, server_port))
-            else:
-                logger.warning("Cannot found interface {} on server {}".format(server_port, server_name))
-        else:
-            logger.warning("Cannot find server by AssetTag {}".format(asset_tag))
+        :param model: Django model class
+        :param changed_objects: list of tuples (object, list of changed fields)
+    """
+    if not changed_objects:
+        return
+    # bulk_update is present only in Django 2.2+
+    if hasattr(model.objects, 'bulk_update'):
+        fields = set(field for _, changed in changed_objects for field in changed)
+        model.objects.bulk_update([obj for obj, _ in changed_objects], fields)
     else:
-        logger.info("Incorrect or None description on interface {} - cannot connect anything".format(interface.name))
+        for obj, changed in changed_objects:
+            attnames = [model._meta.get_field(field).attname for field in changed]
+            model.objects.filter(pk=obj.pk).update(**{attname: getattr(obj, attname) for attname in attnames})
+
+
+_virtual_regex = re.compile(VIRTUAL_REGEX)
+_portchannel_regex = re.compile(PORTCHANNEL_REGEX)
 
 
 def _get_interface_type(if_name):
     ''' Determine iface type (simple)
     '''
-    v_regex = re.compile(VIRTUAL_REGEX)
-    p_regex = re.compile(PORTCHANNEL_REGEX)
-    if v_regex.match(if_name) == None:
-        if p_regex.match(if_name) == None:
+    if _virtual_regex.match(if_name) == None:
+        if _portchannel_regex.match(if_name) == None:
             return IFACE_FF_1GE_FIXED # no way how to properly determine interface type =(
         else:
             return IFACE_FF_LAG
@@ -196,7 +504,7 @@ def _return_command_list(parser):
     result = {}
 
     for item in out:
-        logger.debug("Find command: {}".format(item.get('Command')))
+        logger.debug("Find command: %s", item.get('Command'))
         result[item.get('Command')] = item.get('Description')
 
     return True, result
@@ -207,10 +515,15 @@ def init_parser():
     Init CliTable index and templates
         This function should be call first, before parsing
 
-        :return: cliTable object or None
+        :return: CollectorTable object or None
     """
+    for name, regex in (('VIRTUAL_REGEX', VIRTUAL_REGEX), ('PORTCHANNEL_REGEX', PORTCHANNEL_REGEX)):
+        problems = regexes.check(regex)
+        if problems:
+            logger.warning("Setting %s can be slow - %s", name, "; ".join(problems))
+
     try:
-        parser = clitable.CliTable('index', TEMPLATES_DIRECTORY)
+        parser = CollectorTable('index', TEMPLATES_DIRECTORY)
         logger.info("Collector module loads: Im Alive!!!")
     except Exception as e:
         logger.error("Problem with parser init - check index file and templates directory. Error is %s", e)
@@ -218,16 +531,225 @@ def init_parser():
     return parser
 
 
+# CliTable keeps a parsing result inside itself, so every thread should have own parser
+_thread_parsers = threading.local()
+
+
+def get_parser():
+    """ Return a parser for current thread
+
+        Index file is read only once and shared between all parsers,
+        so creating a parser for new thread is cheap
+
+        :return: CollectorTable object or None
+    """
+    parser = getattr(_thread_parsers, 'parser', None)
+    if parser is None:
+        parser = init_parser()
+        _thread_parsers.parser = parser
+    return parser
+
+
+def _lock_device(device):
+    """ Lock row of device till the end of transaction
+
+        Device can be synced by API requests and by several worker processes at once,
+        sharding of hosts works only inside one worker - other syncs of this device wait for lock
+
+    :param device: object NetBox Device
+    """
+    list(Device.objects.select_for_update().filter(pk=device.pk).values_list('pk', flat=True))
+
+
+def _sync_host(parser, device, command, data, template, process_function):
+    """ Parse one command output and sync it into device
+
+    :param parser: CollectorTable object
+    :param device: object NetBox Device
+    :param command: String
+    :param data: String, raw command output
+    :param template: String, template from index file
+    :param process_function: function for syncing parsed result
+    :return: Bool,String
+    """
+    attrs = {"Command": command, "Vendor": cache.get_profile(device).vendor}
+
+    if not process_function:
+        logger.warning("Cannot found a process function. Parser Agrs: %s Device: %s", attrs, device)
+        return False, "Function for process this command or for this vendor is not implemented yet =("
+
+    # Its parsing time!
+    try:
+        logger.debug("_sync_host: Go to ParseRecords...")
+        # I will use a named indexes to prevent order changes
+        result = parser.ParseRecords(data, attrs, templates=template)
+    except Exception as e:
+        return False, "Error while parsing. {}".format(e)
+    logger.debug("_sync_host: Parser returns %s records", len(result))
+
+    if not result:
+        return False, "Cannot parse a command output - check template or command"
+
+    # Process It!
+    # All changes of device are saved by one transaction - device is never left half-synced,
+    # errors of single objects are rolled back to savepoints inside sync functions
+    try:
+        with metrics.stage(process_function.__name__), transaction.atomic():
+            _lock_device(device)
+            return process_function(device, result)
+    except Exception as e:
+        logger.error("Error while syncing %s on device %s: %s", command, device.name, e)
+        return False, "Error while syncing. {}".format(e)
+
+
+def _get_digest(data):
+    """ Digest of command output for detect not changed outputs
+
+    :param data: String
+    :return: String
+    """
+    return hashlib.sha1(str(data).encode('utf-8')).hexdigest()
+
+
+def _get_digests(entries):
+    """ Get digests of last synced outputs by one query
+
+    :param entries: list of tuples (hostname, command)
+    :return: dict {(hostname, command): object SyncDigest}
+    """
+    hostnames = set(hostname for hostname, _ in entries)
+    commands = set(command for _, command in entries)
+    digests = SyncDigest.objects.filter(hostname__in=hostnames, command__in=commands)
+    return {(item.hostname, item.command): item for item in digests}
+
+
+def _save_digests(digests, synced):
+    """ Save digests of successfully synced outputs
+
+    :param digests: dict {(hostname, command): object SyncDigest}, returned by _get_digests
+    :param synced: dict {(hostname, command): digest}
+    """
+    new_digests = []
+    try:
+        # All digests of batch are saved by one commit
+        with transaction.atomic():
+            for key, digest in synced.items():
+                item = digests.get(key)
+                if item:
+                    item.digest = digest
+                    item.save(update_fields=['digest', 'updated'])
+                else:
+                    new_digests.append(SyncDigest(hostname=key[0], command=key[1], digest=digest))
+            SyncDigest.objects.bulk_create(new_digests)
+    except Exception as e:
+        # Digest could be created by another request at the same time
+        logger.warning("Cannot save digests of synced outputs: %s", e)
+
+
+def sync_hosts(parser, hostlist, force=False):
+    """ Syncing a batch of hosts
+
+        Devices are fetched by one query, vendor and process function
+        are resolved once per (vendor, command) pair for whole batch.
+        Outputs, which are same as last synced output, are skipped
+
+    :param parser: CollectorTable object
+    :param hostlist: list of dicts {"hostname": ..., "command": ..., "data": ..., "force": Bool}
+    :param force: Bool, sync all outputs even if they were not changed
+    :return: list of dicts {"hostname": ..., "command": ..., "result": Bool, "detail": String}
+    """
+    entries = []
+    for host in hostlist:
+        try:
+            entries.append((host['hostname'], host['command'], host['data'], force or host.get('force')))
+        except Exception as e:
+            logger.error("One or all params in query failed. Detail: %s", e)
+            entries.append((None, None, None, None))
+
+    digests = {}
+    if DEDUPLICATE_OUTPUTS:
+        # Digests of forced outputs are needed too - for update it after sync
+        digests = _get_digests([(hostname, command) for hostname, command, _, _ in entries if hostname])
+
+    # {(hostname, command): digest} of successfully synced outputs
+    synced = {}
+    # Results of not changed outputs
+    skipped = {}
+    for index, (hostname, command, data, force) in enumerate(entries):
+        if hostname and DEDUPLICATE_OUTPUTS:
+            digest = _get_digest(data)
+            item = digests.get((hostname, command))
+            if not force and item and item.digest == digest:
+                logger.info("Output of %s on %s was not changed - skip it", command, hostname)
+                skipped[index] = (True, "Output was not changed since last sync - skipped")
+
+    profiles = cache.get_profiles(hostname for index, (hostname, _, _, _) in enumerate(entries)
+                                  if hostname and index not in skipped)
+    logger.debug("sync_hosts: Found %s devices for %s entries", len(profiles), len(entries))
+
+    functions = {}
+    results = []
+    for index, (hostname, command, data, force) in enumerate(entries):
+        if index in skipped:
+            result, detail = skipped[index]
+        elif hostname is None:
+            result, detail = False, "Cannot parse a query - check all parameters"
+        elif hostname not in profiles:
+            logger.warning("Cannot find device by hostname %s", hostname)
+            result, detail = False, "Not found device by hostname: {}".format(hostname)
+        else:
+            device = profiles[hostname].device
+            key = (profiles[hostname].vendor, command)
+            if key not in functions:
+                attrs = {"Command": command, "Vendor": key[0]}
+                logger.debug("sync_hosts: Will do it with next attrs: %s", attrs)
+                functions[key] = _get_process_function(parser, attrs)
+                logger.debug("sync_hosts: Found template and process function %s", functions[key])
+            template, process_function = functions[key]
+            result, detail = _sync_host(parser, device, command, data, template, process_function)
+            if result and DEDUPLICATE_OUTPUTS:
+                synced[(hostname, command)] = _get_digest(data)
+
+        results.append({"hostname": hostname,
+                        "command": command,
+                        "result": result,
+                        "detail": detail})
+
+    if synced:
+        _save_digests(digests, synced)
+    return results
+
+
+def query_result(results):
+    """ Make a query result from results of hosts
+
+        For one host returns result of this host,
+        for many hosts - list of results per each host
+
+    :param results: list of dicts, returned by sync_hosts
+    :return: Bool,String or Bool,List
+    """
+    if len(results) == 1:
+        return results[0]['result'], results[0]['detail']
+    return all(item['result'] for item in results), results
+
+
 def parse_query(parser, query):
     """ Parsing command output
 
-    :param parser: clitable object
-    :param query: Dict
-    :return: Bool,String
+        For a query with one host returns result of this host,
+        for batch query - returns list of results per each host
+
+    :param parser: CollectorTable object
+    :param query: Dict, "data" can be a list or an iterator of hosts
+    :return: Bool,String or Bool,List
     """
-    logger.debug("parse_query: Starting parse query, data is {}, type is {}".format(query, type(query)))
+    if logger.isEnabledFor(logging.DEBUG):
+        # Data can be huge - log only parameters of query
+        logger.debug("parse_query: Starting parse query, parameters are %s",
+                     {key: value for key, value in query.items() if key != 'data'})
 
-    action = query['action']
+    action = query.get('action')
 
     if not action:
         return False, "Not provided any actions"
@@ -237,54 +759,100 @@ def parse_query(parser, query):
         return _return_command_list(parser)
 
     elif action == 'sync':
-        hostlist = query['data']
+        hostlist = query.get('data')
+
+        if not hostlist:
+            return False, "Cannot parse a query - check all parameters"
+
+        if INDEX_AUTO_RELOAD:
+            parser.reload_index()
 
-        for host in hostlist:
+        # Hosts can be an iterator of streaming request - sync it by batches
+        results = []
+        hostlist = iter(hostlist)
+        while True:
             try:
-                command = host['command']
-                data = host['data']
-                hostname = host['hostname']
-            except Exception as e:
-                logger.error("One or all params in query failed. Detail: {}".format(e))
-                return False, "Cannot parse a query - check all parameters"
+                batch = list(islice(hostlist, SYNC_BATCH_SIZE))
+            except ingest.RequestError as e:
+                # Previous batches are already saved - theirs results are returned with error
+                e.results = results
+                raise
+            if not batch:
+                break
+            results.extend(sync_hosts(parser, batch, force=query.get('force')))
 
-            device = _get_device(hostname)
-            logger.debug("parse_query: Device is: {}".format(device))
+        if not results:
+            return False, "Cannot parse a query - check all parameters"
+        return query_result(results)
 
-            if not device:
-                return False, "Not found device by hostname: {}".format(hostname)
+    return False, "Unknown action: {}".format(action)
 
-            # Get Device Vendor (by platform or type)
-            if device.platform:
-                vendor = device.platform.name
-            else:
-                vendor = device.device_type.manufacturer.name
-
-            attrs = {"Command": command, "Vendor": vendor}
-            logger.debug("parse_query: Will do it with next attrs: {}".format(attrs))
-            process_function = _get_process_function(parser, attrs)
-            logger.debug("parse_query: Found process function {}".format(process_function))
-
-            if process_function:
-                # Its parsing time!
-                try:
-                    logger.debug("parse_query: Go to ParseCMD...")
-                    parser.ParseCmd(data, attrs)
-                except Exception as e:
-                    return False, "Error while parsing. {}".format(e)
-                # I will use a named indexes to prevent order changes
-                keys = parser.header.values
-                result = [dict(zip(keys, row)) for row in parser]
-                logger.debug("parse_query: Parser returns this: {}".format(result))
-
-                if result:
-                    # Process It!
-                    return process_function(device, result)
-                else:
-                    return False, "Cannot parse a command output - check template or command"
-            else:
-                logger.warning("Cannot found a process function. Parser Agrs: {} Device: {}".format(attrs, device))
-                return False, "Function for process this command or for this vendor is not implemented yet =("
+
+def _sync_addresses(device, synced, changes):
+    """ Syncing IP addresses of device interfaces
+
+        All device addresses are fetched by one query,
+        new addresses are created by one bulk insert
+
+        :param device: object NetBox Device
+        :param synced: list of tuples (Interface, list of addresses)
+        :param changes: ChangeLog object
+        :return: tuple (created count, unassigned count)
+    """
+    # Current addresses as {(interface id, address): ip id}
+    current = {}
+    for pk, iface_id, address in IPAddress.objects.filter(interface__device=device).values_list('pk',
+                                                                                               'interface_id',
+                                                                                               'address'):
+        current[(iface_id, str(IPNetwork(str(address))))] = pk
+
+    # bulk_create do not call save(), where NetBox fills address family
+    try:
+        IPAddress._meta.get_field('family')
+        has_family = True
+    except FieldDoesNotExist:
+        has_family = False
+
+    new_addresses = []
+    parsed = set()
+    for iface, ips in synced:
+        for address in ips or []:
+            try:
+                network = IPNetwork(address)
+            except Exception as e:
+                logger.warning("Cannot set address %s on interface %s: %s", address, iface.name, e)
+                continue
+            key = (iface.pk, str(network))
+            parsed.add(key)
+            if key in current:
+                continue
+            logger.info("Will add address %s on interface %s", network, iface.name, extra={'device': device.name})
+            addr = IPAddress(address=network, interface=iface)
+            if has_family:
+                addr.family = network.version
+            new_addresses.append(addr)
+
+    if new_addresses:
+        try:
+            with transaction.atomic():
+                IPAddress.objects.bulk_create(new_addresses)
+            changes.created(new_addresses)
+        except Exception as e:
+            logger.warning("Cannot save addresses on device %s: %s", device.name, e)
+            new_addresses = []
+
+    # Addresses, which are not present on synced interfaces anymore
+    stale = []
+    if UNASSIGN_STALE_ADDRESSES:
+        synced_ids = set(iface.pk for iface, _ in synced)
+        stale = [pk for key, pk in current.items() if key[0] in synced_ids and key not in parsed]
+        if stale:
+            logger.info("Will unassign %s stale addresses on device %s", len(stale), device.name)
+            IPAddress.objects.filter(pk__in=stale).update(interface=None)
+            if CHANGELOG_ENABLED:
+                changes.updated(IPAddress.objects.filter(pk__in=stale))
+
+    return len(new_addresses), len(stale)
 
 
 def sync_interfaces(device, interfaces):
@@ -304,16 +872,20 @@ def sync_interfaces(device, interfaces):
 
         :return: status: bool, message: string
     """
-    # Updated interface counter
-    count = 0
+    # Debug messages for every interface are sampled by device
+    log_extra = {'device': device.name}
 
-    # Init interfaces filter
-    iface_filter = device.cf().get('Interfaces filter')
-    try:
-        iface_regex = re.compile(iface_filter)
-    except Exception as e:
-        logger.warning("Cannot parse regex for interface filter: {}".format(e))
-        iface_regex = re.compile('.*')
+    # Interfaces filter
+    iface_regex = cache.get_profile(device).iface_regex
+
+    # All device interfaces by one query
+    device_ifaces = {iface.name: iface for iface in device.interfaces.all()}
+
+    new_ifaces = []
+    changed_ifaces = []
+    # List of tuples (interface, ip addresses) for syncing after saving
+    synced = []
+    changes = changelog.ChangeLog()
 
     for interface in interfaces:
         name = interface.get('NAME')
@@ -322,133 +894,203 @@ def sync_interfaces(device, interfaces):
         mtu = interface.get('MTU')
         description = interface.get('DESCR')
         iface_type = interface.get('TYPE')
-        iface_state = interface.get('STATE')
+        iface_state = interface.get('STATE') or ''
         # TODO: add a bonding support
         iface_master = interface.get('BOND')
 
         # Check interface filter
         if not iface_regex.match(name):
-            logger.debug("Iface {} not match with regex".format(name))
+            logger.debug("Iface %s not match with regex", name, extra=log_extra)
             continue
 
-        # Get interface from device - for check if exist
-        ifaces = device.interfaces.filter(name=name)
-        if ifaces:
-            logger.info("Interface {} is exist on device {}, will update".format(name, device.name))
-            # TODO: I think, that only one item will be in filter, but need to add check for it
-            iface = ifaces[0]
-        else:
-            logger.info("Interface {} is not exist on device {}, will create new".format(name, device.name))
-            iface = Interface(name=name)
-            iface.device = device
-
-        logger.info("Will be save next parameters: Name:{name}, MAC: {mac}, MTU: {mtu}, Descr: {description}".format(
-            name=name, mac=mac, mtu=mtu, description=description))
-        if description:
-            iface.description = description
-        else:
-            iface.description = ''
-        iface.mac_address = mac
+        logger.info("Will be save next parameters: Name:%s, MAC: %s, MTU: %s, Descr: %s, State: %s",
+                    name, mac, mtu, description, iface_state, extra=log_extra)
 
+        values = {
+            'description': description or '',
+            'mac_address': mac,
+            'enabled': 'up' in iface_state.lower(),
+            'form_factor': _get_interface_type(name),
+        }
         # MTU should be less 32767
-        if int(mtu) < MAX_MTU:
-            iface.mtu = mtu
+        if mtu and int(mtu) < MAX_MTU:
+            values['mtu'] = mtu
+
+        iface = device_ifaces.get(name)
+        if iface:
+            changed = _update_fields(iface, values)
+            if changed:
+                logger.info("Interface %s is exist on device %s, will update %s", name, device.name, changed,
+                            extra=log_extra)
+                changed_ifaces.append((iface, changed))
+            else:
+                logger.info("Interface %s is exist on device %s, nothing to change", name, device.name,
+                            extra=log_extra)
+        else:
+            logger.info("Interface %s is not exist on device %s, will create new", name, device.name,
+                        extra=log_extra)
+            iface = Interface(name=name, device=device)
+            _update_fields(iface, values)
+            new_ifaces.append(iface)
+            device_ifaces[name] = iface
 
-        logger.info("Interface state is {}".format(iface_state))
-        iface.enabled = 'up' in iface_state.lower()
-        iface.form_factor = _get_interface_type(name)
+        synced.append((iface, ips))
 
-        try:
-            iface.save()
-        except Exception as e:
-            logger.error("Cannot save interface, error is {}".format(e))
-        else:
-            count += 1
-            logger.info("Interface {} was succesfully saved".format(name, device.name))
+    try:
+        # Without savepoint - on error nothing is saved anyway
+        with transaction.atomic(savepoint=False):
+            Interface.objects.bulk_create(new_ifaces)
+            _bulk_update(Interface, changed_ifaces)
+        # Not all databases return ids from bulk insert
+        if new_ifaces and new_ifaces[0].pk is None:
+            ids = dict(device.interfaces.filter(name__in=[iface.name for iface in new_ifaces])
+                       .values_list('name', 'pk'))
+            for iface in new_ifaces:
+                iface.pk = ids.get(iface.name)
+    except Exception as e:
+        logger.error("Cannot save interfaces, error is %s", e)
+        return False, "Can't update any interface, see a log for details"
+    logger.info("Interfaces on device %s saved: %s created, %s updated", device.name, len(new_ifaces),
+                len(changed_ifaces))
+    changes.created(new_ifaces, related=device)
+    changes.updated([iface for iface, _ in changed_ifaces], related=device)
 
-        try:
-            _connect_interface(iface)
-        except:
-            logger.error("Problem with connection function")
-
-        # IP syncing
-        if len(ips) > 0:
-            for address in ips:
-                addr = IPAddress()
-                addr.interface = iface
-                logger.info("Address is: {}".format(addr))
-                # TODO: Need a test ipv6 addresses
-                try:
-                    # tries to determine is this address exist
-                    if iface.ip_addresses.filter(address=address):
-                        continue
-                    addr.address = IPNetwork(address)
-                    addr.save()
-                except:
-                    logger.warning("Cannot set address {} on interface".format(address))
-
-    if count == 0:
+    try:
+        _connect_interfaces([iface for iface, _ in synced])
+    except Exception as e:
+        logger.error("Problem with connection function: %s", e)
+
+    _sync_addresses(device, synced, changes)
+    changes.commit()
+
+    if not synced:
         return False, "Can't update any interface, see a log for details"
-    return True, "Successfully updated {} interfaces".format(count)
+    return True, "Successfully updated {} interfaces".format(len(synced))
 
 
 def sync_inventory(device, inventory):
     """ Syncing Inventory in NetBox
 
+        Discovered items of device are fetched by one query and compared with parsed items
+        by (name, serial): new items are created and changed items are updated by bulk queries
+
         :return: status: bool, message: string
     """
     logger.debug("sync_inventory: Running sync inventory")
-    is_changed = False
-
-    for item in inventory:
-        name = item['Name']
-        descr = item['Descr']
-        pid = item['PartID']
-        serial = item['Serial']
+    log_extra = {'device': device.name}
+
+    # Discovered items of device as {(name, serial): item}
+    current = {}
+    for item in InventoryItem.objects.filter(device=device, discovered=True):
+        current.setdefault((item.name, item.serial), item)
+
+    # Same vendor is in many rows (like a every DIMM) - find it once
+    vendors = {}
+    # Synced items as {(name, serial): item}
+    synced = OrderedDict()
+    new_items = []
+    changed_items = {}
+
+    for row in inventory:
+        name = row['Name']
+        descr = row['Descr']
+        pid = row['PartID']
+        serial = row['Serial']
         # Additional field to process name or device type
-        try:
-            case = item['Case']
-        except:
-            case = ''
-
         # Name or Case?
         if not name:
-            name = case
+            name = row.get('Case') or ''
 
         # Check if manufacturer is present
-        if 'Vendor' in item.keys():
-            if item['Vendor']:
-                manufacturer = _get_vendor(item['Vendor'])
-            else:
-                manufacturer = None
+        if 'Vendor' in row:
+            vendor = row['Vendor']
+            if vendor and vendor not in vendors:
+                vendors[vendor] = cache.get_vendor(vendor)
+            manufacturer = vendors.get(vendor)
         else:
             manufacturer = device.device_type.manufacturer
 
+        values = {
+            'manufacturer_id': manufacturer.pk if manufacturer else None,
+            'part_id': pid,
+            'description': descr,
+        }
+
         # Check, if this item exists (by device, name and serial)
-        item = InventoryItem.objects.filter(device=device, name=name, serial=serial, discovered=True)
+        key = (name, serial)
+        item = synced.get(key) or current.get(key)
         if item:
-            logger.info("Device {} already have a discovered item {}".format(device.name, name))
-            continue
+            changed = _update_fields(item, values)
+            if changed and item.pk:
+                logger.info("Item %s on device %s will be updated: %s", name, device.name, changed, extra=log_extra)
+                changed_items.setdefault(item.pk, (item, set()))[1].update(changed)
+            else:
+                logger.info("Device %s already have a discovered item %s", device.name, name, extra=log_extra)
         else:
-            logger.info("Tries to add a item {} on device {}".format(name, device.name))
-            item = InventoryItem()
-            item.manufacturer = manufacturer
-            item.name = name
-            item.part_id = pid
-            item.serial = serial
-            item.description = descr
-            item.device = device
-            item.discovered = True
-            try:
-                item.save()
-                is_changed = True
-            except Exception as e:
-                logger.warning(
-                    "Error to save Inventory item with name {} to device {}. Error is {}".format(name, device.name, e))
-    if is_changed:
+            logger.info("Tries to add a item %s on device %s", name, device.name, extra=log_extra)
+            item = InventoryItem(device=device, name=name, serial=serial, discovered=True)
+            _update_fields(item, values)
+            new_items.append(item)
+        synced[key] = item
+
+    changed_items = [(item, list(fields)) for item, fields in changed_items.values()]
+    to_save = len(new_items) + len(changed_items)
+    changes = changelog.ChangeLog()
+    saved = _save_inventory(device, new_items, changed_items, changes)
+    changes.commit()
+
+    # Items, which are not present on device anymore
+    stale = [item.pk for key, item in current.items() if key not in synced]
+    if stale and DELETE_STALE_INVENTORY:
+        logger.info("Will delete %s stale inventory items on device %s", len(stale), device.name)
+        InventoryItem.objects.filter(pk__in=stale).delete()
+        saved += len(stale)
+
+    if saved:
         return True, "Device {} synced successfully".format(device.name)
+    elif not to_save:
+        # All items already exist and were not changed - it is synced too
+        return True, "Device {} already synced - nothing to change".format(device.name)
     else:
-        return False, "Device {} was not synced. May be all items already exists?".format(device.name)
+        return False, "Device {} was not synced, see a log for details".format(device.name)
+
+
+def _save_inventory(device, new_items, changed_items, changes):
+    """ Save inventory items by bulk queries
+        If bulk query fails - items are saved one by one, so one bad item does not break others
+
+        :param device: object NetBox Device
+        :param new_items: list of InventoryItem objects
+        :param changed_items: list of tuples (InventoryItem, list of changed fields)
+        :param changes: ChangeLog object, items saved one by one are written into changelog by NetBox
+        :return: count of saved items
+    """
+    if not new_items and not changed_items:
+        return 0
+    try:
+        with transaction.atomic():
+            InventoryItem.objects.bulk_create(new_items)
+            _bulk_update(InventoryItem, changed_items)
+        changes.created(new_items, related=device)
+        changes.updated([item for item, _ in changed_items], related=device)
+        return len(new_items) + len(changed_items)
+    except Exception as e:
+        logger.warning("Cannot save inventory items of device %s by one query, will save it one by one: %s",
+                       device.name, e)
+
+    saved = 0
+    for item, fields in chain(((item, None) for item in new_items), changed_items):
+        if fields is None:
+            # Object can get a pk from failed bulk insert
+            item.pk = None
+        try:
+            with transaction.atomic():
+                item.save(update_fields=fields)
+            saved += 1
+        except Exception as e:
+            logger.warning("Error to save Inventory item with name %s on device %s. Error is %s",
+                           item.name, device.name, e)
+    return saved
 
 
 def sync_vms(device, vms):
@@ -461,40 +1103,49 @@ def sync_vms(device, vms):
     if not vms:
         return False, "There is no VM to update"
 
+    log_extra = {'device': device.name}
+
     # TODO: cluster tenancy
-    cluster = device.cluster
+    cluster = cache.get_profile(device).cluster
     if not cluster:
         # Will create a new cluster
-        logger.debug("Creating a new cluster {}".format(device.name))
+        logger.debug("Creating a new cluster %s", device.name)
         cluster = Cluster()
         cluster.name = device.name
-        cluster.type = ClusterType.objects.get(name=DEFAULT_CLUSTER_TYPE)
+        cluster.type = cache.get_reference(ClusterType, DEFAULT_CLUSTER_TYPE)
         cluster.site = device.site
-        logger.debug("Saving a cluster {}".format(device.name))
+        logger.debug("Saving a cluster %s", device.name)
         cluster.save()
         cluster.devices.add(device)
         cluster.save()
-        logger.debug("Device was added to cluster {}".format(device.name))
+        # Device was updated by query - cached object has no cluster
+        cache.invalidate_device(device)
+        logger.debug("Device was added to cluster %s", device.name)
+
+    changes = changelog.ChangeLog()
 
     # Determine non-exists VMs and put it offline
     new_vm_names = [ vm_data['NAME'] for vm_data in vms]
     if new_vm_names:
-        logger.debug("New VMS: {}".format(new_vm_names))
-        non_exist_vms = VirtualMachine.objects.filter(cluster_id=cluster.id).exclude(name__in = new_vm_names)
-        logger.debug("VM which located in netbox, but non-exist on current cluster: {}".format(non_exist_vms))
-
-        if non_exist_vms:
-            for vm in non_exist_vms:
-                if vm.status != DEVICE_STATUS_STAGED:
-                    vm.status = DEVICE_STATUS_STAGED
-                    # vm.comments = vm.comments + "\n\nVM not exist on current cluster!\n"
-                    vm.save()
+        logger.debug("New VMS: %s", new_vm_names)
+        non_exist_vms = VirtualMachine.objects.filter(cluster_id=cluster.id).exclude(name__in=new_vm_names)
+        non_exist_vms = non_exist_vms.exclude(status=DEVICE_STATUS_STAGED)
+        staged = list(non_exist_vms.values_list('pk', flat=True)) if CHANGELOG_ENABLED else []
+        count = non_exist_vms.update(status=DEVICE_STATUS_STAGED)
+        logger.debug("VM which located in netbox, but non-exist on current cluster: %s", count)
+        if staged:
+            changes.updated(VirtualMachine.objects.filter(pk__in=staged))
 
     # TODO: role and platform
     # By default all VMS - is a linux VMs
-    platform = Platform.objects.get(name='Linux')
+    platform = cache.get_reference(Platform, 'Linux')
     # with server roles
-    role = DeviceRole.objects.get(name='Server')
+    role = cache.get_reference(DeviceRole, 'Server')
+
+    # VM names are unique, so VMs moved from other cluster will be found too
+    current_vms = {vm.name: vm for vm in VirtualMachine.objects.filter(name__in=new_vm_names)}
+    new_vms = []
+    changed_vms = []
 
     # TODO: Need a get vm disks from vm objects
     # for vm_instance in vms:
@@ -502,63 +1153,53 @@ def sync_vms(device, vms):
 
     for vm_data in vms:
 
-        temp_vm = __TempVm(vm_data.get('NAME'))
+        vm_name = vm_data.get('NAME')
 
-        logger.debug("Will sync VM named: {}".format(temp_vm))
+        logger.debug("Will sync VM named: %s", vm_name, extra=log_extra)
 
-        temp_vm.cluster_id = cluster.id
-        temp_vm.platform_id = platform.id
-        temp_vm.role_id = role.id
-        temp_vm.memory = int(vm_data['MEM'])/1024 # its a simple method - we need a MB
-        temp_vm.vcpus = int(vm_data['VCPU'])
+        values = {
+            'cluster_id': cluster.id,
+            'platform_id': platform.id,
+            'role_id': role.id,
+            'memory': int(vm_data['MEM'])/1024,  # its a simple method - we need a MB
+            'vcpus': int(vm_data['VCPU']),
+            'status': DEVICE_STATUS_OFFLINE,
+        }
 
         # Determine VM state
         if int(vm_data['STATE']) == DEVICE_STATUS_ACTIVE:
-            temp_vm.status = DEVICE_STATUS_ACTIVE
+            values['status'] = DEVICE_STATUS_ACTIVE
 
         # get disks
         names = vm_data.get('DISKNAMES')
         sizes = vm_data.get('DISKSIZES')
         paths = vm_data.get('DISKPATHS')
 
-        # TODO: govnocode style - rewrite it for pythonic true way
-        # This code parse a strings, like "{'diskindex': 1, 'name': 'sda'}"
-        # Convert it to pythonic code
-        # and split to one dict
-        disks = []
-        total_size = 0
+        # Named groups in template return a dicts, like {'diskindex': '1', 'name': 'sda'}
+        # Join it by disk index into one dict per disk
+        disks = OrderedDict()
         for name in names:
-            name = ast.literal_eval(name)
-            temp = name.copy()
-            index = temp.get('diskindex')
-            for size in sizes:
-                size = ast.literal_eval(size)
-                size_index = size.get('diskindex')
-                if size_index == index:
-                    temp.update(size)
-            for path in paths:
-                path = ast.literal_eval(path)
-                path_index = path.get('diskindex')
-                if path_index == index:
-                    temp.update(path)
-            disks.append(temp)
-            del temp  # non-urgent
-
-        logger.info("Disks is: {}, len is {}".format(disks, len(disks)))
+            disks[name.get('diskindex')] = dict(name)
+        for item in chain(sizes, paths):
+            disk = disks.get(item.get('diskindex'))
+            if disk is not None:
+                disk.update(item)
+        disks = list(disks.values())
+        total_size = 0
+
+        logger.debug("Disks is: %s, len is %s", disks, len(disks), extra=log_extra)
 
         # Filling VM comments with Disk Section
         separator = SEPARATOR
 
+        vm = current_vms.get(vm_name)
+        logger.debug("found VM: %s", vm, extra=log_extra)
+
         # saving comments
         # TODO: fixing adding comments with multiple separator
-        # TODO: Change this
-        try:
-            original_comments = VirtualMachine.objects.get(name=temp_vm.name).comments
-        except:
-            logger.debug("Cannot find a VM for original comments")
-            original_comments = ""
+        original_comments = vm.comments if vm else ""
         try:
-            logger.debug("Tries to detect if comments exist")
+            logger.debug("Tries to detect if comments exist", extra=log_extra)
             comments = separator.join(original_comments.split(separator)[1:])
         except:
             logger.debug("Still no any other comments...")
@@ -568,54 +1209,40 @@ def sync_vms(device, vms):
         # and adding disks
         for disk in disks:
             try:
-                logger.debug("Size of disk {} is {}".format(disk.get('name'),disk.get('size')))
+                logger.debug("Size of disk %s is %s", disk.get('name'), disk.get('size'), extra=log_extra)
                 size = int(disk.get('size')) / pow(1024, 3)
                 disk_string += "**Disk:** {}\t**Size:** {} GB\t**Path:** {}\n".format(disk.get('name'),
                                                                                   int(size),
                                                                                   disk.get('path'))
                 total_size += size
             except Exception as e:
-                logger.warning("Cannot add disk {} - error is {}".format(disk.get('name'), e))
+                logger.warning("Cannot add disk %s - error is %s", disk.get('name'), e)
         disk_string += separator
-        temp_vm.comments = disk_string + comments
-        temp_vm.disk = int(total_size)
-
-        vm = VirtualMachine.objects.filter(name=temp_vm.name)
-
-        logger.debug("found VM: {}".format(vm))
-        logger.debug("VM Data: {}".format(vm.__dict__))
+        values['comments'] = disk_string + comments
+        values['disk'] = int(total_size)
 
         if vm:
-            logger.info("VM {} already exists. Will update this VM".format(temp_vm.name))
-            vm = vm[0]
-            if _diff_objects(temp_vm, vm) == 0:
-                vm.cluster_id = temp_vm.cluster_id
-                vm.status = temp_vm.status
-                vm.platform_id = temp_vm.platform_id
-                vm.role_id = temp_vm.role_id
-                vm.memory = temp_vm.memory
-                vm.vcpus = temp_vm.vcpus
-                vm.comments = temp_vm.comments
-                vm.disk = temp_vm.disk
-                vm.save()
-                logger.info("VM {} was updated".format(vm.name))
+            logger.info("VM %s already exists. Will update this VM", vm_name, extra=log_extra)
+            changed = _update_fields(vm, values)
+            if changed:
+                logger.info("VM %s will be updated: %s", vm_name, changed, extra=log_extra)
+                changed_vms.append((vm, changed))
             else:
-                logger.info("VM {} was not changed - nothing to change".format(temp_vm.name))
+                logger.info("VM %s was not changed - nothing to change", vm_name, extra=log_extra)
         else:
-            logger.info("VM {} is not exist. Will create new VM".format(temp_vm.name))
-            vm = VirtualMachine()
-            vm.name = temp_vm.name
-            vm.status = temp_vm.status
-            vm.cluster_id = temp_vm.cluster_id
-            vm.platform_id = temp_vm.platform_id
-            vm.role_id = temp_vm.role_id
-            vm.memory = temp_vm.memory
-            vm.vcpus = temp_vm.vcpus
-            vm.comments = temp_vm.comments
-            vm.disk = temp_vm.disk
-            vm.save()
-
-            logger.info("Saved new VM: {}".format(vm.name))
+            logger.info("VM %s is not exist. Will create new VM", vm_name, extra=log_extra)
+            vm = VirtualMachine(name=vm_name)
+            _update_fields(vm, values)
+            new_vms.append(vm)
+            current_vms[vm_name] = vm
+
+    with transaction.atomic(savepoint=False):
+        VirtualMachine.objects.bulk_create(new_vms)
+        _bulk_update(VirtualMachine, changed_vms)
+    logger.info("VMs on cluster %s saved: %s created, %s updated", cluster.name, len(new_vms), len(changed_vms))
+    changes.created(new_vms)
+    changes.updated([vm for vm, _ in changed_vms])
+    changes.commit()
 
     return True, "VMs successfully synced"
 
@@ -0,0 +1,240 @@
+from collector.settings import *
+from collector import metrics
+import codecs
+import gzip
+import json
+import logging
+
+# zstd is optional - only for agents, which send zstd-compressed bodies
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger('collector')
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+
+# Keys, which control processing of hosts - they should be before "data", which is read while syncing
+_CONTROL_KEYS = ('action', 'force', 'async')
+
+
+class RequestError(Exception):
+    """ Request body is too large or cannot be read
+
+        results - results of hosts, which were already synced, when error was found in the rest of body
+    """
+    results = ()
+
+
+class _LimitedReader(object):
+    """ Read a stream and fail, when more than limit bytes was read
+    """
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.size += len(data)
+        if self.size > self.limit:
+            raise RequestError("Request is too large - max size is {} bytes".format(self.limit))
+        return data
+
+
+class _JsonStream(object):
+    """ Incremental reader of JSON values from text stream
+    """
+
+    def __init__(self, stream, chunk_size=READ_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size):
+        """ Read at least size chars more into buffer
+
+        :return: False on end of stream
+        """
+        if self.eof:
+            return False
+        # Drop already parsed data
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        data = self.stream.read(max(size, self.chunk_size))
+        if not data:
+            self.eof = True
+            return False
+        self.buffer += data
+        return True
+
+    def peek(self):
+        """ Skip whitespaces and return next char or '' on end of stream
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill(self.chunk_size):
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise RequestError("Cannot parse a query - expected {!r} at {!r}".format(chars, char))
+        self.pos += 1
+        return char
+
+    def value(self, limit=None):
+        """ Read one JSON value
+
+        :param limit: max size of value in chars
+        :return: decoded value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                value, end = None, None
+            # Number or literal in the end of buffer can be not complete
+            if end is not None and (end < len(self.buffer) or self.eof):
+                if limit and end - self.pos > limit:
+                    raise RequestError("Query item is too large - max size is {} bytes".format(limit))
+                self.pos = end
+                return value
+
+            size = len(self.buffer) - self.pos
+            if limit and size > limit:
+                raise RequestError("Query item is too large - max size is {} bytes".format(limit))
+            # Read as much as already have - so big values are parsed for linear time
+            if not self._fill(size) and end is None:
+                raise RequestError("Cannot parse a query - invalid or incomplete JSON")
+
+
+def _iter_items(reader, limit):
+    """ Yield items of JSON array one by one
+    """
+    if reader.peek() == ']':
+        reader.pos += 1
+        return
+    while True:
+        # Item is processed out of decode stage
+        with metrics.stage('decode'):
+            item = reader.value(limit)
+            last = reader.expect(',]') == ']'
+        yield item
+        if last:
+            return
+
+
+def _open_body(request):
+    """ Return a text stream of request body, decompressed if needed
+    """
+    stream = request.stream
+    if stream is None:
+        return None
+
+    encoding = request.META.get('HTTP_CONTENT_ENCODING', '').lower().strip()
+    if encoding in ('', 'identity'):
+        pass
+    elif encoding in ('gzip', 'x-gzip'):
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    elif encoding == 'zstd':
+        if zstandard is None:
+            raise RequestError("zstd compressed requests are not supported - install zstandard module")
+        stream = zstandard.ZstdDecompressor().stream_reader(stream)
+    else:
+        raise RequestError("Unsupported Content-Encoding: {}".format(encoding))
+
+    # Limit is checked for decompressed body
+    stream = _LimitedReader(stream, MAX_REQUEST_SIZE)
+    return _TextReader(stream)
+
+
+class _TextReader(object):
+    """ Decode utf-8 stream by chunks
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def read(self, size):
+        while True:
+            data = self.stream.read(size)
+            text = self.decoder.decode(data, final=not data)
+            # Chunk can contain only a part of multibyte char
+            if text or not data:
+                return text
+
+
+def _read_keys(reader, query):
+    """ Read the rest keys of query object into query
+    """
+    while reader.expect(',}') == ',':
+        key = reader.value()
+        reader.expect(':')
+        query[key] = reader.value()
+
+
+def _iter_data(reader, query, items):
+    """ Yield items of "data" and then read keys after it
+
+        Hosts are already synced, when keys after "data" are read -
+        control keys are not allowed there, other keys (like a "timings") are added into query
+    """
+    for item in items:
+        yield item
+    keys = {}
+    _read_keys(reader, keys)
+    for key in _CONTROL_KEYS:
+        if keys.get(key) and keys[key] != query.get(key):
+            raise RequestError("Key {!r} should be before \"data\" - hosts were processed without it".format(key))
+    query.update(keys)
+
+
+def read_query(request):
+    """ Read query from request body
+
+        Items of "data" list are decoded one by one, while query is processed,
+        so whole body is never in memory at once.
+        Keys "action", "force" and "async" should be before "data",
+        other keys after "data" are read after its last item
+
+    :param request: DRF request
+    :return: Dict, where "data" is an iterator of host items
+    """
+    stream = _open_body(request)
+    if stream is None:
+        raise RequestError("Empty request")
+
+    reader = _JsonStream(stream)
+    reader.expect('{')
+    query = {}
+
+    if reader.peek() == '}':
+        return query
+
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'data' and reader.peek() == '[':
+            reader.pos += 1
+            items = _iter_items(reader, MAX_ITEM_SIZE)
+            if 'action' in query:
+                query['data'] = _iter_data(reader, query, items)
+                return query
+            # Action is after data - so cannot process items before reading it
+            query['data'] = list(items)
+        else:
+            query[key] = reader.value()
+
+        if reader.expect(',}') == '}':
+            return query
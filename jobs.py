@@ -0,0 +1,362 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.db import close_old_connections, connections, transaction
+from django.utils import timezone
+from collector.models import Job, JOB_STATUS_PENDING, JOB_STATUS_RUNNING, JOB_STATUS_COMPLETED, JOB_STATUS_FAILED
+from collector.settings import *
+from collector import changelog, collector
+import logging
+import json
+import multiprocessing
+import queue
+import threading
+import zlib
+
+logger = logging.getLogger('collector')
+
+
+def enqueue_query(query):
+    """ Save query into queue for processing by worker
+
+    :param query: Dict
+    :return: object Job
+    """
+    job = Job.objects.create(payload=json.dumps(query))
+    logger.info("Query was queued as job %s", job.pk)
+    return job
+
+
+def get_job_status(job):
+    """ Return job status for API
+
+    :param job: object Job
+    :return: Dict
+    """
+    status = {"job": job.pk,
+              "status": job.get_status_display(),
+              "created": job.created,
+              "started": job.started,
+              "finished": job.finished}
+    if job.result:
+        status.update(json.loads(job.result))
+    return status
+
+
+def claim_jobs(limit):
+    """ Get pending jobs and mark it as running
+        Jobs locked by another worker are skipped,
+        jobs running more than JOB_TIMEOUT seconds are returned into queue
+
+    :param limit: max count of jobs
+    :return: list of Job objects
+    """
+    with transaction.atomic():
+        if JOB_TIMEOUT:
+            # Jobs of crashed or killed worker are never finished
+            deadline = timezone.now() - timedelta(seconds=JOB_TIMEOUT)
+            requeued = Job.objects.filter(status=JOB_STATUS_RUNNING, started__lt=deadline).update(
+                status=JOB_STATUS_PENDING, started=None)
+            if requeued:
+                logger.warning("%s jobs were running more than %s seconds - returned into queue", requeued,
+                               JOB_TIMEOUT)
+        jobs = list(Job.objects.select_for_update(skip_locked=True)
+                    .filter(status=JOB_STATUS_PENDING).order_by('pk')[:limit])
+        if jobs:
+            now = timezone.now()
+            Job.objects.filter(pk__in=[job.pk for job in jobs]).update(status=JOB_STATUS_RUNNING, started=now)
+            for job in jobs:
+                job.status = JOB_STATUS_RUNNING
+                job.started = now
+    return jobs
+
+
+def finish_job(job, result, detail):
+    """ Save job result
+
+    :param job: object Job
+    :param result: Bool
+    :param detail: String or List
+    """
+    job.result = json.dumps({"result": result, "detail": detail})
+    job.status = JOB_STATUS_COMPLETED if result else JOB_STATUS_FAILED
+    job.finished = timezone.now()
+    job.save(update_fields=['result', 'status', 'finished'])
+    logger.info("Job %s finished, result is %s", job.pk, result)
+
+
+def run_job(job):
+    """ Process queued query
+
+    :param job: object Job
+    :return: Bool
+    """
+    changelog.set_author(request_id=changelog.get_job_request_id(job.pk))
+    try:
+        parser = collector.get_parser()
+        if not parser:
+            result, detail = False, "Collector parser is not initialized - see a log for details"
+        else:
+            result, detail = collector.parse_query(parser, json.loads(job.payload))
+    except Exception as e:
+        logger.error("Error while processing job %s: %s", job.pk, e)
+        result, detail = False, str(e)
+
+    finish_job(job, result, detail)
+    return result
+
+
+def get_shard(hostname, shards):
+    """ Shard of host - one device is always synced by same thread or process
+
+    :param hostname: String
+    :param shards: count of shards
+    :return: Int
+    """
+    return zlib.crc32(str(hostname or '').encode('utf-8')) % shards
+
+
+def _split_job(job, shards):
+    """ Split hosts of job by shards
+        Job with a broken query is finished as failed
+
+    :param job: object Job
+    :param shards: count of shards
+    :return: tuple (force, count of hosts, dict {shard: list of (host index, host)}) or None
+    """
+    try:
+        query = json.loads(job.payload)
+        hostlist = query.get('data') or []
+    except Exception as e:
+        finish_job(job, False, "Cannot parse a query: {}".format(e))
+        return None
+    if not hostlist:
+        finish_job(job, False, "Cannot parse a query - check all parameters")
+        return None
+
+    items = {}
+    for index, host in enumerate(hostlist):
+        hostname = host.get('hostname') if isinstance(host, dict) else None
+        items.setdefault(get_shard(hostname, shards), []).append((index, host))
+    return query.get('force'), len(hostlist), items
+
+
+def _sync_items(parser, job_id, items, force):
+    """ Sync hosts of one shard of job
+
+    :param parser: CollectorTable object or None
+    :param job_id: Int
+    :param items: list of tuples (host index, host)
+    :param force: Bool
+    :return: list of tuples (host index, host result)
+    """
+    changelog.set_author(request_id=changelog.get_job_request_id(job_id))
+    hostlist = [host for _, host in items]
+    try:
+        if not parser:
+            raise RuntimeError("Collector parser is not initialized - see a log for details")
+        if INDEX_AUTO_RELOAD:
+            parser.reload_index()
+        host_results = []
+        for start in range(0, len(hostlist), SYNC_BATCH_SIZE):
+            host_results.extend(collector.sync_hosts(parser, hostlist[start:start + SYNC_BATCH_SIZE], force=force))
+    except Exception as e:
+        logger.error("Error while processing job %s: %s", job_id, e)
+        host_results = [{"hostname": host.get('hostname') if isinstance(host, dict) else None,
+                         "command": host.get('command') if isinstance(host, dict) else None,
+                         "result": False,
+                         "detail": str(e)} for host in hostlist]
+    return [(index, result) for (index, _), result in zip(items, host_results)]
+
+
+def _run_shard_in_thread(tasks, pending, lock):
+    """ Sync all hosts of one shard by one thread
+        Job is finished by thread, which synced last shard of this job
+
+    :param tasks: list of tuples (job id, list of (host index, host), force)
+    :param pending: dict {job id: [job, host results, count of shards in progress]}
+    :param lock: Lock of pending
+    """
+    try:
+        parser = collector.get_parser()
+        for job_id, items, force in tasks:
+            items = _sync_items(parser, job_id, items, force)
+            with lock:
+                job, host_results, _ = pending[job_id]
+                for index, result in items:
+                    host_results[index] = result
+                pending[job_id][2] -= 1
+                finished = not pending[job_id][2]
+            if finished:
+                finish_job(job, *collector.query_result(host_results))
+    finally:
+        close_old_connections()
+
+
+def run_pending_jobs(concurrency=JOB_CONCURRENCY, limit=JOB_BATCH_SIZE):
+    """ Process pending jobs by pool of threads
+        Hosts are sharded by hostname between threads, as in ShardedPool,
+        so two threads never write the same device at once
+
+    :param concurrency: count of threads
+    :param limit: max count of jobs for one run
+    :return: count of processed jobs
+    """
+    jobs = claim_jobs(limit)
+    if not jobs:
+        return 0
+
+    logger.info("Will process %s jobs with concurrency %s", len(jobs), concurrency)
+    if concurrency > 1:
+        # {shard: list of (job id, list of (host index, host), force)}
+        tasks = {}
+        pending = {}
+        for job in jobs:
+            split = _split_job(job, concurrency)
+            if split is None:
+                continue
+            force, count, shards = split
+            pending[job.pk] = [job, [None] * count, len(shards)]
+            for shard, items in shards.items():
+                tasks.setdefault(shard, []).append((job.pk, items, force))
+        lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(_run_shard_in_thread, shard_tasks, pending, lock)
+                       for shard_tasks in tasks.values()]
+            for future in futures:
+                future.result()
+    else:
+        for job in jobs:
+            run_job(job)
+    return len(jobs)
+
+
+def delete_old_jobs(days=JOB_RETENTION_DAYS):
+    """ Delete finished jobs older than days
+
+    :param days: Int
+    :return: count of deleted jobs
+    """
+    deadline = timezone.now() - timedelta(days=days)
+    deleted, _ = Job.objects.filter(status__in=[JOB_STATUS_COMPLETED, JOB_STATUS_FAILED],
+                                    finished__lt=deadline).delete()
+    return deleted
+
+
+def _shard_worker(tasks, results):
+    """ Process of sharded pool
+        Every process has own parser with own templates and dispatch caches
+
+    :param tasks: Queue of tuples (job id, shard, list of (host index, host), force)
+    :param results: Queue of tuples (job id, shard, list of (host index, host result))
+    """
+    parser = collector.get_parser()
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        job_id, shard, items, force = task
+        try:
+            items = _sync_items(parser, job_id, items, force)
+        finally:
+            close_old_connections()
+        results.put((job_id, shard, items))
+    # Write queued log records - atexit handlers are not called in pool processes
+    logging.shutdown()
+
+
+class ShardedPool(object):
+    """ Pool of processes for processing jobs
+        Hosts are sharded by hostname, so one device is always synced by same process
+        and two processes never write the same device at once
+    """
+
+    def __init__(self, processes):
+        self.results = multiprocessing.Queue()
+        self.tasks = [multiprocessing.Queue() for _ in range(processes)]
+        self.workers = [None] * processes
+        for shard in range(processes):
+            self._start_worker(shard)
+
+    def _start_worker(self, shard):
+        # Processes should not share a database connections with parent
+        connections.close_all()
+        worker = multiprocessing.Process(target=_shard_worker, args=(self.tasks[shard], self.results))
+        worker.daemon = True
+        worker.start()
+        self.workers[shard] = worker
+
+    def get_shard(self, hostname):
+        return get_shard(hostname, len(self.workers))
+
+    def run_jobs(self, jobs):
+        """ Split jobs by shards and wait for results
+
+        :param jobs: list of Job objects
+        :return: count of processed jobs
+        """
+        # {job id: [job, host results, shards in progress]}
+        pending = {}
+        for job in jobs:
+            split = _split_job(job, len(self.workers))
+            if split is None:
+                continue
+            force, count, shards = split
+            pending[job.pk] = [job, [None] * count, set(shards)]
+            for shard, items in shards.items():
+                self.tasks[shard].put((job.pk, shard, items, force))
+
+        while pending:
+            try:
+                job_id, shard, items = self.results.get(timeout=JOB_POLL_INTERVAL)
+            except queue.Empty:
+                self._check_workers(pending)
+                continue
+
+            if job_id not in pending:
+                # Job was already failed by died process
+                continue
+            job, host_results, shards = pending[job_id]
+            for index, result in items:
+                host_results[index] = result
+            shards.discard(shard)
+            if not shards:
+                del pending[job_id]
+                finish_job(job, *collector.query_result(host_results))
+
+        return len(jobs)
+
+    def _check_workers(self, pending):
+        """ Restart dead processes and fail theirs jobs
+        """
+        for shard, worker in enumerate(self.workers):
+            if worker.is_alive():
+                continue
+            logger.error("Worker process for shard %s died with code %s - restarting it", shard, worker.exitcode)
+            for job_id in list(pending):
+                job, _, shards = pending[job_id]
+                if shard in shards:
+                    del pending[job_id]
+                    finish_job(job, False, "Worker process died while processing job")
+            # Tasks of died process are not valid anymore
+            self.tasks[shard] = multiprocessing.Queue()
+            self._start_worker(shard)
+
+    def close(self):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+def run_pending_jobs_sharded(pool, limit=JOB_BATCH_SIZE):
+    """ Process pending jobs by sharded pool of processes
+
+    :param pool: ShardedPool object
+    :param limit: max count of jobs for one run
+    :return: count of processed jobs
+    """
+    jobs = claim_jobs(limit)
+    if not jobs:
+        return 0
+    logger.info("Will process %s jobs by %s processes", len(jobs), len(pool.workers))
+    return pool.run_jobs(jobs)
@@ -0,0 +1,118 @@
+from logging.handlers import QueueListener, WatchedFileHandler
+import atexit
+import copy
+import logging
+import os
+import queue
+import threading
+
+
+class _QueueListener(QueueListener):
+
+    def enqueue_sentinel(self):
+        # Queue can be full - wait for a free place, records before stop are written anyway
+        self.queue.put(self._sentinel)
+
+
+class QueueTargetHandler(logging.Handler):
+    """ Non-blocking handler
+
+        Records are put into queue and are formatted and written
+        by target handler in separate thread, so sync requests do not wait for disk or console.
+        If queue is full - records are dropped
+    """
+
+    def __init__(self, target, queue_size=10000):
+        super(QueueTargetHandler, self).__init__()
+        self.target = target
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._start_lock = threading.Lock()
+        self._running = False
+        self._start()
+        atexit.register(self.close)
+
+    def _start(self):
+        self._pid = os.getpid()
+        self.queue = queue.Queue(self.queue_size)
+        self.listener = _QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+        self._running = True
+
+    def setFormatter(self, fmt):
+        # Records are formatted by listener thread
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Merge message with args now - args can be changed before record is written,
+        # but do not format time, traceback and so on in caller thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def emit(self, record):
+        # Listener thread is not copied into forked processes
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._start()
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        # Write all queued records before exit
+        if self._running and self._pid == os.getpid():
+            self._running = False
+            self.listener.stop()
+        self.target.close()
+        super(QueueTargetHandler, self).close()
+
+
+class QueueFileHandler(QueueTargetHandler):
+    """ Non-blocking file handler, file is reopened after logrotate
+    """
+
+    def __init__(self, filename, queue_size=10000):
+        super(QueueFileHandler, self).__init__(WatchedFileHandler(filename), queue_size)
+
+
+class QueueStreamHandler(QueueTargetHandler):
+    """ Non-blocking stream handler, writes into stderr by default
+    """
+
+    def __init__(self, stream=None, queue_size=10000):
+        super(QueueStreamHandler, self).__init__(logging.StreamHandler(stream), queue_size)
+
+
+class SamplingFilter(logging.Filter):
+    """ Pass only every N-th of repeated debug messages of one device
+
+        Filters only records with "device" in extra and DEBUG level,
+        like a messages for every interface or VM of device.
+        Records of changes (INFO and above) are always passed
+    """
+
+    def __init__(self, rate=1, max_keys=10000):
+        super(SamplingFilter, self).__init__()
+        self.rate = rate
+        self.max_keys = max_keys
+        self.counters = {}
+
+    def filter(self, record):
+        if self.rate <= 1 or record.levelno >= logging.INFO:
+            return True
+        device = getattr(record, 'device', None)
+        if device is None:
+            return True
+
+        key = (device, record.msg)
+        count = self.counters.get(key, 0)
+        if len(self.counters) >= self.max_keys:
+            self.counters.clear()
+        self.counters[key] = count + 1
+        return count % self.rate == 0
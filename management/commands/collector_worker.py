@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from collector.settings import *
+from collector import jobs
+import time
+
+
+class Command(BaseCommand):
+    help = "Process collector queries, queued by API"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=JOB_CONCURRENCY,
+                            help="Count of threads for processing jobs")
+        parser.add_argument('--processes', type=int, default=JOB_PROCESSES,
+                            help="Count of processes for processing jobs, hosts are sharded by hostname")
+        parser.add_argument('--interval', type=int, default=JOB_POLL_INTERVAL,
+                            help="How long (in seconds) wait for new jobs")
+        parser.add_argument('--once', action='store_true',
+                            help="Process pending jobs and exit")
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        processes = options['processes']
+
+        if processes > 1:
+            pool = jobs.ShardedPool(processes)
+            self.stdout.write("Collector worker started, processes: {}".format(processes))
+        else:
+            pool = None
+            self.stdout.write("Collector worker started, concurrency is {}".format(concurrency))
+
+        try:
+            while True:
+                if pool:
+                    count = jobs.run_pending_jobs_sharded(pool)
+                else:
+                    count = jobs.run_pending_jobs(concurrency)
+                if count:
+                    self.stdout.write("Processed {} jobs".format(count))
+                    continue
+
+                jobs.delete_old_jobs()
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            if pool:
+                pool.close()
@@ -0,0 +1,105 @@
+from contextlib import contextmanager
+from django.db import connection
+from collector.settings import *
+import threading
+import time
+
+# Stage metrics of this process: {stage: [count, seconds, queries, bucket counts]}
+_stages = {}
+_stages_lock = threading.Lock()
+
+# Timings of current request: {stage: {"count": ..., "seconds": ..., "queries": ...}}
+_request = threading.local()
+
+
+class _QueryCounter(object):
+    """ Database execute wrapper, which counts queries
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _observe(name, seconds, queries):
+    with _stages_lock:
+        item = _stages.get(name)
+        if item is None:
+            item = _stages[name] = [0, 0.0, 0, [0] * len(METRICS_BUCKETS)]
+        item[0] += 1
+        item[1] += seconds
+        item[2] += queries
+        for index, bound in enumerate(METRICS_BUCKETS):
+            if seconds <= bound:
+                item[3][index] += 1
+
+    timings = getattr(_request, 'timings', None)
+    if timings is not None:
+        item = timings.setdefault(name, {"count": 0, "seconds": 0.0, "queries": 0})
+        item["count"] += 1
+        item["seconds"] += seconds
+        item["queries"] += queries
+
+
+@contextmanager
+def stage(name):
+    """ Measure time and count of database queries of sync stage
+
+    :param name: String, stage name
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+
+    counter = _QueryCounter()
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(counter):
+            yield
+    finally:
+        _observe(name, time.perf_counter() - start, counter.count)
+
+
+def start_request():
+    """ Start collecting timings of stages for current request
+    """
+    _request.timings = {}
+
+
+def get_timings():
+    """ Stop collecting and return timings of current request
+
+    :return: dict {stage: {"count": ..., "seconds": ..., "queries": ...}}
+    """
+    timings = getattr(_request, 'timings', None) or {}
+    _request.timings = None
+    for item in timings.values():
+        item["seconds"] = round(item["seconds"], 6)
+    return timings
+
+
+def render():
+    """ Return metrics of this process in Prometheus text format
+
+    :return: String
+    """
+    with _stages_lock:
+        stages = sorted((name, item[0], item[1], item[2], list(item[3])) for name, item in _stages.items())
+
+    lines = ["# HELP collector_stage_seconds Time of collector sync stages",
+             "# TYPE collector_stage_seconds histogram"]
+    for name, count, seconds, _, buckets in stages:
+        for bound, bucket in zip(METRICS_BUCKETS, buckets):
+            lines.append('collector_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(name, bound, bucket))
+        lines.append('collector_stage_seconds_bucket{{stage="{}",le="+Inf"}} {}'.format(name, count))
+        lines.append('collector_stage_seconds_sum{{stage="{}"}} {}'.format(name, seconds))
+        lines.append('collector_stage_seconds_count{{stage="{}"}} {}'.format(name, count))
+
+    lines.append("# HELP collector_stage_queries_total Database queries of collector sync stages")
+    lines.append("# TYPE collector_stage_queries_total counter")
+    for name, _, _, queries, _ in stages:
+        lines.append('collector_stage_queries_total{{stage="{}"}} {}'.format(name, queries))
+    return "\n".join(lines) + "\n"
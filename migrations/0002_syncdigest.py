@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collector', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncDigest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('hostname', models.CharField(max_length=256)),
+                ('command', models.CharField(max_length=256)),
+                ('digest', models.CharField(max_length=64)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('hostname', 'command')},
+            },
+        ),
+    ]
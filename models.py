@@ -1,3 +1,47 @@
 from django.db import models
 
-# Create your models here.
+
+JOB_STATUS_PENDING = 1
+JOB_STATUS_RUNNING = 2
+JOB_STATUS_COMPLETED = 3
+JOB_STATUS_FAILED = 4
+JOB_STATUS_CHOICES = (
+    (JOB_STATUS_PENDING, 'Pending'),
+    (JOB_STATUS_RUNNING, 'Running'),
+    (JOB_STATUS_COMPLETED, 'Completed'),
+    (JOB_STATUS_FAILED, 'Failed'),
+)
+
+
+class Job(models.Model):
+    """ Collector query, queued for processing by worker
+    """
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    status = models.PositiveSmallIntegerField(choices=JOB_STATUS_CHOICES, default=JOB_STATUS_PENDING,
+                                              db_index=True)
+    # JSON of query and result
+    payload = models.TextField()
+    result = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['pk']
+
+    def __str__(self):
+        return 'Job {}'.format(self.pk)
+
+
+class SyncDigest(models.Model):
+    """ Digest of last successfully synced command output
+    """
+    hostname = models.CharField(max_length=256)
+    command = models.CharField(max_length=256)
+    digest = models.CharField(max_length=64)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('hostname', 'command')
+
+    def __str__(self):
+        return '{} {}'.format(self.hostname, self.command)
@@ -0,0 +1,145 @@
+import re
+
+# Native parsers of the most frequent commands
+#
+# Every parser returns same records as its TextFSM template (see "Parser" column of index file):
+# list of dicts {value name: value}, not matched values are '', List values are lists.
+# Rules of template are merged into one regex per kind of line with same order of alternatives,
+# so every line is matched once instead of trying every rule of template
+
+
+def _append(records, record, required=()):
+    """ Append record as TextFSM Record operation does and return new empty record
+
+        :param records: list of records
+        :param record: dict {value name: value or None}
+        :param required: names of Required values
+        :return: dict, empty record
+    """
+    empty = dict.fromkeys(record)
+    for name, value in record.items():
+        if isinstance(value, list):
+            empty[name] = []
+    if any(not record[name] for name in required):
+        return empty
+    if all(value is None or value == [] for value in record.values()):
+        return empty
+    records.append({name: '' if value is None else value for name, value in record.items()})
+    return empty
+
+
+# ip_a.template
+_ip_a_index = re.compile(r'(\d+):')
+_ip_a_header = re.compile(r'(\d+): (?P<NAME>\S+): \<(\S+)\> mtu (?P<MTU>\d+) ([\w\s\d-]+) state '
+                          r'(?P<STATE>(UP|DOWN|UNKNOWN){1})'
+                          r'|(\d+): (?P<M_NAME>\S+): \<(\S+)\> mtu (?P<M_MTU>\d+) ([\w\s\d-]+) master (?P<BOND>\S+) '
+                          r'state (?P<M_STATE>(UP|DOWN|UNKNOWN){1})')
+_ip_a_line = re.compile(r'(\s+)link/([\w\s]+) (?P<MAC>([a-fA-F0-9]{2}[:|\-]?){6}) brd (.*)'
+                        r'|(\s+)inet (?P<IP>(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})(\/\d+))')
+
+
+def ip_a(text):
+    """ Parse Linux 'ip a[ddress]' output
+
+        :param text: String, command output
+        :return: list of dicts, same as ip_a.template returns
+    """
+    records = []
+    record = {'NAME': None, 'MAC': None, 'IP': [], 'MTU': None, 'STATE': None, 'BOND': None}
+    for line in text.splitlines():
+        if not line:
+            continue
+        if line[0].isspace():
+            match = _ip_a_line.match(line)
+            if match:
+                if match.group('MAC') is not None:
+                    record['MAC'] = match.group('MAC')
+                else:
+                    record['IP'].append(match.group('IP'))
+        else:
+            match = _ip_a_header.match(line)
+            # "N: iface" line starts a new interface
+            if match or _ip_a_index.match(line):
+                record = _append(records, record)
+            if match:
+                if match.group('NAME') is not None:
+                    record['NAME'], record['MTU'], record['STATE'] = match.group('NAME', 'MTU', 'STATE')
+                else:
+                    record['NAME'], record['MTU'], record['STATE'], record['BOND'] = match.group(
+                        'M_NAME', 'M_MTU', 'M_STATE', 'BOND')
+    _append(records, record)
+    return records
+
+
+# lsblk.template
+_lsblk_line = re.compile(r'(?P<D_Name>\w+)\s+[\d:]+\s+\d+\s+(?P<D_Descr>\d[\d\.]*[A-Za-z]*)\s'
+                         r'|(?P<Name>\w+)\s+(?P<Descr>\d[\d\.]*[A-Za-z]*)\s+(?P<Vendor>\w+)[\s-](?P<PartID>[\w-]+)'
+                         r'(\s+(?P<Serial>[\w-]+))?'
+                         r'|(?P<S_Name>\w+)\s+(?P<S_Descr>\d[\d\.]*[A-Za-z]*)')
+
+
+def lsblk(text):
+    """ Parse Linux 'lsblk -d' output
+
+        :param text: String, command output
+        :return: list of dicts, same as lsblk.template returns
+    """
+    records = []
+    for line in text.splitlines():
+        match = _lsblk_line.match(line)
+        if not match:
+            continue
+        record = {'PartID': '', 'Serial': '', 'Vendor': '', 'Descr': '', 'Name': ''}
+        if match.group('D_Name') is not None:
+            record['Name'], record['Descr'] = match.group('D_Name', 'D_Descr')
+        elif match.group('Name') is not None:
+            for name in ('PartID', 'Serial', 'Vendor', 'Descr', 'Name'):
+                record[name] = match.group(name) or ''
+        else:
+            record['Name'], record['Descr'] = match.group('S_Name', 'S_Descr')
+        records.append(record)
+    return records
+
+
+# virsh_domstats.template
+_virsh_domain = re.compile(r"Domain: '(\S+)'")
+_virsh_line = re.compile(r'(\s+)(?:state\.state=(?P<STATE>\d)|balloon\.maximum=(?P<MEM>\d+)'
+                         r'|vcpu\.maximum=(?P<VCPU>\d+)'
+                         r'|block\.(?P<index>\d+)\.(?:name=(?P<name>\w+)|path=(?P<path>\S+)|capacity=(?P<size>\d+)))')
+
+
+def virsh_domstats(text):
+    """ Parse Linux 'virsh domstats' output
+
+        :param text: String, command output
+        :return: list of dicts, same as virsh_domstats.template returns
+    """
+    records = []
+    record = {'NAME': None, 'MEM': None, 'VCPU': None, 'STATE': None,
+              'DISKNAMES': [], 'DISKPATHS': [], 'DISKSIZES': []}
+    for line in text.splitlines():
+        if not line:
+            # Empty line ends a domain
+            record = _append(records, record, required=('NAME',))
+            continue
+        if line[0].isspace():
+            match = _virsh_line.match(line)
+            if not match:
+                continue
+            index = match.group('index')
+            if index is None:
+                for name in ('STATE', 'MEM', 'VCPU'):
+                    if match.group(name) is not None:
+                        record[name] = match.group(name)
+            elif match.group('name') is not None:
+                record['DISKNAMES'].append({'diskindex': index, 'name': match.group('name')})
+            elif match.group('path') is not None:
+                record['DISKPATHS'].append({'diskindex': index, 'path': match.group('path')})
+            else:
+                record['DISKSIZES'].append({'diskindex': index, 'size': match.group('size')})
+        else:
+            match = _virsh_domain.match(line)
+            if match:
+                record['NAME'] = match.group(1)
+    _append(records, record, required=('NAME',))
+    return records
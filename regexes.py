@@ -0,0 +1,258 @@
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+import re
+
+# Static check of regexes for super-linear backtracking
+#
+# Python re is a backtracking engine: a nested quantifier like a "(.*)+" takes exponential time
+# and a chain of quantifiers, which can match same chars, like a ".*,.*VID:\s+(.*),"
+# takes polynomial time on lines, which are not matched.
+# Check is approximate - only ASCII chars of one line are considered
+
+_ALPHABET = frozenset(chr(code) for code in range(128)) - {'\n'}
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: r'\d',
+    sre_constants.CATEGORY_NOT_DIGIT: r'\D',
+    sre_constants.CATEGORY_SPACE: r'\s',
+    sre_constants.CATEGORY_NOT_SPACE: r'\S',
+    sre_constants.CATEGORY_WORD: r'\w',
+    sre_constants.CATEGORY_NOT_WORD: r'\W',
+}
+_CATEGORIES = {category: frozenset(char for char in _ALPHABET if re.match(regex, char))
+               for category, regex in _CATEGORIES.items()}
+
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+# Max polynomial degree of backtracking - any chain of two overlapping repeats is quadratic
+# and a line is parsed in one call of re.match, which cannot be interrupted
+MAX_DEGREE = 1
+
+_END_ANCHORS = (sre_constants.AT_END, sre_constants.AT_END_STRING)
+
+
+class _Item(object):
+    """ Item of flattened regex sequence
+
+        chars - chars, which can be matched by item
+        repeat - item is unbounded repeat, which can backtrack
+        nullable - item can match an empty string
+        first - chars, which can start a match of item
+    """
+
+    def __init__(self, chars, repeat=False, nullable=False, first=None):
+        self.chars = chars
+        self.repeat = repeat
+        self.nullable = nullable
+        self.first = chars if first is None else first
+
+
+def _in_chars(items):
+    chars = set()
+    negate = False
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            chars.add(chr(av))
+        elif op == sre_constants.RANGE:
+            chars.update(char for char in _ALPHABET if av[0] <= ord(char) <= av[1])
+        elif op == sre_constants.CATEGORY:
+            chars.update(_CATEGORIES.get(av, ()))
+    return _ALPHABET - chars if negate else frozenset(chars)
+
+
+def _chars(pattern):
+    """ All chars, which can be matched by pattern
+    """
+    chars = set()
+    for op, av in pattern:
+        if op == sre_constants.LITERAL:
+            chars.add(chr(av))
+        elif op == sre_constants.NOT_LITERAL:
+            chars.update(_ALPHABET - {chr(av)})
+        elif op == sre_constants.ANY:
+            chars.update(_ALPHABET)
+        elif op == sre_constants.IN:
+            chars.update(_in_chars(av))
+        elif op == sre_constants.CATEGORY:
+            chars.update(_CATEGORIES.get(av, ()))
+        elif op == sre_constants.BRANCH:
+            for branch in av[1]:
+                chars.update(_chars(branch))
+        elif isinstance(av, tuple) and av and isinstance(av[-1], (list, sre_parse.SubPattern)):
+            # Groups and repeats
+            chars.update(_chars(av[-1]))
+        elif isinstance(av, (list, sre_parse.SubPattern)):
+            # Atomic groups
+            chars.update(_chars(av))
+    return frozenset(chars)
+
+
+def _is_unbounded(op, av):
+    return op in _REPEATS and av[1] == sre_constants.MAXREPEAT
+
+
+def _has_unbounded(pattern):
+    for op, av in pattern:
+        if _is_unbounded(op, av):
+            return True
+        if op == sre_constants.BRANCH:
+            if any(_has_unbounded(branch) for branch in av[1]):
+                return True
+        elif isinstance(av, tuple) and av and isinstance(av[-1], (list, sre_parse.SubPattern)):
+            if _has_unbounded(av[-1]):
+                return True
+    return False
+
+
+def _flatten(pattern, items):
+    """ Flatten pattern into a list of _Item, groups are opened
+    """
+    for op, av in pattern:
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN,
+                  sre_constants.CATEGORY):
+            items.append(_Item(_chars([(op, av)])))
+        elif op == sre_constants.SUBPATTERN:
+            _flatten(av[-1], items)
+        elif op in _REPEATS:
+            body = av[2]
+            if av[1] == sre_constants.MAXREPEAT:
+                items.append(_Item(_chars(body), repeat=True, nullable=av[0] == 0, first=_first(body)))
+            elif av[0] == 1 and av[1] == 1:
+                _flatten(body, items)
+            else:
+                items.append(_Item(_chars(body), nullable=av[0] == 0))
+        elif op == sre_constants.BRANCH:
+            nullable = any(not branch for branch in av[1])
+            # Only repeats at the end of branch can share chars with next items
+            tails = [_flatten(branch, []) for branch in av[1]]
+            repeat = any(tail and tail[-1].repeat for tail in tails)
+            first = frozenset().union(*[_first(branch) for branch in av[1]])
+            items.append(_Item(_chars([(op, av)]), repeat=repeat, nullable=nullable, first=first))
+        elif op == getattr(sre_constants, 'ATOMIC_GROUP', None):
+            items.append(_Item(_chars(av)))
+        elif op == sre_constants.AT and av in _END_ANCHORS:
+            # "$" consumes nothing, but it can fail - previous repeats can backtrack
+            items.append(_Item(frozenset()))
+        # Other anchors, lookarounds and references do not consume chars of sequence
+    return items
+
+
+def _first(pattern):
+    """ Chars, which can start a match of pattern
+    """
+    chars = set()
+    for item in _flatten(pattern, []):
+        chars.update(item.first)
+        if not item.nullable:
+            break
+    return frozenset(chars)
+
+
+def _get_degree(items):
+    """ Length of longest chain of repeats, which can share same substring
+    """
+    while items:
+        # Trailing optional items can always match, so they do not backtrack
+        if items[-1].nullable:
+            items = items[:-1]
+        # "$" after ".*" always matches
+        elif not items[-1].chars and len(items) > 1 and items[-2].repeat and items[-2].chars == _ALPHABET:
+            items = items[:-1]
+        else:
+            break
+    # Last repeat is never backtracked - match is found, when it matched once
+    if items and items[-1].repeat:
+        items = items[:-1] + [_Item(items[-1].chars)]
+
+    degree = 0
+    chains = []
+    for index, item in enumerate(items):
+        if not item.repeat:
+            continue
+        length = 1
+        for prev_index, prev_length in chains:
+            prev = items[prev_index]
+            middle = items[prev_index + 1:index]
+            # Both repeats and everything between them can match a run of same chars,
+            # so this run can be split between repeats in many ways
+            common = prev.chars & item.chars
+            if prev.chars & item.first and all(other.nullable or other.chars & common for other in middle):
+                length = max(length, prev_length + 1)
+        chains.append((index, length))
+        degree = max(degree, length)
+    return degree
+
+
+def _find_nested(pattern, problems):
+    for op, av in pattern:
+        if _is_unbounded(op, av):
+            body = av[2]
+            items = _flatten(body, [])
+            for item in items:
+                # Inner repeat can match whole iteration - iterations can be split in many ways
+                if item.repeat and all(other is item or other.nullable or other.chars <= item.chars
+                                       for other in items):
+                    problems.append("nested quantifier - exponential backtracking")
+                    break
+            else:
+                if len(body) == 1 and body[0][0] == sre_constants.SUBPATTERN:
+                    body = body[0][1][-1]
+                if len(body) == 1 and body[0][0] == sre_constants.BRANCH:
+                    branches = [_chars(branch) for branch in body[0][1][1]]
+                    if any(first & second for index, first in enumerate(branches)
+                           for second in branches[index + 1:]):
+                        problems.append("repeated alternation of overlapping branches - exponential backtracking")
+            _find_nested(body, problems)
+        elif op == sre_constants.BRANCH:
+            for branch in av[1]:
+                _find_nested(branch, problems)
+        elif isinstance(av, tuple) and av and isinstance(av[-1], (list, sre_parse.SubPattern)):
+            _find_nested(av[-1], problems)
+        elif isinstance(av, (list, sre_parse.SubPattern)) and op != sre_constants.IN:
+            _find_nested(av, problems)
+
+
+def check(regex):
+    """ Find a super-linear backtracking in regex
+
+        Regex is checked as it is used by re.match - anchored at start
+
+        :param regex: String
+        :return: list of strings - found problems, empty if regex is safe
+    """
+    try:
+        pattern = sre_parse.parse(regex)
+    except Exception as e:
+        return ["cannot parse regex: {}".format(e)]
+
+    problems = []
+    _find_nested(pattern, problems)
+
+    branches = [pattern]
+    if len(pattern) == 1 and pattern[0][0] == sre_constants.BRANCH:
+        branches = pattern[0][1][1]
+    degree = max(_get_degree(_flatten(branch, [])) for branch in branches)
+    if degree > MAX_DEGREE:
+        problems.append("{} overlapping quantifiers in a row - O(n^{}) backtracking".format(degree, degree))
+    return problems
+
+
+def check_template(fsm):
+    """ Find a super-linear backtracking in rules of TextFSM template
+
+        :param fsm: TextFSM object
+        :return: list of tuples (state, rule regex, problems)
+    """
+    result = []
+    for state, rules in fsm.states.items():
+        for rule in rules:
+            problems = check(rule.regex)
+            if problems:
+                result.append((state, rule.regex, problems))
+    return result
@@ -3,30 +3,125 @@
 # Directory, with TextFSM templates and index file
 TEMPLATES_DIRECTORY = 'collector/cli_templates'
 
+# Re-read index file on sync request, if it was changed
+INDEX_AUTO_RELOAD = True
+
+# Max count of memoized (vendor, command) lookups in index file
+DISPATCH_CACHE_SIZE = 1024
+
+# Parse outputs of commands with native parser in "Parser" column of index file by it instead of template
+NATIVE_PARSERS = True
+
+# Parsing of one command output is stopped with error after this count of seconds
+# Time is checked between lines - a match of one line cannot be interrupted. 0 - no limit
+PARSE_TIME_LIMIT = 10
+
+# Lines of command output longer than this count of chars are cut before parsing,
+# it bounds a time of one line match for rules, which pass the check of regexes. 0 - no limit
+MAX_LINE_LENGTH = 1024
+
 # MAX mtu for interfaces
 MAX_MTU = 32767
 
+# Unassign IP addresses, which are not present on synced interfaces anymore
+UNASSIGN_STALE_ADDRESSES = False
+
+# Delete discovered inventory items, which are not present in synced output anymore
+DELETE_STALE_INVENTORY = False
+
+# Write objects, saved by bulk queries, into NetBox changelog
+CHANGELOG_ENABLED = True
+
+# User name in changelog for changes made by queued jobs
+CHANGELOG_USERNAME = 'collector'
+
 # regex for agregated interfaces
 PORTCHANNEL_REGEX = '(^([Pp]ort).*)|(^([Bb]ond).*)'
 
 # Default cluster type
 DEFAULT_CLUSTER_TYPE = 'KVM'
 
+# How long (in seconds) reference objects, like a platform or device role, and devices are cached
+# Changes made by this process are seen at once, changes made by other processes - after this time
+REFERENCE_CACHE_TTL = 300
+
+# Max count of cached devices
+DEVICE_CACHE_SIZE = 1024
+
+# Max count of cached vendor names from command outputs
+VENDOR_CACHE_SIZE = 1024
+
+# Aliases of vendor names from command outputs: {alias: Manufacturer name}, in lower case
+# like a {'hp': 'hewlett packard'}
+VENDOR_ALIASES = {}
+
 # regex for virtual interfaces
 VIRTUAL_REGEX = '^([Vv]lan|[Dd]iler|[Vv]irtual|[Gg]re|[Tt]un).*|(.+\.\d+)'
 
+# Max size of request body (after decompression) in bytes
+MAX_REQUEST_SIZE = 256 * 1024 * 1024
+
+# Max size of one host item in request in bytes
+MAX_ITEM_SIZE = 32 * 1024 * 1024
+
+# Request body is read by chunks of this size
+READ_CHUNK_SIZE = 64 * 1024
+
+# Hosts of big queries are synced by batches of this size
+SYNC_BATCH_SIZE = 100
+
+# Skip outputs, which are same as last synced output of this command on this host
+# Use "force": true in query for sync it anyway
+DEDUPLICATE_OUTPUTS = True
+
+# Queue all sync queries for worker, not only queries with "async": true
+ASYNC_QUERIES = False
+
+# Count of threads, which process queued jobs
+JOB_CONCURRENCY = 4
+
+# Count of processes, which process queued jobs (hosts are sharded by hostname)
+# 0 - use threads only
+JOB_PROCESSES = 0
+
+# Max count of jobs, taken by worker at once
+JOB_BATCH_SIZE = 100
+
+# How long (in seconds) worker waits for new jobs
+JOB_POLL_INTERVAL = 5
+
+# Running jobs, which were not finished in this count of seconds (worker was killed or crashed),
+# are returned into queue. Should be more than time of the biggest job. 0 - never
+JOB_TIMEOUT = 3600
+
+# Finished jobs older than this count of days will be deleted
+JOB_RETENTION_DAYS = 7
+
+# Collect time and database queries of sync stages for metrics endpoint
+METRICS_ENABLED = True
+
+# Bounds of stage time histogram buckets in seconds
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
 # FILE to LOG
 LOGFILE = "/var/log/netbox/netbox.log"
 
 # LOGLEVEL
-LOGLEVEL = 'DEBUG'
+LOGLEVEL = 'INFO'
+
+# Max count of log records waiting for writing into file - other records will be dropped
+LOG_QUEUE_SIZE = 10000
+
+# Log only every N-th of repeated debug messages for one device (like a message for every interface)
+# 1 - log all messages
+LOG_SAMPLE_RATE = 10
 
 # Separator strong for divide comments and disk information
 SEPARATOR = "***\r\n"
 
 # Configuration for logging
 # For change it - See Django documantation
-# Now set as debug logginng
+# Log file and console are written by separate threads, so requests do not wait for disk
 LOGGING_CONFIG = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -35,14 +130,22 @@ LOGGING_CONFIG = {
             'format': '%(asctime)s %(levelname)s %(filename)s[Line:%(lineno)d] %(message)s',
         },
     },
+    'filters': {
+        'sampling': {
+            '()': 'collector.logs.SamplingFilter',
+            'rate': LOG_SAMPLE_RATE,
+        },
+    },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
+            'class': 'collector.logs.QueueStreamHandler',
+            'queue_size': LOG_QUEUE_SIZE,
             'formatter': 'console',
         },
         'logfile': {
-            'class': 'logging.FileHandler',
+            'class': 'collector.logs.QueueFileHandler',
             'filename': LOGFILE,
+            'queue_size': LOG_QUEUE_SIZE,
             'formatter': 'console',
         },
     },
@@ -50,6 +153,7 @@ LOGGING_CONFIG = {
         'collector': {
             'level': LOGLEVEL,
             'handlers': ['console', 'logfile'],
+            'filters': ['sampling'],
         },
     },
 }
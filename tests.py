@@ -1,3 +1,1545 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+from textfsm import clitable
+from dcim.constants import *
+from extras.constants import OBJECTCHANGE_ACTION_CREATE, OBJECTCHANGE_ACTION_UPDATE
+from extras.models import CustomField, CustomFieldValue, ObjectChange
+from dcim.models import (Device, DeviceRole, DeviceType, Interface, InventoryItem, Manufacturer, Platform,
+                         Site)
+from ipam.models import IPAddress
+from virtualization.models import Cluster, ClusterType, VirtualMachine
+from collector import cache, changelog, collector, ingest, jobs, logs, metrics, parsers, regexes, views
+from collector.models import Job, SyncDigest, JOB_STATUS_RUNNING, JOB_STATUS_COMPLETED, JOB_STATUS_FAILED
+from collector.settings import CHANGELOG_USERNAME, DEFAULT_CLUSTER_TYPE, SEPARATOR
+from unittest import mock, skipUnless
+from types import SimpleNamespace
+from datetime import timedelta
+import gzip
+import importlib.util
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import textfsm
+import threading
 
-# Create your tests here.
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli_templates')
+UTILS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils')
+
+IP_A = """1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN group default qlen 1000
+    link/loopback 00:00:00:00:00:00 brd 00:00:00:00:00:00
+    inet 127.0.0.1/8 scope host lo
+       valid_lft forever preferred_lft forever
+    inet6 ::1/128 scope host
+       valid_lft forever preferred_lft forever
+2: eth0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc pfifo_fast state UP group default qlen 1000
+    link/ether 52:54:00:12:34:56 brd ff:ff:ff:ff:ff:ff
+    altname enp0s3
+    inet 10.0.0.5/24 brd 10.0.0.255 scope global eth0
+       valid_lft forever preferred_lft forever
+    inet 10.0.0.6/24 brd 10.0.0.255 scope global secondary eth0
+       valid_lft forever preferred_lft forever
+3: eth1: <BROADCAST,MULTICAST,SLAVE,UP,LOWER_UP> mtu 9000 qdisc mq master bond0 state UP group default qlen 1000
+    link/ether 52:54:00:12:34:57 brd ff:ff:ff:ff:ff:ff
+4: bond0: <BROADCAST,MULTICAST,MASTER,UP,LOWER_UP> mtu 9000 qdisc noqueue state UP group default qlen 1000
+    link/ether 52:54:00:12:34:57 brd ff:ff:ff:ff:ff:ff
+    inet 192.168.1.10/24 brd 192.168.1.255 scope global bond0
+5: bond0.100@bond0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 9000 qdisc noqueue master br-100.1 state UP group default
+    link/ether 52:54:00:12:34:57 brd ff:ff:ff:ff:ff:ff
+6: veth1@if5: <NO-CARRIER,BROADCAST,MULTICAST,UP> mtu 1500 qdisc noqueue state LOWERLAYERDOWN group default
+    link/ether 2e:5a:01:02:03:04 brd ff:ff:ff:ff:ff:ff link-netnsid 0
+7: tun0: <POINTOPOINT,MULTICAST,NOARP,UP,LOWER_UP> mtu 1400 qdisc pfifo_fast state UNKNOWN group default qlen 100
+    link/none
+    inet 10.8.0.1 peer 10.8.0.2/32 scope global tun0
+"""
+
+LSBLK = """NAME    MAJ:MIN RM   SIZE RO TYPE MOUNTPOINT
+sda       8:0    0   1.8T  0 disk
+sdb       8:16   0 447.1G  0 disk
+nvme0n1 259:0    0   1.8T  0 disk
+sr0      11:0    1  1024M  0 rom
+loop0     7:0    0  55.4M  1 loop /snap/core/1
+"""
+
+LSBLK_MODELS = """NAME      SIZE MODEL                   SERIAL
+sda       1.8T ST2000NM0055-1V4        ZC20ABCD
+sdb     447.1G INTEL SSDSC2KB480G8     PHYF1234
+sdc       1.8T Samsung SSD 860 EVO     S3Z1234
+sdd       1.8T INTEL SSDSC2BB480G4
+nvme0n1 931.5G
+"""
+
+VIRSH = """Domain: 'vm1'
+  state.state=1
+  state.reason=1
+  balloon.current=4194304
+  balloon.maximum=4194304
+  vcpu.current=2
+  vcpu.maximum=2
+  block.count=2
+  block.0.name=vda
+  block.0.path=/var/lib/libvirt/images/vm1.qcow2
+  block.0.capacity=21474836480
+  block.1.name=hda
+  block.1.capacity=0
+
+Domain: 'vm2'
+  state.state=5
+  state.reason=0
+  balloon.maximum=2097152
+  vcpu.maximum=1
+  block.count=0
+
+Domain: 'vm3'
+  state.state=3
+  vcpu.maximum=4
+  block.count=1
+  block.0.name=vda
+  block.0.path=/dev/vg0/vm3
+"""
+
+# Lines for random outputs - includes lines, which are matched partially or not matched by templates
+IP_A_LINES = IP_A.splitlines() + [
+    "8: eth2: <BROADCAST,MULTICAST> mtu 1500 qdisc noop state DOWN mode DEFAULT group default qlen 1000",
+    "9: eth3: <BROADCAST> mtu 1500 qdisc noop state UPPER", "10 no colon", "11:", "x: junk", "",
+    "    link/ether 52-54-00-12-34-58 brd x", "\tlink/ipip 10.0.0.1 peer 10.0.0.2", "    inet 1000.1.1.1/8"]
+LSBLK_LINES = LSBLK.splitlines() + LSBLK_MODELS.splitlines() + [
+    "sde\t.5\tX-Y Z", " sdf 1T", "sdg 1.8T HGST", "", "sr1 11:1 1 1024M 0 rom", "nvme1n1 259:1 0 3.6T 0 disk",
+    "sdh 1.8T INTEL SSD1", "sdi 1.8T X-Y ", "sdj 10:1 0 1.8T"]
+VIRSH_LINES = VIRSH.splitlines() + [
+    "Domain: 'a'b'", "Domain: ''", "Domain: vm4", "  state.state=10", "  block.x.name=vdb", "\tblock.10.capacity=1",
+    "  block.1.name=hd-a", "   ", ""]
+
+
+def load_util(name):
+    """ Import a script from utils, its names are not module names
+    """
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(UTILS_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def parse_template(template, text):
+    """ Parse output by TextFSM template, same as CollectorTable.ParseRecords does
+    """
+    with open(os.path.join(TEMPLATES_DIR, template)) as template_file:
+        fsm = textfsm.TextFSM(template_file)
+    return [dict(zip(fsm.header, record)) for record in fsm.ParseText(text)]
+
+
+def random_outputs(lines, count, seed):
+    rnd = random.Random(seed)
+    for _ in range(count):
+        output = "\n".join(rnd.choice(lines) for _ in range(rnd.randint(0, 30)))
+        yield output + rnd.choice(("", "\n"))
+
+
+class NativeParsersTest(SimpleTestCase):
+    """ Native parsers should return same records as its templates
+    """
+
+    def assertSameRecords(self, template, parser, text):
+        self.assertEqual(parser(text), parse_template(template, text), msg=text)
+
+    def test_index(self):
+        index = clitable.IndexTable(file_path=os.path.join(TEMPLATES_DIR, 'index'))
+        native = {}
+        for row in index.index:
+            if row['Parser']:
+                self.assertTrue(hasattr(parsers, row['Parser']), row['Parser'])
+                native[row['Template']] = row['Parser']
+        self.assertEqual(native, {'ip_a.template': 'ip_a', 'lsblk.template': 'lsblk',
+                                  'virsh_domstats.template': 'virsh_domstats'})
+
+    def test_ip_a(self):
+        self.assertSameRecords('ip_a.template', parsers.ip_a, IP_A)
+        self.assertEqual(len(parsers.ip_a(IP_A)), 7)
+        for text in random_outputs(IP_A_LINES, 500, 1):
+            self.assertSameRecords('ip_a.template', parsers.ip_a, text)
+
+    def test_lsblk(self):
+        self.assertEqual(parsers.lsblk(LSBLK), LSBLK_RECORDS)
+        self.assertEqual(parsers.lsblk(LSBLK_MODELS), LSBLK_MODELS_RECORDS)
+        self.assertSameRecords('lsblk.template', parsers.lsblk, LSBLK)
+        self.assertSameRecords('lsblk.template', parsers.lsblk, LSBLK_MODELS)
+        for text in random_outputs(LSBLK_LINES, 500, 2):
+            self.assertSameRecords('lsblk.template', parsers.lsblk, text)
+
+    def test_virsh_domstats(self):
+        self.assertSameRecords('virsh_domstats.template', parsers.virsh_domstats, VIRSH)
+        self.assertEqual(len(parsers.virsh_domstats(VIRSH)), 3)
+        for text in random_outputs(VIRSH_LINES, 500, 3):
+            self.assertSameRecords('virsh_domstats.template', parsers.virsh_domstats, text)
+
+    def test_empty(self):
+        for template, parser in (('ip_a.template', parsers.ip_a), ('lsblk.template', parsers.lsblk),
+                                 ('virsh_domstats.template', parsers.virsh_domstats)):
+            self.assertSameRecords(template, parser, '')
+            self.assertEqual(parser(''), [])
+
+
+def interface(name, mac=None, ips=(), mtu='1500', state='UP'):
+    """ Interface row, same as templates of interfaces commands return
+    """
+    return {'NAME': name, 'MAC': mac, 'IP': list(ips), 'MTU': mtu, 'DESCR': '', 'TYPE': '', 'STATE': state}
+
+
+class DeviceMixin(object):
+    """ Server with reference objects, which are used by sync functions
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.site = Site.objects.create(name='Site 1', slug='site-1')
+        self.manufacturer = Manufacturer.objects.create(name='Linux', slug='linux')
+        Manufacturer.objects.create(name='--- NoName ---', slug='noname')
+        self.device_type = DeviceType.objects.create(manufacturer=self.manufacturer, model='Server', slug='server')
+        self.role = DeviceRole.objects.create(name='Server', slug='server', color='ff0000')
+        self.platform = Platform.objects.create(name='Linux', slug='linux')
+        ClusterType.objects.create(name=DEFAULT_CLUSTER_TYPE, slug='kvm')
+        self.device = Device.objects.create(name='srv01', asset_tag='SRV01', device_type=self.device_type,
+                                            device_role=self.role, site=self.site, platform=self.platform)
+
+    def tearDown(self):
+        cache.clear()
+
+
+class SyncTestCase(DeviceMixin, TestCase):
+    pass
+
+
+class SyncInterfacesTest(SyncTestCase):
+
+    def test_create(self):
+        result, _ = collector.sync_interfaces(self.device, [interface('eth0', mac='52:54:00:12:34:56'),
+                                                            interface('bond0', mtu='9000', state='DOWN'),
+                                                            interface('eth0.100')])
+        self.assertTrue(result)
+        ifaces = {iface.name: iface for iface in self.device.interfaces.all()}
+        self.assertEqual(set(ifaces), {'eth0', 'bond0', 'eth0.100'})
+        self.assertEqual(str(ifaces['eth0'].mac_address).lower(), '52:54:00:12:34:56')
+        self.assertEqual(ifaces['eth0'].mtu, 1500)
+        self.assertTrue(ifaces['eth0'].enabled)
+        self.assertEqual(ifaces['eth0'].form_factor, IFACE_FF_1GE_FIXED)
+        self.assertEqual(ifaces['bond0'].mtu, 9000)
+        self.assertFalse(ifaces['bond0'].enabled)
+        self.assertEqual(ifaces['bond0'].form_factor, IFACE_FF_LAG)
+        self.assertEqual(ifaces['eth0.100'].form_factor, IFACE_FF_VIRTUAL)
+
+    def test_update_changed_only(self):
+        collector.sync_interfaces(self.device, [interface('eth0'), interface('eth1')])
+        with mock.patch.object(collector, '_bulk_update', wraps=collector._bulk_update) as bulk_update:
+            result, _ = collector.sync_interfaces(self.device, [interface('eth0'), interface('eth1', mtu='9000')])
+        self.assertTrue(result)
+        changed = bulk_update.call_args[0][1]
+        self.assertEqual([(iface.name, fields) for iface, fields in changed], [('eth1', ['mtu'])])
+        self.assertEqual(self.device.interfaces.count(), 2)
+        self.assertEqual(self.device.interfaces.get(name='eth1').mtu, 9000)
+
+    def test_mtu_limit(self):
+        collector.sync_interfaces(self.device, [interface('eth0', mtu='65536')])
+        self.assertIsNone(self.device.interfaces.get(name='eth0').mtu)
+
+    def test_nothing_to_sync(self):
+        result, _ = collector.sync_interfaces(self.device, [])
+        self.assertFalse(result)
+
+    def test_save_error(self):
+        # Device is synced by one transaction - failed sync is rolled back with it
+        with transaction.atomic(), \
+                mock.patch.object(Interface.objects, 'bulk_create', side_effect=IntegrityError('error')):
+            result, detail = collector.sync_interfaces(self.device, [interface('eth0')])
+        self.assertFalse(result)
+        self.assertEqual(detail, "Can't update any interface, see a log for details")
+        self.assertFalse(self.device.interfaces.exists())
+
+
+class ConnectInterfacesTest(SyncTestCase):
+
+    def setUp(self):
+        super(ConnectInterfacesTest, self).setUp()
+        self.server = Device.objects.create(name='srv02', asset_tag='SRV02', device_type=self.device_type,
+                                            device_role=self.role, site=self.site, platform=self.platform)
+        self.ports = {name: Interface.objects.create(device=self.server, name=name)
+                      for name in ('Ethernet0/1', 'Ethernet0/2', 'eth0/3', 'Ethernet0/3', 'Ethernet0/4',
+                                   'Eth-Trunk0/4')}
+
+    def connect(self, *descriptions):
+        interfaces = [Interface.objects.create(device=self.device, name='ge-0/0/{}'.format(number), description=descr)
+                      for number, descr in enumerate(descriptions)]
+        count = collector._connect_interfaces(interfaces)
+        return count, [Interface.objects.get(pk=iface.pk).cable_id for iface in interfaces]
+
+    def assertConnected(self, iface, port_name):
+        port = Interface.objects.get(pk=self.ports[port_name].pk)
+        self.assertIsNotNone(port.cable_id)
+        self.assertEqual(Interface.objects.get(device=self.device, cable=port.cable_id).name, iface)
+
+    def test_index(self):
+        index = collector._interfaces_index(list(self.ports.values()))
+        ports = self.ports
+        # Short and long names of type
+        self.assertIs(index[('e', '0/1')], ports['Ethernet0/1'])
+        self.assertIs(index[('eth', '0/2')], ports['Ethernet0/2'])
+        self.assertIs(index[('ethernet', '0/2')], ports['Ethernet0/2'])
+        # Exact names and whole types have priority over prefixes
+        self.assertIs(index['eth0/3'], ports['eth0/3'])
+        self.assertIs(index[('eth', '0/3')], ports['eth0/3'])
+        self.assertIs(index[('ethernet', '0/3')], ports['Ethernet0/3'])
+        self.assertIsNone(index[('e', '0/3')])
+        # Prefix of Ethernet and Eth-Trunk is ambiguous
+        self.assertIsNone(index[('eth', '0/4')])
+        self.assertIs(index[('eth-', '0/4')], ports['Eth-Trunk0/4'])
+        self.assertIs(index[('ether', '0/4')], ports['Ethernet0/4'])
+
+    def test_connect(self):
+        count, cables = self.connect('SRV02|eth0/1', 'SRV02|Ethernet0/2', 'SRV02|eth0/3')
+        self.assertEqual(count, 3)
+        self.assertTrue(all(cables))
+        self.assertConnected('ge-0/0/0', 'Ethernet0/1')
+        self.assertConnected('ge-0/0/1', 'Ethernet0/2')
+        self.assertConnected('ge-0/0/2', 'eth0/3')
+
+    def test_not_connected(self):
+        count, cables = self.connect('', 'no separator', '|eth0/1', 'UNKNOWN|eth0/1', 'SRV02|eth0/9', 'SRV02|eth0/4',
+                                     'SRV02|e0/3')
+        self.assertEqual(count, 0)
+        self.assertFalse(any(cables))
+        self.assertFalse(Interface.objects.filter(device=self.server, cable__isnull=False).exists())
+
+    def test_cabled(self):
+        count, _ = self.connect('SRV02|eth0/1')
+        self.assertEqual(count, 1)
+        # Interface with cable is skipped
+        iface = Interface.objects.get(device=self.device, name='ge-0/0/0')
+        iface.description = 'SRV02|eth0/2'
+        self.assertEqual(collector._connect_interfaces([iface]), 0)
+        self.assertIsNone(Interface.objects.get(pk=self.ports['Ethernet0/2'].pk).cable_id)
+        # Port with cable is skipped
+        other = Interface.objects.create(device=self.device, name='ge-0/0/1', description='SRV02|Ethernet0/1')
+        self.assertEqual(collector._connect_interfaces([other]), 0)
+        self.assertIsNone(Interface.objects.get(pk=other.pk).cable_id)
+
+    def test_used_ports(self):
+        # Both interfaces point to one port - only first is connected
+        count, cables = self.connect('SRV02|eth0/1', 'SRV02|Ethernet0/1')
+        self.assertEqual(count, 1)
+        self.assertIsNotNone(cables[0])
+        self.assertIsNone(cables[1])
+        self.assertConnected('ge-0/0/0', 'Ethernet0/1')
+
+    def test_save_error(self):
+        with mock.patch.object(collector.Cable, 'save', side_effect=[IntegrityError('broken'), None]) as save:
+            count, _ = self.connect('SRV02|eth0/1', 'SRV02|eth0/2')
+        self.assertEqual(count, 1)
+        self.assertEqual(save.call_count, 2)
+
+
+class ParseQueryTest(SyncTestCase):
+
+    def test_batch(self):
+        hosts = [{'hostname': 'srv01', 'command': 'lsblk', 'data': LSBLK},
+                 {'hostname': 'nope', 'command': 'lsblk', 'data': LSBLK},
+                 {'hostname': 'srv01', 'command': 'unknown', 'data': LSBLK},
+                 {'hostname': 'srv01', 'command': 'ip a', 'data': IP_A},
+                 {'command': 'lsblk', 'data': LSBLK}]
+        # Hosts are synced by batches, results are in order of hosts
+        with mock.patch.object(collector, 'SYNC_BATCH_SIZE', 2), \
+                mock.patch.object(collector, 'sync_hosts', wraps=collector.sync_hosts) as sync_hosts:
+            result, detail = collector.parse_query(collector.get_parser(), {'action': 'sync', 'data': iter(hosts)})
+        self.assertEqual([len(call[0][1]) for call in sync_hosts.call_args_list], [2, 2, 1])
+        self.assertFalse(result)
+        self.assertEqual([(item['hostname'], item['command'], item['result']) for item in detail],
+                         [('srv01', 'lsblk', True), ('nope', 'lsblk', False), ('srv01', 'unknown', False),
+                          ('srv01', 'ip a', True), (None, None, False)])
+        self.assertEqual(detail[1]['detail'], "Not found device by hostname: nope")
+        self.assertTrue(self.device.inventory_items.exists())
+        self.assertTrue(self.device.interfaces.exists())
+
+    def test_all_synced(self):
+        hosts = [{'hostname': 'srv01', 'command': 'lsblk', 'data': LSBLK},
+                 {'hostname': 'srv01', 'command': 'ip a', 'data': IP_A}]
+        result, detail = collector.parse_query(collector.get_parser(), {'action': 'sync', 'data': hosts})
+        self.assertTrue(result)
+        self.assertEqual(len(detail), 2)
+
+    def test_one_host(self):
+        # Result of one host is returned as before batches
+        result, detail = collector.parse_query(collector.get_parser(), {
+            'action': 'sync', 'data': [{'hostname': 'nope', 'command': 'lsblk', 'data': LSBLK}]})
+        self.assertEqual((result, detail), (False, "Not found device by hostname: nope"))
+
+    def test_bad_query(self):
+        parser = collector.get_parser()
+        self.assertEqual(collector.parse_query(parser, {'data': []}), (False, "Not provided any actions"))
+        self.assertEqual(collector.parse_query(parser, {'action': 'sync', 'data': []}),
+                         (False, "Cannot parse a query - check all parameters"))
+        self.assertEqual(collector.parse_query(parser, {'action': 'sync', 'data': iter([])}),
+                         (False, "Cannot parse a query - check all parameters"))
+        self.assertEqual(collector.parse_query(parser, {'action': 'drop'}), (False, "Unknown action: drop"))
+
+
+class SyncAddressesTest(SyncTestCase):
+
+    def sync(self, *interfaces):
+        result, _ = collector.sync_interfaces(self.device, list(interfaces))
+        self.assertTrue(result)
+
+    def addresses(self):
+        return {(ip.interface.name if ip.interface else None, str(ip.address)) for ip in IPAddress.objects.all()}
+
+    def test_create(self):
+        self.sync(interface('eth0', ips=['10.0.0.5/24', '10.0.1.5/24']), interface('eth1', ips=['10.0.2.5/24']))
+        self.assertEqual(self.addresses(), {('eth0', '10.0.0.5/24'), ('eth0', '10.0.1.5/24'),
+                                            ('eth1', '10.0.2.5/24')})
+
+    def test_not_duplicated(self):
+        self.sync(interface('eth0', ips=['10.0.0.5/24']))
+        self.sync(interface('eth0', ips=['10.0.0.5/24', '10.0.1.5/24']))
+        self.assertEqual(IPAddress.objects.count(), 2)
+        self.assertEqual(self.addresses(), {('eth0', '10.0.0.5/24'), ('eth0', '10.0.1.5/24')})
+
+    def test_invalid_address(self):
+        self.sync(interface('eth0', ips=['10.0.0.256/24', '10.0.0.5/24']))
+        self.assertEqual(self.addresses(), {('eth0', '10.0.0.5/24')})
+
+    def test_stale_kept(self):
+        self.sync(interface('eth0', ips=['10.0.0.5/24', '10.0.1.5/24']))
+        self.sync(interface('eth0', ips=['10.0.0.5/24']))
+        self.assertEqual(self.addresses(), {('eth0', '10.0.0.5/24'), ('eth0', '10.0.1.5/24')})
+
+    def test_stale_unassigned(self):
+        self.sync(interface('eth0', ips=['10.0.0.5/24', '10.0.1.5/24']), interface('eth1', ips=['10.0.2.5/24']))
+        with mock.patch.object(collector, 'UNASSIGN_STALE_ADDRESSES', True):
+            # Addresses of not synced interfaces are not touched
+            self.sync(interface('eth0', ips=['10.0.0.5/24']))
+        self.assertEqual(self.addresses(), {('eth0', '10.0.0.5/24'), (None, '10.0.1.5/24'),
+                                            ('eth1', '10.0.2.5/24')})
+
+
+class UpdateFieldsTest(SyncTestCase):
+
+    def test_converted_values(self):
+        iface = Interface(device=self.device, name='eth0', mtu=1500, enabled=True, description='')
+        # Values from outputs are strings - same values after conversion are not changed
+        self.assertEqual(collector._update_fields(iface, {'mtu': '1500', 'enabled': True, 'description': ''}), [])
+        self.assertEqual(collector._update_fields(iface, {'mtu': '9000', 'description': 'uplink'}),
+                         ['mtu', 'description'])
+        self.assertEqual(iface.mtu, 9000)
+        self.assertEqual(iface.description, 'uplink')
+
+    def test_foreign_key(self):
+        vendor = Manufacturer.objects.create(name='Samsung', slug='samsung')
+        item = InventoryItem(device=self.device, name='sda', manufacturer=self.manufacturer)
+        self.assertEqual(collector._update_fields(item, {'manufacturer_id': self.manufacturer.pk}), [])
+        self.assertEqual(collector._update_fields(item, {'manufacturer_id': vendor.pk}), ['manufacturer'])
+        self.assertEqual(item.manufacturer, vendor)
+
+    def test_invalid_value(self):
+        # Not converted value is set as is - it will be rejected by database or by model validation
+        iface = Interface(device=self.device, name='eth0', mtu=1500)
+        self.assertEqual(collector._update_fields(iface, {'mtu': 'auto'}), ['mtu'])
+        self.assertEqual(iface.mtu, 'auto')
+
+    def test_last_updated(self):
+        cluster = Cluster.objects.create(name='srv01', type=ClusterType.objects.get())
+        vm = VirtualMachine.objects.create(cluster=cluster, name='vm1', vcpus=2)
+        old = timezone.now() - timedelta(days=1)
+        VirtualMachine.objects.filter(pk=vm.pk).update(last_updated=old)
+        vm.refresh_from_db()
+        self.assertEqual(collector._update_fields(vm, {'vcpus': '2'}), [])
+        self.assertEqual(vm.last_updated, old)
+        # auto_now is not filled by bulk_update() and save(update_fields) - it is set as changed field
+        self.assertEqual(collector._update_fields(vm, {'vcpus': '4'}), ['vcpus', 'last_updated'])
+        collector._bulk_update(VirtualMachine, [(vm, ['vcpus', 'last_updated'])])
+        self.assertGreater(VirtualMachine.objects.get(pk=vm.pk).last_updated, old)
+
+    def test_save_changes(self):
+        iface = Interface.objects.create(device=self.device, name='eth0', mtu=1500)
+        with mock.patch.object(iface, 'save') as save:
+            self.assertEqual(collector._save_changes(iface, {'mtu': '1500'}), [])
+            save.assert_not_called()
+            self.assertEqual(collector._save_changes(iface, {'mtu': '9000'}), ['mtu'])
+            save.assert_called_once_with(update_fields=['mtu'])
+
+
+def domain(name, state='1', mem='2097152', vcpu='2', disks=()):
+    """ VM row, same as virsh domstats template returns
+
+        :param disks: list of tuples (index, name, path, size)
+    """
+    return {'NAME': name, 'MEM': mem, 'VCPU': vcpu, 'STATE': state,
+            'DISKNAMES': [{'diskindex': index, 'name': disk} for index, disk, _, _ in disks],
+            'DISKPATHS': [{'diskindex': index, 'path': path} for index, _, path, _ in disks],
+            'DISKSIZES': [{'diskindex': index, 'size': size} for index, _, _, size in disks]}
+
+
+class SyncVMsTest(SyncTestCase):
+
+    def test_create(self):
+        result, _ = collector.sync_vms(self.device, [domain('vm1'), domain('vm2', state='5', vcpu='4')])
+        self.assertTrue(result)
+        cluster = Cluster.objects.get(name=self.device.name)
+        self.assertEqual(cluster.type.name, DEFAULT_CLUSTER_TYPE)
+        self.assertEqual(list(cluster.devices.all()), [self.device])
+        vms = {vm.name: vm for vm in VirtualMachine.objects.all()}
+        self.assertEqual(set(vms), {'vm1', 'vm2'})
+        self.assertEqual(vms['vm1'].cluster, cluster)
+        self.assertEqual(vms['vm1'].platform, self.platform)
+        self.assertEqual(vms['vm1'].role, self.role)
+        self.assertEqual(vms['vm1'].memory, 2048)
+        self.assertEqual(vms['vm1'].status, DEVICE_STATUS_ACTIVE)
+        self.assertEqual(vms['vm2'].vcpus, 4)
+        self.assertEqual(vms['vm2'].status, DEVICE_STATUS_OFFLINE)
+
+    def test_update_changed_only(self):
+        collector.sync_vms(self.device, [domain('vm1'), domain('vm2')])
+        with mock.patch.object(collector, '_bulk_update', wraps=collector._bulk_update) as bulk_update:
+            result, _ = collector.sync_vms(self.device, [domain('vm1'), domain('vm2', vcpu='8')])
+        self.assertTrue(result)
+        changed = bulk_update.call_args[0][1]
+        self.assertEqual([(vm.name, fields) for vm, fields in changed], [('vm2', ['vcpus', 'last_updated'])])
+        self.assertEqual(VirtualMachine.objects.count(), 2)
+        self.assertEqual(Cluster.objects.count(), 1)
+        self.assertEqual(VirtualMachine.objects.get(name='vm2').vcpus, 8)
+
+    def test_missing_staged(self):
+        collector.sync_vms(self.device, [domain('vm1'), domain('vm2')])
+        collector.sync_vms(self.device, [domain('vm1')])
+        self.assertEqual(VirtualMachine.objects.get(name='vm1').status, DEVICE_STATUS_ACTIVE)
+        self.assertEqual(VirtualMachine.objects.get(name='vm2').status, DEVICE_STATUS_STAGED)
+
+    def test_nothing_to_sync(self):
+        result, detail = collector.sync_vms(self.device, [])
+        self.assertFalse(result)
+        self.assertEqual(detail, "There is no VM to update")
+        self.assertFalse(Cluster.objects.exists())
+
+
+class VMDisksTest(SyncTestCase):
+
+    def comments(self, name):
+        return VirtualMachine.objects.get(name=name).comments
+
+    def test_joined_by_index(self):
+        gb = str(1024 ** 3)
+        row = domain('vm1', disks=[('0', 'vda', '/var/lib/libvirt/images/vm1.qcow2', str(20 * 1024 ** 3)),
+                                   ('1', 'vdb', '/dev/vg0/vm1', gb)])
+        # Records of disk are not always in order of index
+        row['DISKSIZES'].reverse()
+        row['DISKPATHS'].append({'diskindex': '2', 'path': '/dev/sr0'})
+        collector.sync_vms(self.device, [row])
+        vm = VirtualMachine.objects.get(name='vm1')
+        self.assertEqual(vm.disk, 21)
+        self.assertEqual(vm.comments,
+                         "**Disk:** vda\t**Size:** 20 GB\t**Path:** /var/lib/libvirt/images/vm1.qcow2\n"
+                         "**Disk:** vdb\t**Size:** 1 GB\t**Path:** /dev/vg0/vm1\n" + SEPARATOR)
+
+    def test_comments_kept(self):
+        collector.sync_vms(self.device, [domain('vm1', disks=[('0', 'vda', '/dev/vda', str(1024 ** 3))])])
+        vm = VirtualMachine.objects.get(name='vm1')
+        vm.comments += 'Owner: admin'
+        vm.save()
+        collector.sync_vms(self.device, [domain('vm1', disks=[('0', 'vda', '/dev/vda', str(2 * 1024 ** 3))])])
+        self.assertEqual(self.comments('vm1'),
+                         "**Disk:** vda\t**Size:** 2 GB\t**Path:** /dev/vda\n" + SEPARATOR + 'Owner: admin')
+
+    def test_invalid_size(self):
+        # Disk without size is skipped, other disks are synced
+        row = domain('vm1', disks=[('0', 'vda', '/dev/vda', str(1024 ** 3))])
+        row['DISKNAMES'].append({'diskindex': '1', 'name': 'vdb'})
+        result, _ = collector.sync_vms(self.device, [row])
+        self.assertTrue(result)
+        self.assertEqual(self.comments('vm1'), "**Disk:** vda\t**Size:** 1 GB\t**Path:** /dev/vda\n" + SEPARATOR)
+        self.assertEqual(VirtualMachine.objects.get(name='vm1').disk, 1)
+
+
+class JobsTest(SyncTestCase):
+
+    def test_claim(self):
+        first = jobs.enqueue_query({'action': 'sync', 'data': []})
+        second = jobs.enqueue_query({'action': 'sync', 'data': []})
+        claimed = jobs.claim_jobs(1)
+        self.assertEqual(claimed, [first])
+        self.assertEqual(claimed[0].status, JOB_STATUS_RUNNING)
+        self.assertIsNotNone(Job.objects.get(pk=first.pk).started)
+        # Running jobs are not claimed again
+        self.assertEqual(jobs.claim_jobs(10), [second])
+        self.assertEqual(jobs.claim_jobs(10), [])
+
+    def test_stale_requeued(self):
+        job = jobs.enqueue_query({'action': 'sync', 'data': []})
+        jobs.claim_jobs(10)
+        Job.objects.filter(pk=job.pk).update(started=timezone.now() - timedelta(seconds=jobs.JOB_TIMEOUT + 60))
+        with mock.patch.object(jobs, 'JOB_TIMEOUT', 0):
+            self.assertEqual(jobs.claim_jobs(10), [])
+        self.assertEqual(jobs.claim_jobs(10), [job])
+        self.assertEqual(Job.objects.get(pk=job.pk).status, JOB_STATUS_RUNNING)
+
+    def test_run(self):
+        job = jobs.enqueue_query({'action': 'sync',
+                                  'data': [{'hostname': 'srv01', 'command': 'lsblk', 'data': LSBLK}]})
+        broken = Job.objects.create(payload='{"action": "sync", "data": [')
+        self.assertEqual(jobs.run_pending_jobs(concurrency=1), 2)
+        job.refresh_from_db()
+        self.assertEqual(job.status, JOB_STATUS_COMPLETED)
+        self.assertTrue(jobs.get_job_status(job)['result'])
+        self.assertTrue(self.device.inventory_items.filter(name='sda').exists())
+        broken.refresh_from_db()
+        self.assertEqual(broken.status, JOB_STATUS_FAILED)
+        self.assertFalse(jobs.get_job_status(broken)['result'])
+        self.assertEqual(jobs.run_pending_jobs(concurrency=1), 0)
+
+    def test_device_lock(self):
+        # Syncs of one device by several workers wait for each other - row is locked before any change
+        states = []
+        lock_device = collector._lock_device
+
+        def lock(device):
+            states.append((device.pk, device.inventory_items.count()))
+            with self.assertNumQueries(1):
+                lock_device(device)
+
+        with mock.patch.object(collector, '_lock_device', side_effect=lock):
+            results = collector.sync_hosts(collector.get_parser(),
+                                           [{'hostname': 'srv01', 'command': 'lsblk', 'data': LSBLK}])
+        self.assertTrue(results[0]['result'])
+        self.assertEqual(states, [(self.device.pk, 0)])
+        self.assertTrue(self.device.inventory_items.exists())
+
+
+class ShardsTest(SimpleTestCase):
+
+    def test_get_shard(self):
+        for hostname in ('srv01', 'srv02', 'switch-1', '', None):
+            shard = jobs.get_shard(hostname, 4)
+            self.assertIn(shard, range(4))
+            self.assertEqual(jobs.get_shard(hostname, 4), shard)
+
+    def test_split_job(self):
+        hosts = [{'hostname': 'srv{:02}'.format(i % 5), 'command': 'lsblk', 'data': ''} for i in range(20)]
+        job = Job(payload=json.dumps({'action': 'sync', 'force': True, 'data': hosts}))
+        force, count, shards = jobs._split_job(job, 3)
+        self.assertTrue(force)
+        self.assertEqual(count, 20)
+        indexes = sorted(index for items in shards.values() for index, _ in items)
+        self.assertEqual(indexes, list(range(20)))
+        for shard, items in shards.items():
+            for index, host in items:
+                self.assertEqual(host, hosts[index])
+                self.assertEqual(jobs.get_shard(host['hostname'], 3), shard)
+
+    def test_broken_job(self):
+        for payload in ('{"action": "sync", "data": [', '{"action": "sync", "data": []}'):
+            job = Job(payload=payload)
+            with mock.patch.object(job, 'save'):
+                self.assertIsNone(jobs._split_job(job, 3))
+            self.assertEqual(job.status, JOB_STATUS_FAILED)
+
+
+class ShardedJobsTest(TransactionTestCase):
+    """ Jobs are processed by threads with own database connections, so data should be committed
+    """
+
+    def test_run(self):
+        hostnames = ['srv{:02}'.format(i) for i in range(8)]
+        payloads = [{'action': 'sync', 'data': [{'hostname': hostname, 'command': 'lsblk', 'data': ''}
+                                                for hostname in hostnames[i:] + hostnames[:i]]}
+                    for i in range(3)]
+        queued = [jobs.enqueue_query(payload) for payload in payloads]
+
+        threads = {}
+        sync_hosts = collector.sync_hosts
+
+        def record(parser, hostlist, **kwargs):
+            for host in hostlist:
+                threads.setdefault(host['hostname'], set()).add(threading.get_ident())
+            return sync_hosts(parser, hostlist, **kwargs)
+
+        with mock.patch.object(collector, 'sync_hosts', side_effect=record):
+            self.assertEqual(jobs.run_pending_jobs(concurrency=4), 3)
+
+        # Every device was synced by one thread
+        self.assertEqual(set(threads), set(hostnames))
+        self.assertTrue(all(len(idents) == 1 for idents in threads.values()))
+        # Results are in order of hosts in query
+        for job, payload in zip(queued, payloads):
+            job.refresh_from_db()
+            self.assertEqual(job.status, JOB_STATUS_FAILED)
+            detail = jobs.get_job_status(job)['detail']
+            self.assertEqual([result['hostname'] for result in detail],
+                             [host['hostname'] for host in payload['data']])
+            self.assertEqual(detail[0]['detail'], "Not found device by hostname: {}".format(detail[0]['hostname']))
+
+
+class DigestsTest(SyncTestCase):
+
+    def setUp(self):
+        super(DigestsTest, self).setUp()
+        self.parser = collector.get_parser()
+
+    def sync(self, data, command='lsblk', force=False):
+        results = collector.sync_hosts(self.parser, [{'hostname': 'srv01', 'command': command, 'data': data}],
+                                       force=force)
+        return results[0]['result'], results[0]['detail']
+
+    def test_skipped(self):
+        self.assertEqual(self.sync(LSBLK), (True, "Device srv01 synced successfully"))
+        with mock.patch.object(collector, '_sync_host') as sync_host:
+            self.assertEqual(self.sync(LSBLK), (True, "Output was not changed since last sync - skipped"))
+            sync_host.assert_not_called()
+        self.assertEqual(SyncDigest.objects.get(hostname='srv01', command='lsblk').digest,
+                         collector._get_digest(LSBLK))
+
+    def test_changed(self):
+        self.sync(LSBLK)
+        result, detail = self.sync(LSBLK_MODELS)
+        self.assertTrue(result)
+        self.assertNotEqual(detail, "Output was not changed since last sync - skipped")
+        self.assertEqual(SyncDigest.objects.get(hostname='srv01', command='lsblk').digest,
+                         collector._get_digest(LSBLK_MODELS))
+
+    def test_force(self):
+        self.sync(LSBLK)
+        self.assertEqual(self.sync(LSBLK, force=True), (True, "Device srv01 already synced - nothing to change"))
+        # Force of one host in batch
+        results = collector.sync_hosts(self.parser, [{'hostname': 'srv01', 'command': 'lsblk', 'data': LSBLK,
+                                                      'force': True}])
+        self.assertEqual(results[0]['detail'], "Device srv01 already synced - nothing to change")
+
+    def test_not_changed_inventory(self):
+        # Output, which was synced before digests, changes nothing - but it is synced
+        self.sync(LSBLK)
+        SyncDigest.objects.all().delete()
+        self.assertEqual(self.sync(LSBLK), (True, "Device srv01 already synced - nothing to change"))
+        self.assertTrue(SyncDigest.objects.filter(hostname='srv01', command='lsblk').exists())
+
+    def test_failed(self):
+        result, _ = self.sync('', command='unknown command')
+        self.assertFalse(result)
+        result, _ = self.sync('')
+        self.assertFalse(result)
+        self.assertFalse(SyncDigest.objects.exists())
+
+    def test_disabled(self):
+        with mock.patch.object(collector, 'DEDUPLICATE_OUTPUTS', False):
+            self.sync(LSBLK)
+            self.assertEqual(self.sync(LSBLK), (True, "Device srv01 already synced - nothing to change"))
+        self.assertFalse(SyncDigest.objects.exists())
+
+
+class ReadQueryTest(SimpleTestCase):
+
+    hosts = [{'hostname': 'srv{:02}'.format(i), 'command': 'lsblk', 'data': LSBLK} for i in range(10)]
+
+    def read(self, body, **extra):
+        request = APIRequestFactory().post('/api/collector/', body, content_type='application/json', **extra)
+        return ingest.read_query(Request(request))
+
+    def test_stream(self):
+        query = self.read(json.dumps({'action': 'sync', 'force': True, 'data': self.hosts}))
+        self.assertEqual(query['action'], 'sync')
+        self.assertTrue(query['force'])
+        # Hosts are read from body while syncing
+        self.assertNotIsInstance(query['data'], list)
+        self.assertEqual(list(query['data']), self.hosts)
+
+    def test_data_first(self):
+        query = self.read('{"data": %s, "action": "sync"}' % json.dumps(self.hosts))
+        self.assertEqual(query, {'action': 'sync', 'data': self.hosts})
+
+    def test_gzip(self):
+        body = gzip.compress(json.dumps({'action': 'sync', 'data': self.hosts}).encode('utf-8'))
+        query = self.read(body, HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(list(query['data']), self.hosts)
+
+    def test_empty(self):
+        with self.assertRaises(ingest.RequestError):
+            self.read('')
+
+    def test_unsupported_encoding(self):
+        with self.assertRaises(ingest.RequestError):
+            self.read(json.dumps({'action': 'sync', 'data': self.hosts}), HTTP_CONTENT_ENCODING='br')
+
+    def test_malformed(self):
+        with self.assertRaises(ingest.RequestError):
+            self.read('{"action" "sync"}')
+        # Broken item is found while syncing previous items
+        query = self.read('{"action": "sync", "data": [{"hostname": "srv01"}, {"hostname": ')
+        data = iter(query['data'])
+        self.assertEqual(next(data), {'hostname': 'srv01'})
+        with self.assertRaises(ingest.RequestError):
+            next(data)
+
+    def test_keys_after_data(self):
+        query = self.read('{"action": "sync", "data": %s, "timings": true, "force": false}' % json.dumps(self.hosts))
+        self.assertNotIn('timings', query)
+        self.assertEqual(list(query['data']), self.hosts)
+        # Keys after data are read after its last item
+        self.assertTrue(query['timings'])
+        self.assertFalse(query['force'])
+
+    def test_control_key_after_data(self):
+        query = self.read('{"action": "sync", "data": %s, "force": true}' % json.dumps(self.hosts))
+        data = iter(query['data'])
+        self.assertEqual([next(data) for _ in self.hosts], self.hosts)
+        with self.assertRaisesMessage(ingest.RequestError, "Key 'force' should be before \"data\""):
+            next(data)
+
+    def test_item_too_large(self):
+        hosts = self.hosts + [{'hostname': 'srv99', 'command': 'lsblk', 'data': 'x' * 100000}]
+        with mock.patch.object(ingest, 'MAX_ITEM_SIZE', 10000):
+            query = self.read(json.dumps({'action': 'sync', 'data': hosts}))
+            with self.assertRaisesMessage(ingest.RequestError, "Query item is too large"):
+                list(query['data'])
+
+    def test_body_too_large(self):
+        # Limit is checked for decompressed body
+        body = gzip.compress(json.dumps({'action': 'sync', 'data': self.hosts * 100}).encode('utf-8'))
+        with mock.patch.object(ingest, 'MAX_REQUEST_SIZE', len(body) * 2), \
+                self.assertRaisesMessage(ingest.RequestError, "Request is too large"):
+            list(self.read(body, HTTP_CONTENT_ENCODING='gzip')['data'])
+
+
+class ClientTest(SimpleTestCase):
+
+    def setUp(self):
+        self.client_new = load_util('client-new')
+
+    def read(self, content, host_filter=None):
+        return self.client_new._read_sync_items(io.StringIO(content), host_filter)
+
+    def test_read_items(self):
+        items = [{'hostname': 'srv01', 'command': 'lsblk', 'data': LSBLK},
+                 {'hostname': 'srv02', 'command': 'ip a', 'data': IP_A}]
+        self.assertEqual(self.read(json.dumps(items)), items)
+        self.assertEqual(self.read(json.dumps({'action': 'sync', 'data': items})), items)
+        self.assertEqual(self.read("\n".join(json.dumps(item) for item in items) + "\n"), items)
+        self.assertEqual(self.read(json.dumps(items), 'srv02'), items[1:])
+
+    def test_read_one_host(self):
+        item = {'hostname': 'srv01', 'command': 'lsblk', 'data': LSBLK}
+        # Same for JSON with one host and JSONL with one line - output in "data" is not a list of items
+        self.assertEqual(self.read(json.dumps(item)), [item])
+        self.assertEqual(self.read(json.dumps(item) + "\n"), [item])
+        self.assertEqual(self.read(json.dumps({'action': 'sync', 'data': LSBLK})), [])
+
+
+@skipUnless(importlib.util.find_spec('napalm'), "NAPALM is not installed")
+class NapalmSyncTest(SimpleTestCase):
+
+    def setUp(self):
+        self.napalm_sync = load_util('napalm_sync')
+
+    def device(self, name):
+        return SimpleNamespace(name=name, platform=SimpleNamespace(napalm_driver='ios'), primary_ip='10.0.0.1')
+
+    def test_device_timeout(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        collecting = {}
+
+        def collect_device(device, *args):
+            collecting[device.name] = threading.current_thread()
+            if device.name == 'slow':
+                release.wait()
+            return {}
+
+        args = SimpleNamespace(workers=2, timeout=1, device_timeout=0.1, iface_regex=None, user='user',
+                               no_interfaces=False, no_inventory=False)
+        output = io.StringIO()
+        with mock.patch.object(self.napalm_sync, 'collector', collector, create=True), \
+                mock.patch.object(self.napalm_sync, 'getDevices', return_value=[self.device('slow'),
+                                                                                 self.device('fast')]), \
+                mock.patch.object(self.napalm_sync, 'collectDevice', side_effect=collect_device), \
+                mock.patch.object(self.napalm_sync, 'syncDevice', return_value=[('interfaces', True, "ok")]), \
+                mock.patch('sys.stdout', output):
+            self.assertFalse(self.napalm_sync.syncDevices(args, 'password'))
+        self.assertIn("slow connect: Data was not collected in 0.1 seconds", output.getvalue())
+        self.assertIn("fast interfaces: ok", output.getvalue())
+        self.assertNotIn("  fast", output.getvalue())
+        # Hanging thread does not block exit of script
+        self.assertTrue(collecting['slow'].is_alive())
+        self.assertTrue(collecting['slow'].daemon)
+
+
+class IndexViewTest(SyncTestCase):
+
+    def post(self, body, **extra):
+        request = APIRequestFactory().post('/api/collector/', body, content_type='application/json', **extra)
+        force_authenticate(request, User.objects.create(username='admin'))
+        return views.index(request).data
+
+    def test_sync(self):
+        body = gzip.compress(json.dumps({'action': 'sync',
+                                         'data': [{'hostname': 'srv01', 'command': 'lsblk', 'data': LSBLK},
+                                                  {'hostname': 'srv02', 'command': 'lsblk', 'data': LSBLK}]})
+                             .encode('utf-8'))
+        response = self.post(body, HTTP_CONTENT_ENCODING='gzip')
+        self.assertFalse(response['result'])
+        self.assertEqual([host['result'] for host in response['detail']], [True, False])
+        self.assertTrue(self.device.inventory_items.filter(name='sda').exists())
+
+    def test_malformed(self):
+        response = self.post('{"action": "sync", "data": [{"hostname": ')
+        self.assertFalse(response['result'])
+        self.assertTrue(response['detail'].startswith("Cannot parse a query"))
+
+    def test_partial(self):
+        body = '{"action": "sync", "data": [%s, {"hostname": ' % json.dumps({'hostname': 'srv01', 'command': 'lsblk',
+                                                                               'data': LSBLK})
+        with mock.patch.object(collector, 'SYNC_BATCH_SIZE', 1):
+            response = self.post(body)
+        self.assertFalse(response['result'])
+        self.assertTrue(response['detail'].startswith("Cannot parse a query"))
+        # First host is already saved - its result is returned with error
+        self.assertEqual([(host['hostname'], host['result']) for host in response['hosts']], [('srv01', True)])
+        self.assertTrue(self.device.inventory_items.filter(name='sda').exists())
+
+    def test_timings_after_data(self):
+        body = '{"action": "sync", "data": [%s], "timings": true}' % json.dumps({'hostname': 'srv01',
+                                                                                'command': 'lsblk', 'data': LSBLK})
+        response = self.post(body)
+        self.assertTrue(response['result'])
+        self.assertIn('timings', response)
+
+
+class MetricsTest(TestCase):
+
+    def test_stage(self):
+        with metrics.stage('test_stage'):
+            Job.objects.count()
+            Job.objects.count()
+        text = metrics.render()
+        self.assertIn('collector_stage_seconds_count{stage="test_stage"} 1\n', text)
+        self.assertIn('collector_stage_seconds_bucket{stage="test_stage",le="+Inf"} 1\n', text)
+        self.assertIn('collector_stage_queries_total{stage="test_stage"} 2\n', text)
+
+    def test_failed_stage(self):
+        with self.assertRaises(ValueError), metrics.stage('test_failed_stage'):
+            raise ValueError()
+        self.assertIn('collector_stage_seconds_count{stage="test_failed_stage"} 1\n', metrics.render())
+
+    def test_disabled(self):
+        with mock.patch.object(metrics, 'METRICS_ENABLED', False), metrics.stage('test_disabled'):
+            pass
+        self.assertNotIn('test_disabled', metrics.render())
+
+    def test_timings(self):
+        metrics.start_request()
+        with metrics.stage('test_timings'):
+            Job.objects.count()
+        timings = metrics.get_timings()
+        self.assertEqual(timings['test_timings']['count'], 1)
+        self.assertEqual(timings['test_timings']['queries'], 1)
+        # Stages out of request are not collected
+        with metrics.stage('test_timings'):
+            pass
+        self.assertEqual(metrics.get_timings(), {})
+
+    def test_view(self):
+        with metrics.stage('test_view'):
+            pass
+        request = APIRequestFactory().get('/api/collector/metrics/')
+        force_authenticate(request, User.objects.create(username='admin'))
+        response = views.metrics_view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'collector_stage_seconds_count{stage="test_view"} 1\n', response.content)
+
+    def test_view_not_authenticated(self):
+        response = views.metrics_view(APIRequestFactory().get('/api/collector/metrics/'))
+        self.assertIn(response.status_code, (401, 403))
+
+
+class ListHandler(logging.Handler):
+    """ Keeps messages of records, waits for "resume" event before every record
+    """
+
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.messages = []
+        self.writing = threading.Event()
+        self.resume = threading.Event()
+        self.resume.set()
+
+    def emit(self, record):
+        self.writing.set()
+        self.resume.wait()
+        self.messages.append(record.getMessage())
+
+
+def log_record(msg, level=logging.DEBUG, **extra):
+    record = logging.LogRecord('collector', level, __file__, 0, msg, (), None)
+    record.__dict__.update(extra)
+    return record
+
+
+class LogsTest(SimpleTestCase):
+
+    def handler(self, queue_size=10):
+        target = ListHandler()
+        handler = logs.QueueTargetHandler(target, queue_size)
+        self.addCleanup(handler.close)
+        self.addCleanup(target.resume.set)
+        return handler, target
+
+    def test_queue(self):
+        handler, target = self.handler()
+        args = ['eth0']
+        record = logging.LogRecord('collector', logging.INFO, __file__, 0, "Interface %s", (args,), None)
+        handler.handle(record)
+        # Args changed after logging are not written
+        args[0] = 'eth1'
+        handler.close()
+        self.assertEqual(target.messages, ["Interface ['eth0']"])
+
+    def test_drop(self):
+        handler, target = self.handler(queue_size=1)
+        target.resume.clear()
+        handler.handle(log_record("first"))
+        # Listener is writing first record, second one fills the queue
+        self.assertTrue(target.writing.wait(5))
+        for msg in ("second", "third", "fourth"):
+            handler.handle(log_record(msg))
+        self.assertEqual(handler.dropped, 2)
+        target.resume.set()
+        handler.close()
+        self.assertEqual(target.messages, ["first", "second"])
+
+    def test_fork(self):
+        handler, target = self.handler()
+        handler.handle(log_record("parent"))
+        listener = handler.listener
+        # Handler was created by parent process - listener thread is not running in this one
+        handler._pid = -1
+        listener.stop()
+        handler.handle(log_record("child"))
+        self.assertIsNot(handler.listener, listener)
+        self.assertEqual(handler._pid, os.getpid())
+        handler.close()
+        self.assertEqual(target.messages, ["parent", "child"])
+
+    def test_sampling(self):
+        sampling = logs.SamplingFilter(rate=3)
+        passed = [sampling.filter(log_record("Interface is synced", device='srv01')) for _ in range(7)]
+        self.assertEqual(passed, [True, False, False, True, False, False, True])
+        # Counters are per device and message
+        self.assertTrue(sampling.filter(log_record("Interface is synced", device='srv02')))
+        self.assertTrue(sampling.filter(log_record("VM is synced", device='srv01')))
+        # Changes and messages without device are not sampled
+        for _ in range(3):
+            self.assertTrue(sampling.filter(log_record("Interface is synced", logging.INFO, device='srv01')))
+            self.assertTrue(sampling.filter(log_record("Interface is synced")))
+        self.assertTrue(all(logs.SamplingFilter().filter(log_record("Interface is synced", device='srv01'))
+                            for _ in range(3)))
+
+    def test_sampling_keys(self):
+        sampling = logs.SamplingFilter(rate=3, max_keys=2)
+        sampling.filter(log_record("Interface is synced", device='srv01'))
+        sampling.filter(log_record("Interface is synced", device='srv02'))
+        # Full counters are cleared
+        sampling.filter(log_record("Interface is synced", device='srv03'))
+        self.assertEqual(list(sampling.counters), [('srv03', "Interface is synced")])
+        self.assertTrue(sampling.filter(log_record("Interface is synced", device='srv01')))
+
+
+class ChangeLogTest(DeviceMixin, TransactionTestCase):
+    """ Changes are written after commit, so every test needs a real transaction
+    """
+
+    def setUp(self):
+        super(ChangeLogTest, self).setUp()
+        changelog.set_author()
+
+    def changes(self):
+        return sorted((change.object_repr, change.action, change.related_object_id, change.user_name)
+                      for change in ObjectChange.objects.filter(related_object_id__isnull=False))
+
+    def test_written_after_commit(self):
+        with transaction.atomic():
+            collector.sync_interfaces(self.device, [interface('eth0'), interface('eth1')])
+            self.assertFalse(ObjectChange.objects.exists())
+        self.assertEqual(self.changes(), [('eth0', OBJECTCHANGE_ACTION_CREATE, self.device.pk, CHANGELOG_USERNAME),
+                                          ('eth1', OBJECTCHANGE_ACTION_CREATE, self.device.pk, CHANGELOG_USERNAME)])
+        # Changes of one sync are written with one request id
+        self.assertEqual(ObjectChange.objects.values('request_id').distinct().count(), 1)
+
+        ObjectChange.objects.all().delete()
+        with transaction.atomic():
+            collector.sync_interfaces(self.device, [interface('eth0'), interface('eth1', mtu='9000')])
+        self.assertEqual(self.changes(), [('eth1', OBJECTCHANGE_ACTION_UPDATE, self.device.pk, CHANGELOG_USERNAME)])
+
+    def test_rolled_back(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            collector.sync_interfaces(self.device, [interface('eth0')])
+            raise RuntimeError()
+        self.assertFalse(ObjectChange.objects.exists())
+        self.assertFalse(Interface.objects.exists())
+
+    def test_author(self):
+        user = User.objects.create(username='admin')
+        changelog.set_author(user)
+        with transaction.atomic():
+            collector.sync_interfaces(self.device, [interface('eth0')])
+        self.assertEqual(self.changes(), [('eth0', OBJECTCHANGE_ACTION_CREATE, self.device.pk, 'admin')])
+        self.assertEqual(ObjectChange.objects.get().user, user)
+
+    def test_disabled(self):
+        with mock.patch.object(changelog, 'CHANGELOG_ENABLED', False), transaction.atomic():
+            collector.sync_interfaces(self.device, [interface('eth0')])
+        self.assertFalse(ObjectChange.objects.exists())
+
+
+def inventory_item(name, descr='', pid='', serial='', vendor=None):
+    """ Inventory row, same as inventory templates return
+    """
+    row = {'Name': name, 'Descr': descr, 'PartID': pid, 'Serial': serial}
+    if vendor is not None:
+        row['Vendor'] = vendor
+    return row
+
+
+class SyncInventoryTest(SyncTestCase):
+
+    def items(self):
+        return {(item.name, item.serial): item for item in self.device.inventory_items.all()}
+
+    def test_create(self):
+        samsung = Manufacturer.objects.create(name='Samsung', slug='samsung')
+        result, detail = collector.sync_inventory(self.device, [
+            inventory_item('sda', '1.8T', 'SSD 860 EVO', 'S3Z1234', vendor='Samsung'),
+            inventory_item('sdb', '1.8T', vendor='Unknown'),
+            inventory_item('CPU0', 'Xeon'),
+        ])
+        self.assertEqual((result, detail), (True, "Device srv01 synced successfully"))
+        items = self.items()
+        self.assertEqual(set(items), {('sda', 'S3Z1234'), ('sdb', ''), ('CPU0', '')})
+        self.assertEqual(items[('sda', 'S3Z1234')].manufacturer, samsung)
+        self.assertEqual(items[('sda', 'S3Z1234')].part_id, 'SSD 860 EVO')
+        self.assertEqual(items[('sdb', '')].manufacturer.name, '--- NoName ---')
+        # Rows without vendor are made by device vendor
+        self.assertEqual(items[('CPU0', '')].manufacturer, self.manufacturer)
+        self.assertTrue(all(item.discovered for item in items.values()))
+
+    def test_update_changed_only(self):
+        rows = [inventory_item('sda', '1.8T', serial='A1'), inventory_item('sdb', '1.8T', serial='B1')]
+        collector.sync_inventory(self.device, rows)
+        self.assertEqual(collector.sync_inventory(self.device, rows),
+                         (True, "Device srv01 already synced - nothing to change"))
+        rows[1]['Descr'] = '2T'
+        with mock.patch.object(collector, '_bulk_update', wraps=collector._bulk_update) as bulk_update:
+            result, _ = collector.sync_inventory(self.device, rows)
+        self.assertTrue(result)
+        changed = bulk_update.call_args[0][1]
+        self.assertEqual([(item.name, fields) for item, fields in changed], [('sdb', ['description'])])
+        self.assertEqual(len(self.items()), 2)
+        self.assertEqual(self.items()[('sdb', 'B1')].description, '2T')
+
+    def test_duplicated_rows(self):
+        collector.sync_inventory(self.device, [inventory_item('DIMM', '16GB'), inventory_item('DIMM', '16GB')])
+        self.assertEqual(self.device.inventory_items.count(), 1)
+
+    def test_stale_kept(self):
+        collector.sync_inventory(self.device, [inventory_item('sda', serial='A1'), inventory_item('sdb', serial='B1')])
+        collector.sync_inventory(self.device, [inventory_item('sda', serial='A1')])
+        self.assertEqual(set(self.items()), {('sda', 'A1'), ('sdb', 'B1')})
+
+    def test_stale_deleted(self):
+        manual = InventoryItem.objects.create(device=self.device, name='Rails', discovered=False)
+        collector.sync_inventory(self.device, [inventory_item('sda', serial='A1'), inventory_item('sdb', serial='B1')])
+        with mock.patch.object(collector, 'DELETE_STALE_INVENTORY', True):
+            # Replaced disk has another serial
+            result, _ = collector.sync_inventory(self.device, [inventory_item('sda', serial='A1'),
+                                                               inventory_item('sdb', serial='B2')])
+        self.assertTrue(result)
+        self.assertEqual(set(self.items()), {('sda', 'A1'), ('sdb', 'B2'), ('Rails', '')})
+        self.assertTrue(InventoryItem.objects.filter(pk=manual.pk).exists())
+
+    def test_bulk_error(self):
+        # Items are saved one by one, if bulk insert fails
+        with mock.patch.object(InventoryItem.objects, 'bulk_create', side_effect=IntegrityError('error')):
+            result, _ = collector.sync_inventory(self.device, [inventory_item('sda'), inventory_item('sdb')])
+        self.assertTrue(result)
+        self.assertEqual(set(self.items()), {('sda', ''), ('sdb', '')})
+
+    def test_save_error(self):
+        with mock.patch.object(InventoryItem.objects, 'bulk_create', side_effect=IntegrityError('error')), \
+                mock.patch.object(InventoryItem, 'save', side_effect=IntegrityError('error')):
+            result, detail = collector.sync_inventory(self.device, [inventory_item('sda')])
+        self.assertEqual((result, detail), (False, "Device srv01 was not synced, see a log for details"))
+        self.assertFalse(self.device.inventory_items.exists())
+
+
+class ReferenceCacheTest(SyncTestCase):
+
+    def test_reference(self):
+        self.assertEqual(cache.get_reference(Platform, 'Linux'), self.platform)
+        with self.assertNumQueries(0):
+            platform = cache.get_reference(Platform, 'Linux')
+        # Changed object is fetched again
+        platform.slug = 'gnu-linux'
+        platform.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(cache.get_reference(Platform, 'Linux').slug, 'gnu-linux')
+
+    def test_reference_expired(self):
+        cache.get_reference(Platform, 'Linux')
+        with mock.patch.object(cache, 'REFERENCE_CACHE_TTL', 0), self.assertNumQueries(1):
+            cache.get_reference(Platform, 'Linux')
+
+    def test_reference_not_found(self):
+        with self.assertRaises(Platform.DoesNotExist):
+            cache.get_reference(Platform, 'Windows')
+
+    def test_vendor(self):
+        samsung = Manufacturer.objects.create(name='Samsung Electronics', slug='samsung')
+        self.assertEqual(cache.get_vendor('SAMSUNG'), samsung)
+        self.assertEqual(cache.get_vendor(' samsung  electronics'), samsung)
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get_vendor('Samsung'), samsung)
+
+    def test_vendor_cache_size(self):
+        samsung = Manufacturer.objects.create(name='Samsung', slug='samsung')
+        with mock.patch.object(cache, 'VENDOR_CACHE_SIZE', 2), mock.patch.object(cache, 'DEVICE_CACHE_SIZE', 1):
+            cache.get_vendor('Samsung')
+            cache.get_vendor('SAMSUNG ')
+            self.assertEqual(list(cache._found_vendors), ['samsung'])
+            cache.get_vendor('Intel')
+            self.assertEqual(len(cache._found_vendors), 2)
+            # Full cache is cleared
+            self.assertEqual(cache.get_vendor('Seagate').name, '--- NoName ---')
+            self.assertEqual(list(cache._found_vendors), ['seagate'])
+            with self.assertNumQueries(0):
+                self.assertEqual(cache.get_vendor('Samsung'), samsung)
+
+    def test_vendor_alias(self):
+        samsung = Manufacturer.objects.create(name='Samsung', slug='samsung')
+        with mock.patch.object(cache, 'VENDOR_ALIASES', {'ssg': 'samsung'}):
+            self.assertEqual(cache.get_vendor('SSG'), samsung)
+
+    def test_vendor_not_found(self):
+        self.assertEqual(cache.get_vendor('Samsung').name, '--- NoName ---')
+        # New manufacturer is found at once
+        samsung = Manufacturer.objects.create(name='Samsung', slug='samsung')
+        self.assertEqual(cache.get_vendor('Samsung'), samsung)
+
+
+class DeviceCacheTest(SyncTestCase):
+
+    def setUp(self):
+        super(DeviceCacheTest, self).setUp()
+        self.other = Device.objects.create(name='srv02', asset_tag='SRV02', device_type=self.device_type,
+                                           device_role=self.role, site=self.site)
+
+    def test_cached(self):
+        with self.assertNumQueries(1):
+            devices = cache.get_devices(['srv01', 'srv02', 'unknown'])
+        self.assertEqual(devices, {'srv01': self.device, 'srv02': self.other})
+        # Not found devices are fetched again - it can be added
+        with self.assertNumQueries(1):
+            self.assertEqual(set(cache.get_devices(['srv01', 'srv02', 'unknown'])), {'srv01', 'srv02'})
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get_devices(['srv01']), {'srv01': devices['srv01']})
+
+    def test_device_changed(self):
+        cache.get_devices(['srv01', 'srv02'])
+        self.device.asset_tag = 'SRV01-NEW'
+        self.device.save()
+        with self.assertNumQueries(1):
+            devices = cache.get_devices(['srv01', 'srv02'])
+        self.assertEqual(devices['srv01'].asset_tag, 'SRV01-NEW')
+        self.device.delete()
+        self.assertEqual(set(cache.get_devices(['srv01', 'srv02'])), {'srv02'})
+
+    def test_reference_changed(self):
+        # Devices keep a related objects
+        cache.get_devices(['srv01'])
+        self.platform.name = 'Ubuntu'
+        self.platform.save()
+        self.assertEqual(cache.get_devices(['srv01'])['srv01'].platform.name, 'Ubuntu')
+
+    def test_size(self):
+        with mock.patch.object(cache, 'DEVICE_CACHE_SIZE', 1):
+            cache.get_devices(['srv01'])
+            cache.get_devices(['srv02'])
+            with self.assertNumQueries(1):
+                cache.get_devices(['srv01'])
+
+
+class DeviceProfileTest(SyncTestCase):
+
+    def test_vendor(self):
+        self.assertEqual(cache.get_profiles(['srv01'])['srv01'].vendor, 'Linux')
+        # Vendor of device without platform is a manufacturer of device type
+        self.device.platform = None
+        self.device.save()
+        self.assertEqual(cache.get_profile(self.device).vendor, self.manufacturer.name)
+
+    def test_cached(self):
+        profile = cache.get_profiles(['srv01'])['srv01']
+        with self.assertNumQueries(0):
+            self.assertIs(cache.get_profiles(['srv01'])['srv01'], profile)
+            self.assertIs(cache.get_profile(profile.device), profile)
+        # Device got not from cache has own profile
+        self.assertIsNot(cache.get_profile(Device.objects.get(pk=self.device.pk)), profile)
+
+    def test_cluster(self):
+        self.assertIsNone(cache.get_profiles(['srv01'])['srv01'].cluster)
+        collector.sync_vms(self.device, [domain('vm1')])
+        self.assertEqual(cache.get_profiles(['srv01'])['srv01'].cluster.name, 'srv01')
+        # Cluster is not created again
+        collector.sync_vms(self.device, [domain('vm2')])
+        self.assertEqual(Cluster.objects.count(), 1)
+
+    def test_iface_regex(self):
+        with mock.patch.object(Device, 'cf', return_value={'Interfaces filter': '^eth'}):
+            profile = cache.get_profiles(['srv01'])['srv01']
+            self.assertTrue(profile.iface_regex.match('eth0'))
+            self.assertFalse(profile.iface_regex.match('lo'))
+
+    def test_invalid_iface_regex(self):
+        with mock.patch.object(Device, 'cf', return_value={'Interfaces filter': '(eth'}):
+            profile = cache.get_profiles(['srv01'])['srv01']
+            self.assertEqual(profile.iface_regex.pattern, '.*')
+
+    def test_custom_field_changed(self):
+        profile = cache.get_profiles(['srv01'])['srv01']
+        field = CustomField.objects.create(name='Interfaces filter')
+        self.assertIsNot(cache.get_profiles(['srv01'])['srv01'], profile)
+        profile = cache.get_profiles(['srv01'])['srv01']
+        CustomFieldValue.objects.create(field=field, obj_type=ContentType.objects.get_for_model(Device),
+                                        obj_id=self.device.pk, serialized_value='^eth')
+        self.assertIsNot(cache.get_profiles(['srv01'])['srv01'], profile)
+        # Values of other objects do not drop profiles
+        profile = cache.get_profiles(['srv01'])['srv01']
+        CustomFieldValue.objects.create(field=field, obj_type=ContentType.objects.get_for_model(Platform),
+                                        obj_id=self.platform.pk, serialized_value='^eth')
+        self.assertIs(cache.get_profiles(['srv01'])['srv01'], profile)
+
+
+def disk(name, size, vendor='', pid='', serial=''):
+    """ Disk row, same as lsblk.template returns
+    """
+    return {'Name': name, 'Descr': size, 'Vendor': vendor, 'PartID': pid, 'Serial': serial}
+
+
+LSBLK_RECORDS = [disk('sda', '1.8T'), disk('sdb', '447.1G'), disk('nvme0n1', '1.8T'), disk('sr0', '1024M'),
+                 disk('loop0', '55.4M')]
+LSBLK_MODELS_RECORDS = [disk('sda', '1.8T', 'ST2000NM0055', '1V4', 'ZC20ABCD'),
+                        disk('sdb', '447.1G', 'INTEL', 'SSDSC2KB480G8', 'PHYF1234'),
+                        disk('sdc', '1.8T', 'Samsung', 'SSD', '860'),
+                        disk('sdd', '1.8T', 'INTEL', 'SSDSC2BB480G4'),
+                        disk('nvme0n1', '931.5G')]
+
+
+FILLDOWN_TEMPLATE = """Value Filldown HOST (\\S+)
+Value List IP (\\S+)
+Value Required NAME (\\S+)
+
+Start
+  ^host ${HOST}
+  ^  ip ${IP}
+  ^iface ${NAME} -> Record
+"""
+
+
+class TemplateCacheTest(SimpleTestCase):
+
+    def test_clone(self):
+        for template, text in (('ip_a.template', IP_A), ('lsblk.template', LSBLK_MODELS),
+                               ('virsh_domstats.template', VIRSH)):
+            path = os.path.join(TEMPLATES_DIR, template)
+            with open(path) as template_file:
+                expected = textfsm.TextFSM(template_file).ParseText(text)
+            # Every parse gets own clone of cached template
+            for _ in range(2):
+                self.assertEqual(collector._parse_text(collector._get_template(path), text), expected, template)
+
+    def test_clone_state(self):
+        fsm = textfsm.TextFSM(io.StringIO(FILLDOWN_TEMPLATE))
+        text = "host h1\n  ip 10.0.0.1\n  ip 10.0.0.2\niface eth0\n  ip 10.0.0.3\niface eth1\n"
+        expected = textfsm.TextFSM(io.StringIO(FILLDOWN_TEMPLATE)).ParseText(text)
+        self.assertEqual(expected, [['h1', ['10.0.0.1', '10.0.0.2'], 'eth0'], ['h1', ['10.0.0.3'], 'eth1']])
+        # Not finished parse of one clone does not change values of another clone and of original
+        first = collector._clone_template(fsm)
+        for line in ("host h2", "  ip 10.0.0.9"):
+            first._CheckLine(line)
+        self.assertEqual(collector._parse_text(collector._clone_template(fsm), "iface eth9\n"), [['', [], 'eth9']])
+        self.assertEqual(collector._parse_text(collector._clone_template(fsm), text), expected)
+        self.assertEqual(collector._parse_text(fsm, text), expected)
+        # Filldown value is kept by first clone only
+        self.assertEqual(collector._parse_text(first, "iface eth9\n"), [['h2', ['10.0.0.9'], 'eth9']])
+
+    def test_recompile(self):
+        path = os.path.join(tempfile.mkdtemp(), 'test.template')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        self.addCleanup(collector._templates.pop, path, None)
+        with open(path, 'w') as template_file:
+            template_file.write("Value NAME (\\S+)\n\nStart\n  ^${NAME} -> Record\n")
+        with mock.patch.object(textfsm, 'TextFSM', wraps=textfsm.TextFSM) as compile_template:
+            self.assertEqual(collector._get_template(path).header, ['NAME'])
+            self.assertEqual(collector._get_template(path).header, ['NAME'])
+            self.assertEqual(compile_template.call_count, 1)
+            # Changed file is compiled again
+            with open(path, 'w') as template_file:
+                template_file.write("Value ITEM (\\S+)\n\nStart\n  ^${ITEM} -> Record\n")
+            mtime = os.path.getmtime(path) + 10
+            os.utime(path, (mtime, mtime))
+            self.assertEqual(collector._get_template(path).header, ['ITEM'])
+            self.assertEqual(collector._get_template(path).header, ['ITEM'])
+            self.assertEqual(compile_template.call_count, 2)
+
+
+class DispatchTest(SimpleTestCase):
+
+    def setUp(self):
+        self.template_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.template_dir)
+        for name in os.listdir(TEMPLATES_DIR):
+            shutil.copy(os.path.join(TEMPLATES_DIR, name), self.template_dir)
+        self.index_path = os.path.join(self.template_dir, 'index')
+        self.addCleanup(collector.CollectorTable.INDEX.pop, self.index_path, None)
+        self.parser = collector.CollectorTable('index', self.template_dir)
+
+    def test_cache(self):
+        self.assertEqual(self.parser.get_dispatch('Linux', 'lsblk'), ('lsblk.template', 'sync_inventory'))
+        self.assertEqual(self.parser.get_dispatch('Linux', 'unknown'), (None, None))
+        # Next lookups do not match rows
+        self.parser._dispatch_rows = []
+        self.assertEqual(self.parser.get_dispatch('Linux', 'lsblk'), ('lsblk.template', 'sync_inventory'))
+        self.assertEqual(self.parser.get_dispatch('Linux', 'unknown'), (None, None))
+        self.assertEqual(self.parser.get_dispatch('Linux', 'ip a'), (None, None))
+
+    def test_cache_size(self):
+        with mock.patch.object(collector, 'DISPATCH_CACHE_SIZE', 2):
+            self.parser.get_dispatch('Linux', 'lsblk')
+            self.parser.get_dispatch('Linux', 'ip a')
+            self.assertEqual(len(self.parser._dispatch_cache), 2)
+            # Full cache is cleared
+            self.parser.get_dispatch('Linux', 'dmidecode')
+            self.assertEqual(list(self.parser._dispatch_cache), [('Linux', 'dmidecode')])
+
+    def test_reload_index(self):
+        self.assertFalse(self.parser.reload_index())
+        self.assertEqual(self.parser.get_dispatch('Linux', 'lsblk'), ('lsblk.template', 'sync_inventory'))
+        self.assertEqual(self.parser.get_dispatch('Linux', 'disks'), (None, None))
+        with open(self.index_path) as index_file:
+            text = index_file.read()
+        with open(self.index_path, 'w') as index_file:
+            index_file.write(text.replace(", lsblk, sync_inventory,", ", disks, sync_inventory,"))
+        mtime = os.path.getmtime(self.index_path) + 10
+        os.utime(self.index_path, (mtime, mtime))
+        # Cached lookups are dropped with old index
+        self.assertTrue(self.parser.reload_index())
+        self.assertFalse(self.parser.reload_index())
+        self.assertEqual(self.parser.get_dispatch('Linux', 'lsblk'), (None, None))
+        self.assertEqual(self.parser.get_dispatch('Linux', 'disks'), ('lsblk.template', 'sync_inventory'))
+        # New parsers get reloaded index too
+        parser = collector.CollectorTable('index', self.template_dir)
+        self.assertIs(parser.index, self.parser.index)
+        self.assertEqual(parser.get_dispatch('Linux', 'disks'), ('lsblk.template', 'sync_inventory'))
+
+
+class ThreadParsersTest(SimpleTestCase):
+
+    @mock.patch.object(collector, '_thread_parsers', threading.local())
+    def test_get_parser(self):
+        parsers = {}
+
+        def get_parsers(name):
+            parsers[name] = (collector.get_parser(), collector.get_parser())
+
+        threads = [threading.Thread(target=get_parsers, args=(name,)) for name in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        get_parsers('main')
+        # Thread gets same parser on every call, other threads get own parsers
+        self.assertTrue(all(first is second for first, second in parsers.values()))
+        thread_parsers = [first for first, _ in parsers.values()]
+        self.assertEqual(len(set(map(id, thread_parsers))), 4)
+        # Index is read once and shared between parsers
+        self.assertTrue(all(parser.index is thread_parsers[0].index for parser in thread_parsers))
+        self.assertTrue(all(parser.get_dispatch('Linux', 'lsblk') == ('lsblk.template', 'sync_inventory')
+                            for parser in thread_parsers))
+
+
+class TemplatesTest(SimpleTestCase):
+
+    def test_lsblk(self):
+        self.assertEqual(parse_template('lsblk.template', LSBLK), LSBLK_RECORDS)
+        self.assertEqual(parse_template('lsblk.template', LSBLK_MODELS), LSBLK_MODELS_RECORDS)
+
+    def test_long_line(self):
+        # Took minutes with not escaped dots of MAC
+        with open(os.path.join(TEMPLATES_DIR, 'cisco_show_interfaces.template')) as template_file:
+            fsm = textfsm.TextFSM(template_file)
+        with mock.patch.object(collector, 'MAX_LINE_LENGTH', 4096):
+            self.assertEqual(collector._parse_text(fsm, 'address is ' + 'a' * 4096), [])
+
+
+class RegexesTest(SimpleTestCase):
+
+    def test_safe(self):
+        for regex in (r'(\d+): (\S+): \<(\S+)\> mtu (\d+)', r'[^,]*,[^,]*,\s+VID:\s+(\S+)', r'(ab|cd)+',
+                      r'^\s*$', r'(\S+)\s+is\s+(.+?)$', r'^.*input rate (\d+)'):
+            self.assertEqual(regexes.check(regex), [], regex)
+
+    def test_nested(self):
+        for regex in (r'(.*)+', r'(\w+\s?)+$', r'((\d+)\.?)*'):
+            self.assertIn("nested quantifier - exponential backtracking", regexes.check(regex), regex)
+        self.assertEqual(regexes.check(r'(x\w|\wy)+'),
+                         ["repeated alternation of overlapping branches - exponential backtracking"])
+
+    def test_overlapping(self):
+        self.assertEqual(regexes.check(r'.*a.*b.*c.*d'), ["4 overlapping quantifiers in a row - O(n^4) backtracking"])
+        self.assertEqual(regexes.check(r'.*,.*VID:\s+(.*),.*SN:'),
+                         ["4 overlapping quantifiers in a row - O(n^4) backtracking"])
+        # Dots are not escaped - a run of letters can be split between three parts of MAC
+        self.assertEqual(regexes.check(r'^.*address is ([a-zA-Z0-9]+.[a-zA-Z0-9]+.[a-zA-Z0-9]+) .*bia (\S+)'),
+                         ["3 overlapping quantifiers in a row - O(n^3) backtracking"])
+        self.assertEqual(regexes.check(r'^.*address is ([0-9a-fA-F]+\.[0-9a-fA-F]+\.[0-9a-fA-F]+) \(bia (\S+)\)'), [])
+        # Even two quantifiers are quadratic - a match of one line cannot be interrupted
+        for regex in (r'.*\s+(\S+)\s*$', r'\s+(.+?),', r'(\S+)(\w+)x'):
+            self.assertEqual(regexes.check(regex), ["2 overlapping quantifiers in a row - O(n^2) backtracking"], regex)
+        # Quantifiers, which are divided by char not matched by previous one, cannot share chars
+        self.assertEqual(regexes.check(r'[^,]*,[^,]*,[^,]*,[^,]*,[^,]*'), [])
+
+    def test_not_parsed(self):
+        problems = regexes.check('(eth')
+        self.assertEqual(len(problems), 1)
+        self.assertTrue(problems[0].startswith("cannot parse regex: "))
+
+    def test_templates(self):
+        for template in os.listdir(TEMPLATES_DIR):
+            if template.endswith('.template'):
+                with open(os.path.join(TEMPLATES_DIR, template)) as template_file:
+                    self.assertEqual(regexes.check_template(textfsm.TextFSM(template_file)), [], template)
+
+    def test_template_problems(self):
+        fsm = textfsm.TextFSM(io.StringIO("Value NAME (.*)\n\nStart\n  ^(\\S+\\s?)+ -> Record\n  ^${NAME}\n"))
+        problems = regexes.check_template(fsm)
+        self.assertEqual([(state, problems) for state, _, problems in problems],
+                         [('Start', ["nested quantifier - exponential backtracking"])])
+
+    def test_parse_limits(self):
+        with open(os.path.join(TEMPLATES_DIR, 'lsblk.template')) as template_file:
+            fsm = textfsm.TextFSM(template_file)
+        with mock.patch.object(collector, 'MAX_LINE_LENGTH', 20):
+            records = collector._parse_text(fsm, 'sda   1.8T ' + 'x' * 100)
+        self.assertEqual(len(records), 1)
+        with mock.patch.object(collector, 'PARSE_TIME_LIMIT', 1e-9), \
+                self.assertRaisesMessage(textfsm.TextFSMError, "Parsing takes more than"):
+            collector._parse_text(textfsm.TextFSM(io.StringIO("Value NAME (\\S+)\n\nStart\n  ^${NAME}\n")),
+                                  LSBLK * 100)
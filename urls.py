@@ -4,4 +4,6 @@ from . import views
 
 urlpatterns =[ 
     url(r'^$', views.index, name='index'),
+    url(r'^jobs/(?P<job_id>\d+)/$', views.job_status, name='job_status'),
+    url(r'^metrics/$', views.metrics_view, name='metrics'),
 ]
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+""" Benchmark of collector parsing and syncing
+
+    Runs every template and sync function with synthetic command outputs
+    against SQLite database with a minimal stand-in of NetBox models.
+    Netbox is not needed - only Django, TextFSM and netaddr.
+
+    Usage:
+        python utils/benchmark/benchmark.py --ports 48 --domains 50 --repeat 20
+        python utils/benchmark/benchmark.py --json > result.json
+"""
+
+from argparse import ArgumentParser
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import generators
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+COLLECTOR_DIR = os.path.dirname(os.path.dirname(BENCHMARK_DIR))
+
+
+def setup(db):
+    """ Configure Django with stand-in apps and create database
+
+    :param db: String, path to SQLite database or ':memory:'
+    """
+    # App should be importable as "collector" - as it is cloned into netbox folder
+    if os.path.basename(COLLECTOR_DIR) == 'collector':
+        root = os.path.dirname(COLLECTOR_DIR)
+    else:
+        root = tempfile.mkdtemp(prefix='collector-benchmark-')
+        os.symlink(COLLECTOR_DIR, os.path.join(root, 'collector'))
+    sys.path.insert(0, os.path.join(BENCHMARK_DIR, 'standin'))
+    sys.path.insert(0, root)
+    # Templates directory in settings is relative to netbox folder
+    os.chdir(root)
+
+    import django
+    from django.conf import settings
+    settings.configure(
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': db}},
+        INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth',
+                        'dcim', 'ipam', 'virtualization', 'extras', 'collector'],
+        MIGRATION_MODULES={'dcim': None, 'ipam': None, 'virtualization': None, 'extras': None},
+        USE_TZ=True,
+    )
+
+    # Log is written, as in production, but into nowhere
+    import collector.settings
+    collector.settings.LOGGING_CONFIG['handlers']['logfile']['filename'] = os.devnull
+    collector.settings.LOGGING_CONFIG['handlers']['console'] = {'class': 'logging.NullHandler'}
+
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+def create_devices(servers):
+    """ Create reference objects and devices for benchmark
+
+    :param servers: count of servers, connected to switch
+    """
+    from dcim.models import Manufacturer, Platform, DeviceRole, DeviceType, Site, Device, Interface
+    from virtualization.models import ClusterType
+    from collector.settings import DEFAULT_CLUSTER_TYPE
+
+    linux = Manufacturer.objects.create(name='Linux')
+    cisco = Manufacturer.objects.create(name='Cisco')
+    for name in ('--- NoName ---', 'Samsung', 'Hynix', 'Intel', 'Supermicro'):
+        Manufacturer.objects.create(name=name)
+    platform = Platform.objects.create(name='Linux', manufacturer=linux)
+    DeviceRole.objects.create(name='Server')
+    ClusterType.objects.create(name=DEFAULT_CLUSTER_TYPE)
+    site = Site.objects.create(name='benchmark')
+    server_type = DeviceType.objects.create(model='server', manufacturer=linux)
+    switch_type = DeviceType.objects.create(model='switch', manufacturer=cisco)
+
+    Device.objects.create(name='linux', device_type=server_type, platform=platform, site=site)
+    Device.objects.create(name='ios', device_type=switch_type, site=site)
+    Device.objects.create(name='nxos', device_type=switch_type, site=site)
+    for index in range(servers):
+        server = Device.objects.create(name='srv{}'.format(index), asset_tag='SRV{}'.format(index),
+                                       device_type=server_type, platform=platform, site=site)
+        Interface.objects.create(device=server, name='eth0')
+
+
+def get_cases(args):
+    """ Benchmark cases: (name, hostname, command, vendor, generator of output by variant)
+    """
+    return [
+        ('ip a', 'linux', 'ip a', 'Linux', lambda variant: generators.ip_a(args.ports, variant)),
+        ('sh int', 'ios', 'sh int', 'Cisco',
+         lambda variant: generators.ios_show_interfaces(args.ports, args.servers, variant)),
+        ('sh int nx', 'nxos', 'sh int nx', 'Cisco', lambda variant: generators.nxos_show_interfaces(args.ports, variant)),
+        ('dmidecode', 'linux', 'dmidecode', 'Linux', lambda variant: generators.dmidecode(args.dimms, variant)),
+        ('lsblk', 'linux', 'lsblk', 'Linux', lambda variant: generators.lsblk(args.disks, variant)),
+        ('virsh_domstats', 'linux', 'virsh_domstats', 'Linux',
+         lambda variant: generators.virsh_domstats(args.domains, args.vm_disks, variant)),
+    ]
+
+
+class QueryCounter(object):
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[max(int(math.ceil(percent / 100.0 * len(values))) - 1, 0)]
+
+
+def timed(function, *args, **kwargs):
+    """ Run function, return (result, seconds, count of queries)
+    """
+    from django.db import connection
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - start
+    return result, seconds, counter.count
+
+
+def run_case(parser, case, repeat):
+    from collector import collector
+
+    name, hostname, command, vendor, generate = case
+    outputs = [generate(0), generate(1)]
+    attrs = {"Command": command, "Vendor": vendor}
+    template, _ = collector._get_process_function(parser, attrs)
+
+    # Parsing only
+    parse_times = []
+    for index in range(repeat):
+        rows, seconds, _ = timed(parser.ParseRecords, outputs[index % 2], attrs, templates=template)
+        parse_times.append(seconds)
+
+    # First sync creates objects, next are updating it by turns
+    host = {'hostname': hostname, 'command': command}
+    results, create_time, create_queries = timed(collector.sync_hosts, parser, [dict(host, data=outputs[0])],
+                                                 force=True)
+    if not results[0]['result']:
+        raise RuntimeError("Sync of {} failed: {}".format(name, results[0]['detail']))
+
+    sync_times = []
+    sync_queries = []
+    for index in range(1, repeat + 1):
+        _, seconds, queries = timed(collector.sync_hosts, parser, [dict(host, data=outputs[index % 2])], force=True)
+        sync_times.append(seconds)
+        sync_queries.append(queries)
+
+    # Peak memory of parsing and syncing of one output
+    tracemalloc.start()
+    collector.sync_hosts(parser, [dict(host, data=outputs[(repeat + 1) % 2])], force=True)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    size = len(outputs[0])
+    return {
+        'case': name,
+        'bytes': size,
+        'rows': len(rows),
+        'parse_p50': percentile(parse_times, 50),
+        'parse_p95': percentile(parse_times, 95),
+        'parse_max': max(parse_times),
+        'parse_mb_per_sec': size * len(parse_times) / sum(parse_times) / 1024 / 1024,
+        'create': create_time,
+        'create_queries': create_queries,
+        'sync_p50': percentile(sync_times, 50),
+        'sync_p95': percentile(sync_times, 95),
+        'sync_max': max(sync_times),
+        'syncs_per_sec': len(sync_times) / sum(sync_times),
+        'sync_queries': max(sync_queries),
+        'peak_memory': peak,
+    }
+
+
+def print_report(results):
+    header = ("{:<15} {:>8} {:>5} | {:>8} {:>8} {:>8} {:>7} | {:>8} {:>5} | {:>8} {:>8} {:>8} {:>7} {:>5} | {:>8}"
+              .format('case', 'KB', 'rows', 'p50 ms', 'p95 ms', 'max ms', 'MB/s',
+                      'new ms', 'qry', 'p50 ms', 'p95 ms', 'max ms', 'syncs/s', 'qry', 'peak MB'))
+    print("{:<30} | {:^42} | {:^16} | {:^48} |".format('', 'parse', 'first sync', 'sync'))
+    print(header)
+    print('-' * len(header))
+    for item in results:
+        print("{:<15} {:>8.1f} {:>5} | {:>8.2f} {:>8.2f} {:>8.2f} {:>7.2f} | {:>8.2f} {:>5} | "
+              "{:>8.2f} {:>8.2f} {:>8.2f} {:>7.1f} {:>5} | {:>8.2f}".format(
+                  item['case'], item['bytes'] / 1024.0, item['rows'],
+                  item['parse_p50'] * 1000, item['parse_p95'] * 1000, item['parse_max'] * 1000,
+                  item['parse_mb_per_sec'],
+                  item['create'] * 1000, item['create_queries'],
+                  item['sync_p50'] * 1000, item['sync_p95'] * 1000, item['sync_max'] * 1000,
+                  item['syncs_per_sec'], item['sync_queries'],
+                  item['peak_memory'] / 1024.0 / 1024.0))
+
+
+if __name__ == '__main__':
+    arg_parser = ArgumentParser(description="Benchmark of collector parsing and syncing")
+    arg_parser.add_argument('--ports', type=int, default=48, help="Count of interfaces in outputs")
+    arg_parser.add_argument('--servers', type=int, default=24, help="Count of switch ports, connected to servers")
+    arg_parser.add_argument('--dimms', type=int, default=16, help="Count of memory devices in dmidecode")
+    arg_parser.add_argument('--disks', type=int, default=12, help="Count of disks in lsblk")
+    arg_parser.add_argument('--domains', type=int, default=50, help="Count of VMs in virsh domstats")
+    arg_parser.add_argument('--vm-disks', type=int, default=2, help="Count of disks of every VM")
+    arg_parser.add_argument('--repeat', type=int, default=20, help="Count of runs of every case")
+    arg_parser.add_argument('--case', action='append', help="Run only this case, can be used many times")
+    arg_parser.add_argument('--db', default=':memory:', help="Path to SQLite database")
+    arg_parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = arg_parser.parse_args()
+
+    setup(args.db)
+    create_devices(args.servers)
+
+    from collector import collector
+    parser = collector.init_parser()
+    if not parser:
+        print("Cannot init parser - see a log for details")
+        exit(1)
+
+    results = []
+    for case in get_cases(args):
+        if args.case and case[0] not in args.case:
+            continue
+        results.append(run_case(parser, case, args.repeat))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
@@ -0,0 +1,141 @@
+# Generators of synthetic command outputs for benchmarks
+# variant - changes some values, so repeated syncs have something to update
+
+
+def _mac(index, sep=':'):
+    octets = [0x52, 0x54, 0x00, (index >> 16) & 0xff, (index >> 8) & 0xff, index & 0xff]
+    return sep.join('{:02x}'.format(octet) for octet in octets)
+
+
+def _cisco_mac(index):
+    mac = _mac(index, '')
+    return '.'.join((mac[0:4], mac[4:8], mac[8:12]))
+
+
+def ip_a(ports, variant=0):
+    """ Linux 'ip a' output with loopback and ports ethN
+    """
+    lines = ["1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN group default qlen 1000",
+             "    link/loopback 00:00:00:00:00:00 brd 00:00:00:00:00:00",
+             "    inet 127.0.0.1/8 scope host lo",
+             "       valid_lft forever preferred_lft forever"]
+    mtu = 9000 if variant else 1500
+    for index in range(ports):
+        state = 'DOWN' if variant and index % 4 == 0 else 'UP'
+        lines.append("{}: eth{}: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu {} qdisc mq state {} group default qlen 1000"
+                     .format(index + 2, index, mtu, state))
+        lines.append("    link/ether {} brd ff:ff:ff:ff:ff:ff".format(_mac(index)))
+        lines.append("    inet 10.{}.{}.5/24 brd 10.{}.{}.255 scope global eth{}".format(
+            index // 256, index % 256, index // 256, index % 256, index))
+        lines.append("       valid_lft forever preferred_lft forever")
+        if index % 2:
+            lines.append("    inet 10.{}.{}.6/24 brd 10.{}.{}.255 scope global secondary eth{}".format(
+                index // 256, index % 256, index // 256, index % 256, index))
+    return "\n".join(lines) + "\n"
+
+
+def ios_show_interfaces(ports, servers=0, variant=0):
+    """ Cisco IOS 'show interfaces' output
+        First servers ports have description "SRVn|eth0" for cabling
+    """
+    lines = []
+    for index in range(ports):
+        if index < servers:
+            description = "SRV{}|eth0".format(index)
+        else:
+            description = "port {} v{}".format(index, variant)
+        state = 'administratively down' if variant and index % 4 == 0 else 'up'
+        lines.append("GigabitEthernet0/{} is {}, line protocol is {}".format(
+            index + 1, state, 'down' if 'down' in state else 'up'))
+        lines.append("  Hardware is Gigabit Ethernet, address is {0} (bia {0})".format(_cisco_mac(index)))
+        lines.append("  Description: {}".format(description))
+        if index % 8 == 0:
+            lines.append("  Internet address is 172.16.{}.1/24".format(index // 8))
+        lines.append("  MTU {} bytes, BW 1000000 Kbit/sec, DLY 10 usec,".format(9000 if variant else 1500))
+        lines.append("     reliability 255/255, txload 1/255, rxload 1/255")
+        lines.append("  Encapsulation ARPA, loopback not set")
+        lines.append("  Queueing strategy: fifo")
+        lines.append("  Full-duplex, 1000Mb/s, media type is RJ45")
+        lines.append("  5 minute input rate 1000 bits/sec, 2 packets/sec")
+        lines.append("  5 minute output rate 2000 bits/sec, 3 packets/sec")
+    return "\n".join(lines) + "\n"
+
+
+def nxos_show_interfaces(ports, variant=0):
+    """ Cisco NX-OS 'show interface' output
+    """
+    lines = []
+    for index in range(ports):
+        state = 'down' if variant and index % 4 == 0 else 'up'
+        lines.append("Ethernet1/{} is {}".format(index + 1, state))
+        lines.append("admin state is up, Dedicated Interface")
+        lines.append("  Hardware: 1000/10000 Ethernet, address: {0} (bia {0})".format(_cisco_mac(index)))
+        lines.append("  Description: port {} v{}".format(index, variant))
+        if index % 8 == 0:
+            lines.append("  Internet Address is 172.17.{}.1/24".format(index // 8))
+        lines.append("  MTU {} bytes, BW 10000000 Kbit, DLY 10 usec".format(9216 if variant else 1500))
+        lines.append("  reliability 255/255, txload 1/255, rxload 1/255")
+        lines.append("  Encapsulation ARPA, medium is broadcast")
+        lines.append("  full-duplex, 10 Gb/s, media type is 10G")
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def dmidecode(dimms, variant=0):
+    """ Linux 'dmidecode' output with board, two CPUs and memory devices
+    """
+    lines = ["Handle 0x0002, DMI type 2, 15 bytes",
+             "Base Board Information",
+             "\tManufacturer: Supermicro",
+             "\tProduct Name: X10DRi",
+             "\tVersion: 1.0{}".format(variant),
+             "\tSerial Number: NM123",
+             ""]
+    for cpu in range(2):
+        lines.extend(["Handle 0x004{}, DMI type 4, 42 bytes".format(cpu),
+                      "Processor Information",
+                      "\tSocket Designation: CPU{}".format(cpu + 1),
+                      "\tFamily: Xeon",
+                      "\tManufacturer: Intel",
+                      "\tVersion: Intel(R) Xeon(R) CPU E5-2620 v{}".format(variant + 3),
+                      "\tSerial Number: Not Specified",
+                      ""])
+    for dimm in range(dimms):
+        lines.extend(["Handle 0x{:04x}, DMI type 17, 40 bytes".format(0x100 + dimm),
+                      "Memory Device",
+                      "\tSize: {} MB".format(32768 if variant else 16384),
+                      "\tBank Locator: P{}_Node0_Channel{}_Dimm0".format(dimm % 2, dimm // 2),
+                      "\tManufacturer: {}".format('Samsung' if dimm % 2 else 'Hynix'),
+                      "\tSerial Number: {:08X}".format(dimm),
+                      "\tPart Number: M393A2G40DB0",
+                      ""])
+    return "\n".join(lines) + "\n"
+
+
+def lsblk(disks, variant=0):
+    """ Linux 'lsblk -d' output
+    """
+    lines = ["NAME  MAJ:MIN RM   SIZE RO TYPE MOUNTPOINT"]
+    for index in range(disks):
+        name = "sd" + chr(ord('a') + index % 26) * (index // 26 + 1)
+        lines.append("{:<5} 8:{:<4} 0 {:>5} 0 disk".format(name, index * 16, '3.6T' if variant else '1.8T'))
+    return "\n".join(lines) + "\n"
+
+
+def virsh_domstats(domains, disks=2, variant=0):
+    """ Linux 'virsh domstats' output
+    """
+    lines = []
+    for domain in range(domains):
+        lines.append("Domain: 'vm{}'".format(domain))
+        lines.append("  state.state={}".format(5 if variant and domain % 4 == 0 else 1))
+        lines.append("  state.reason=1")
+        lines.append("  balloon.maximum={}".format(4194304 * (variant + 1)))
+        lines.append("  vcpu.maximum={}".format(2 + variant))
+        lines.append("  block.count={}".format(disks))
+        for disk in range(disks):
+            lines.append("  block.{}.name=vd{}".format(disk, chr(ord('a') + disk % 26)))
+            lines.append("  block.{}.path=/var/lib/libvirt/images/vm{}-{}.qcow2".format(disk, domain, disk))
+            lines.append("  block.{}.capacity={}".format(disk, 21474836480 * (variant + 1)))
+        lines.append("")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,9 @@
+# Constants of NetBox dcim, used by collector
+DEVICE_STATUS_OFFLINE = 0
+DEVICE_STATUS_ACTIVE = 1
+DEVICE_STATUS_PLANNED = 2
+DEVICE_STATUS_STAGED = 3
+DEVICE_STATUS_FAILED = 4
+IFACE_FF_VIRTUAL = 0
+IFACE_FF_LAG = 200
+IFACE_FF_1GE_FIXED = 1000
@@ -0,0 +1,83 @@
+# Minimal stand-in of NetBox dcim models - only fields, used by collector
+import json
+from django.db import models
+
+
+class Manufacturer(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+
+class Platform(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    manufacturer = models.ForeignKey(Manufacturer, null=True, on_delete=models.SET_NULL)
+    napalm_driver = models.CharField(max_length=50, blank=True)
+
+
+class DeviceRole(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+
+class DeviceType(models.Model):
+    model = models.CharField(max_length=50)
+    manufacturer = models.ForeignKey(Manufacturer, on_delete=models.PROTECT)
+
+
+class Site(models.Model):
+    name = models.CharField(max_length=50)
+
+
+class Device(models.Model):
+    name = models.CharField(max_length=64, unique=True, null=True)
+    asset_tag = models.CharField(max_length=50, null=True, blank=True)
+    device_type = models.ForeignKey(DeviceType, on_delete=models.PROTECT)
+    device_role = models.ForeignKey(DeviceRole, null=True, on_delete=models.PROTECT)
+    platform = models.ForeignKey(Platform, null=True, blank=True, on_delete=models.SET_NULL)
+    site = models.ForeignKey(Site, null=True, on_delete=models.PROTECT)
+    cluster = models.ForeignKey('virtualization.Cluster', null=True, blank=True,
+                                related_name='devices', on_delete=models.SET_NULL)
+    primary_ip4 = models.ForeignKey('ipam.IPAddress', null=True, blank=True, related_name='+',
+                                    on_delete=models.SET_NULL)
+    custom_fields = models.TextField(default='{}')
+
+    @property
+    def primary_ip(self):
+        return self.primary_ip4
+
+    def cf(self):
+        return json.loads(self.custom_fields)
+
+    def __str__(self):
+        return self.name or ''
+
+
+class Cable(models.Model):
+    termination_a = models.ForeignKey('Interface', related_name='+', on_delete=models.CASCADE)
+    termination_b = models.ForeignKey('Interface', related_name='+', on_delete=models.CASCADE)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        Interface.objects.filter(pk__in=[self.termination_a_id, self.termination_b_id]).update(cable=self)
+
+
+class Interface(models.Model):
+    device = models.ForeignKey(Device, related_name='interfaces', on_delete=models.CASCADE)
+    name = models.CharField(max_length=64)
+    description = models.CharField(max_length=100, blank=True)
+    mac_address = models.CharField(max_length=32, null=True, blank=True)
+    mtu = models.PositiveIntegerField(null=True, blank=True)
+    enabled = models.BooleanField(default=True)
+    form_factor = models.PositiveSmallIntegerField(default=1000)
+    cable = models.ForeignKey(Cable, null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+
+    def __str__(self):
+        return self.name
+
+
+class InventoryItem(models.Model):
+    device = models.ForeignKey(Device, related_name='inventory_items', on_delete=models.CASCADE)
+    name = models.CharField(max_length=50)
+    manufacturer = models.ForeignKey(Manufacturer, null=True, blank=True, on_delete=models.PROTECT)
+    part_id = models.CharField(max_length=50, blank=True)
+    serial = models.CharField(max_length=50, blank=True)
+    description = models.CharField(max_length=100, blank=True)
+    discovered = models.BooleanField(default=False)
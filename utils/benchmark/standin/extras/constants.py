@@ -0,0 +1,4 @@
+# Minimal stand-in of NetBox extras constants - only constants, used by collector
+OBJECTCHANGE_ACTION_CREATE = 1
+OBJECTCHANGE_ACTION_UPDATE = 2
+OBJECTCHANGE_ACTION_DELETE = 3
@@ -0,0 +1,31 @@
+# Minimal stand-in of NetBox extras models - only fields, used by collector
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+
+
+class CustomField(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+
+class CustomFieldValue(models.Model):
+    field = models.ForeignKey(CustomField, related_name='values', on_delete=models.CASCADE)
+    obj_type = models.ForeignKey(ContentType, related_name='+', on_delete=models.PROTECT)
+    obj_id = models.PositiveIntegerField()
+    serialized_value = models.CharField(max_length=255)
+
+
+class ObjectChange(models.Model):
+    time = models.DateTimeField(auto_now_add=True, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='changes', blank=True, null=True,
+                             on_delete=models.SET_NULL)
+    user_name = models.CharField(max_length=150, editable=False)
+    request_id = models.UUIDField(editable=False)
+    action = models.PositiveSmallIntegerField()
+    changed_object_type = models.ForeignKey(ContentType, related_name='+', on_delete=models.PROTECT)
+    changed_object_id = models.PositiveIntegerField()
+    related_object_type = models.ForeignKey(ContentType, related_name='+', blank=True, null=True,
+                                            on_delete=models.PROTECT)
+    related_object_id = models.PositiveIntegerField(blank=True, null=True)
+    object_repr = models.CharField(max_length=200, editable=False)
+    object_data = models.TextField(editable=False)
@@ -0,0 +1,12 @@
+# Minimal stand-in of NetBox ipam models - only fields, used by collector
+from django.db import models
+
+
+class IPAddress(models.Model):
+    address = models.CharField(max_length=64)
+    interface = models.ForeignKey('dcim.Interface', null=True, blank=True, related_name='ip_addresses',
+                                  on_delete=models.CASCADE)
+
+    def save(self, *args, **kwargs):
+        self.address = str(self.address)
+        super().save(*args, **kwargs)
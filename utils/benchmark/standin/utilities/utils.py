@@ -0,0 +1,10 @@
+# Minimal stand-in of NetBox utilities - only functions, used by collector
+from django.core.serializers import serialize
+import json
+
+
+def serialize_object(obj, extra=None):
+    data = json.loads(serialize('json', [obj]))[0]['fields']
+    if extra is not None:
+        data.update(extra)
+    return data
@@ -0,0 +1,25 @@
+# Minimal stand-in of NetBox virtualization models - only fields, used by collector
+from django.db import models
+
+
+class ClusterType(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+
+class Cluster(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    type = models.ForeignKey(ClusterType, on_delete=models.PROTECT)
+    site = models.ForeignKey('dcim.Site', null=True, blank=True, on_delete=models.PROTECT)
+
+
+class VirtualMachine(models.Model):
+    cluster = models.ForeignKey(Cluster, related_name='virtual_machines', on_delete=models.PROTECT)
+    name = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField(default=1)
+    platform = models.ForeignKey('dcim.Platform', null=True, blank=True, on_delete=models.SET_NULL)
+    role = models.ForeignKey('dcim.DeviceRole', null=True, blank=True, on_delete=models.PROTECT)
+    vcpus = models.PositiveSmallIntegerField(null=True)
+    memory = models.PositiveIntegerField(null=True)
+    disk = models.PositiveIntegerField(null=True)
+    comments = models.TextField(blank=True)
+    last_updated = models.DateTimeField(auto_now=True, blank=True, null=True)
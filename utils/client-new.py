@@ -3,16 +3,28 @@
 
 from __future__ import unicode_literals
 from argparse import ArgumentParser,FileType
+from collections import OrderedDict
+from io import BytesIO
+from multiprocessing.dummy import Pool
 from os.path import expanduser
 from pprint import pprint
+import gzip
 import json
+import re
+import socket
 import sys
+import threading
+import time
 
 # python 2 or 3 comparability(tested with 2.6 and 3.6)
 try:
     from urllib2 import urlopen, Request, URLError, HTTPError, HTTPErrorProcessor, build_opener, quote
+    from urlparse import urlparse
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
 except ImportError:
     from urllib.request import urlopen, Request, URLError, HTTPError, HTTPErrorProcessor, build_opener, quote
+    from urllib.parse import urlparse
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
 
 
 # For colorize terminal output
@@ -103,6 +115,164 @@ def _sync_device(args):
         exit(1)
 
 
+def _read_sync_items(data, host_filter=None):
+    """
+    Read a list of host items from JSON or JSONL
+    JSON can be a list of items, one item or a query with items in "data"
+    """
+    content = data.read()
+    try:
+        items = json.loads(content)
+        if isinstance(items, dict):
+            if 'hostname' in items and 'command' in items:
+                # One host - its "data" is a command output
+                items = [items]
+            elif isinstance(items.get('data'), list):
+                items = items['data']
+            else:
+                items = []
+    except ValueError:
+        # JSONL - one item per line
+        items = [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    if host_filter:
+        regex = re.compile(host_filter)
+        items = [item for item in items if regex.search(item.get('hostname', ''))]
+    return items
+
+
+def _gzip(data):
+    buf = BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+class _Uploader(object):
+    """
+    Send batches to collector API
+    Every thread keeps own keep-alive connection
+    """
+
+    def __init__(self, token, base_url, retries, backoff, compress):
+        url = urlparse(base_url)
+        self.connection_class = HTTPSConnection if url.scheme == 'https' else HTTPConnection
+        self.netloc = url.netloc
+        self.path = url.path.rstrip('/') + '/api/collector/'
+        self.retries = retries
+        self.backoff = backoff
+        self.compress = compress
+        self.headers = {"Content-Type": "application/json",
+                        "Authorization": "Token %s" % token,
+                        "Connection": "keep-alive"}
+        if compress:
+            self.headers["Content-Encoding"] = "gzip"
+        self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, 'connection', None)
+        if conn is None:
+            conn = self.connection_class(self.netloc, timeout=300)
+            self.local.connection = conn
+        return conn
+
+    def _reset(self):
+        conn = getattr(self.local, 'connection', None)
+        if conn is not None:
+            conn.close()
+        self.local.connection = None
+
+    def send(self, send_data):
+        body = json.dumps(send_data).encode('utf8')
+        if self.compress:
+            body = _gzip(body)
+
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+            try:
+                conn = self._connection()
+                conn.request('POST', self.path, body, self.headers)
+                response = conn.getresponse()
+                content = response.read().decode('utf-8')
+            except (HTTPException, socket.error) as e:
+                # Server can close keep-alive connection - reconnect and retry
+                self._reset()
+                error = "Connection error: %s" % e
+                continue
+
+            if response.status == 200:
+                try:
+                    return json.loads(content)
+                except ValueError:
+                    # Request could be processed - do not retry it
+                    error = "Server return not a JSON response: %s" % content[:200]
+                    break
+            error = "Server return HTTP Code: %s" % response.status
+            # Client errors will not be fixed by retry
+            if response.status < 500:
+                break
+        return {"result": False, "detail": error}
+
+
+def _mulsync_devices(args):
+    print(Bcolors.HEADER + "Will sync multiple devices" + Bcolors.ENDC)
+
+    items = _read_sync_items(args.data, args.filter)
+    if not items:
+        print("Nothing to sync")
+        exit(0)
+
+    batches = [items[i:i + args.batch_size] for i in range(0, len(items), args.batch_size)]
+    print(Bcolors.BOLD + "Hosts: " + Bcolors.ENDC + "%s, batches: %s, threads: %s" % (len(items),
+                                                                                    len(batches),
+                                                                                    args.threads))
+
+    token, base_url = _get_connect_info(args)
+    uploader = _Uploader(token, base_url, args.retries, args.backoff, not args.no_compress)
+
+    def send_batch(batch):
+        # Control keys should be before data - server reads data items as a stream
+        send_data = OrderedDict([('action', 'sync'), ('force', args.force), ('data', batch)])
+        result = uploader.send(send_data)
+        detail = result.get('detail')
+        # Server can queue a query as job - hosts are not synced yet
+        if result.get('job') is not None:
+            return [{"hostname": item.get('hostname'), "command": item.get('command'),
+                     "result": None, "detail": detail} for item in batch]
+        # For one host server returns result of this host
+        if not isinstance(detail, list):
+            detail = [{"hostname": item.get('hostname'), "command": item.get('command'),
+                       "result": result.get('result'), "detail": detail} for item in batch]
+        return detail
+
+    pool = Pool(args.threads)
+    failed = 0
+    queued = 0
+    try:
+        for results in pool.imap_unordered(send_batch, batches):
+            for item in results:
+                if item.get('result') is None:
+                    status = Bcolors.WARNING + "QUEUED" + Bcolors.ENDC
+                    queued += 1
+                elif item.get('result'):
+                    status = Bcolors.OKGREEN + "OK" + Bcolors.ENDC
+                else:
+                    status = Bcolors.FAIL + "FAIL" + Bcolors.ENDC
+                    failed += 1
+                print("%s\t%s\t%s\t%s" % (status, item.get('hostname'), item.get('command'), item.get('detail')))
+    finally:
+        pool.close()
+        pool.join()
+
+    print(Bcolors.BOLD + "Synced: " + Bcolors.ENDC + "%s, " % (len(items) - failed - queued) +
+          Bcolors.BOLD + "queued: " + Bcolors.ENDC + "%s, " % queued +
+          Bcolors.BOLD + "failed: " + Bcolors.ENDC + "%s" % failed)
+    if failed:
+        exit(1)
+
+
 def _list_api(args):
     print(Bcolors.HEADER + "Will get info from API" + Bcolors.ENDC)
     url = 'api/'
@@ -168,8 +338,16 @@ def _add_args():
     mulsync_parser = subparsers.add_parser('mulsync',
                                            help='Syncing a multiple device')
     mulsync_parser.add_argument('data', nargs='?', type=FileType('r'),
-                                default=sys.stdin, help="Json data, contains a host,command, data values")
-    mulsync_parser.add_argument('-f', '--filter', action='store', help='Filter string')
+                                default=sys.stdin, help="Json or JSONL data, contains a host,command, data values")
+    mulsync_parser.add_argument('-f', '--filter', action='store', help='Sync only hostnames matched this regex')
+    mulsync_parser.add_argument('-b', '--batch-size', type=int, default=50, help='Count of hosts in one request')
+    mulsync_parser.add_argument('-j', '--threads', type=int, default=4, help='Count of parallel requests')
+    mulsync_parser.add_argument('-r', '--retries', type=int, default=3, help='Count of retries for failed request')
+    mulsync_parser.add_argument('--backoff', type=float, default=1.0,
+                                help='First retry delay in seconds, doubles every retry')
+    mulsync_parser.add_argument('--no-compress', action='store_true', help='Do not gzip requests')
+    mulsync_parser.add_argument('--force', action='store_true', help='Sync even not changed outputs')
+    mulsync_parser.set_defaults(func=_mulsync_devices)
 
     # Search
     search_parser = subparsers.add_parser('search',
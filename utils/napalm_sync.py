@@ -1,255 +1,278 @@
 #!/usr/bin/env python3
 
+from argparse import ArgumentParser, SUPPRESS
 import os
-import sys
-import django
+import queue
 import re
+import sys
+import threading
+import time
 import getpass
-import clitable
+import django
+from django.db import transaction
 from napalm import get_network_driver
-from dcim.constants import *
-
-# Regex for determine virtual interfaces type
-VIRTUAL_REGEX = '^([Vv]lan|[Dd]iler|[Vv]irtual).*|(.+\.\d+)'
 
-# Regex for determine LAG interfaces type
-PORTCHANNEL_REGEX = '^([Pp]ort).*'
+# Netbox folder - collector is cloned into it
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
-TEMPLATES_DIRECTORY = "cli_templates"
+# Command for get inventory from device, same as in cli_templates/index
+INVENTORY_COMMAND = 'sh inventory'
 
 
-def connectToDevice(device, login, password):
+def connectToDevice(device, login, password, timeout):
     ''' Connect to device using NAPALM drivers
     '''
-    driver = device.platform.napalm_driver
+    driver = get_network_driver(device.platform.napalm_driver)
     ip_addr = str(device.primary_ip.address.ip)
 
-    driver = get_network_driver(driver)
-
-    print("connecting to device {} User: {}".format(ip_addr, login))
+    print("connecting to device {} ({}) User: {}".format(device.name, ip_addr, login))
 
-    connection = driver(ip_addr, login, password)
-
-    try:
-        connection.open()
-    except Exception as e:
-        print("Cannot connect to device {}, error is {}".format(ip_addr, e))
-        return 0
-    else:
-        return connection
-
-
-def initParser():
-    try:
-        parser = clitable.CliTable('index', TEMPLATES_DIRECTORY)
-    except Exception as e:
-        print("Problem with parser init - check index file and templates directory. Error is {}".format(e))
-        return None
-    return parser
+    connection = driver(ip_addr, login, password, timeout=timeout)
+    connection.open()
+    return connection
 
 
-def getInterfaceType(if_name):
-    ''' Determine iface type (simple) 
+def convertInterfaces(interfaces, interfaces_ip):
+    ''' Convert NAPALM interfaces into collector format
+        (same as result of parsing interfaces command)
     '''
-    v_regex = re.compile(VIRTUAL_REGEX)
-    p_regex = re.compile(PORTCHANNEL_REGEX)
-    if v_regex.match(if_name) == None:
-        if p_regex.match(if_name) == None:
-            return IFACE_FF_1GE_FIXED # no way how to determine now interface type =(
-        else:
-            return IFACE_FF_LAG
-    else:
-        return IFACE_FF_VIRTUAL
-
-
-def compareInterfaces(src_iface, dst_iface):
-    ''' This function compare shortest interface name
-        with longest interface name.
-
-        EXAMPLE:
-        eth0/1 should match Ethernet0/1
+    result = []
+    for if_name, iface in interfaces.items():
+        addresses = []
+        for family in ('ipv4', 'ipv6'):
+            for address, params in interfaces_ip.get(if_name, {}).get(family, {}).items():
+                addresses.append("{}/{}".format(address, params['prefix_length']))
+
+        state = iface.get('is_enabled') and iface.get('is_up')
+        result.append({
+            'NAME': if_name,
+            'MAC': iface.get('mac_address') or None,
+            'IP': addresses,
+            'MTU': iface.get('mtu') or '',
+            'DESCR': iface.get('description') or '',
+            'TYPE': '',
+            'STATE': 'up' if state else 'down',
+        })
+    return result
+
+
+def collectDevice(device, login, password, timeout, interfaces=True, inventory=True):
+    ''' Connect to device and get all data from it
+        Is running in thread - so do not touch a database here
     '''
-    regex = '([a-z\-]+)([\d/\.]+)'
-    regex = re.compile(regex, re.I)
+    data = {}
+    connection = connectToDevice(device, login, password, timeout)
     try:
-        src_name, src_number = regex.match(src_iface).groups()
-        dst_name, dst_number = regex.match(dst_iface).groups()
-    except:
-        return False
-
-    nameMatch = src_name.lower().startswith(dst_name.lower())
-    return ((src_number == dst_number) and nameMatch)
-
-
-def syncInterfaces(device, connection, iface_regex):
-    ''' Get interfaces from device and add|update it on netbox
+        if interfaces:
+            try:
+                interfaces_ip = connection.get_interfaces_ip()
+            except NotImplementedError:
+                interfaces_ip = {}
+            data['interfaces'] = convertInterfaces(connection.get_interfaces(), interfaces_ip)
+        if inventory:
+            output = connection.cli([INVENTORY_COMMAND])
+            data['inventory'] = output.get(INVENTORY_COMMAND)
+    finally:
+        connection.close()
+    return data
+
+
+def syncDevice(parser, device, data, iface_regex=None):
+    ''' Save collected data by collector sync functions
+        All changes of device are saved by one transaction, as API do
+        Return list of tuples (what, result, detail)
     '''
-    interfaces = connection.get_interfaces()
-
-    print("Connection complete, number of interfaces {}".format(len(interfaces)))
-
-    for if_name in interfaces.keys():
-        # Cheking is interface matching regex
-        if re.match(iface_regex, if_name):
-            if_type = getInterfaceType(if_name)
-            # and state (up/down)
-            state = (interfaces[if_name]['is_enabled'] and interfaces[if_name]['is_up'])
-
-            intf = device.interfaces.filter(name = if_name)
-
-            # I cannot found now a way how to do it without two code block =\
-            if intf.count() == 0:
-                # if no interface present in device, create new
-                print("Create new interface {}".format(if_name))
-                iface = Interface(name = if_name)
-                iface.description = interfaces[if_name]['description']
-                iface.mac_address = interfaces[if_name]['mac_address']
-                iface.enabled =  state
-                iface.form_factor = if_type
-                iface.device = device
-                iface.save()
-                # Try to connect interface by description
-                connect_interface(iface)
-            else:
-                # or get current iface and update them
-                print("Update interface {}".format(if_name))
-                iface = intf[0]
-                iface.description = interfaces[if_name]['description']
-                iface.mac_address = interfaces[if_name]['mac_address']
-                iface.enabled =  state
-                #iface.form_factor = if_type
-                iface.save()
-                # Try to connect interface by description
-                connect_interface(iface)
+    results = []
+    with transaction.atomic():
+        if 'interfaces' in data:
+            interfaces = data['interfaces']
+            if iface_regex:
+                interfaces = [iface for iface in interfaces if iface_regex.match(iface['NAME'])]
+            try:
+                # Errors of interfaces do not roll back inventory
+                with transaction.atomic():
+                    result, detail = collector.sync_interfaces(device, interfaces)
+            except Exception as e:
+                result, detail = False, "Error while syncing. {}".format(e)
+            results.append(('interfaces', result, detail))
+
+        if data.get('inventory'):
+            # Same way as API do - parse output by index and templates
+            host = {'hostname': device.name, 'command': INVENTORY_COMMAND, 'data': data['inventory']}
+            host_result = collector.sync_hosts(parser, [host])[0]
+            results.append(('inventory', host_result['result'], host_result['detail']))
+        elif 'inventory' in data:
+            results.append(('inventory', False, "Cannot do a command {} on device".format(INVENTORY_COMMAND)))
+    return results
+
+
+def getDevices(args):
+    ''' Get devices by filter
+    '''
+    devices = Device.objects.select_related('platform', 'primary_ip4', 'primary_ip6', 'device_type__manufacturer')
+    if args.device:
+        devices = devices.filter(name__in=args.device)
+    if args.site:
+        devices = devices.filter(site__slug=args.site)
+    if args.role:
+        devices = devices.filter(device_role__slug=args.role)
+    if args.platform:
+        devices = devices.filter(platform__slug=args.platform)
+    return list(devices.order_by('name'))
+
+
+def startCollecting(devices, workers, collect):
+    ''' Collect data from devices by daemon threads
+        Return queue of tuples (device, data, error)
+    '''
+    tasks = queue.Queue()
+    for device in devices:
+        tasks.put(device)
+    results = queue.Queue()
+
+    def worker():
+        while True:
+            try:
+                device = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results.put((device, collect(device), None))
+            except Exception as e:
+                results.put((device, None, e))
+
+    for _ in range(min(workers, len(devices))):
+        threading.Thread(target=worker, daemon=True).start()
+    return results
+
+
+def syncDevices(args, password):
+    ''' Collect data from devices by pool of threads
+        and save it into netbox one by one
+    '''
+    parser = collector.get_parser()
+    if not parser:
+        print("Cannot work without parser - exiting...")
+        exit(-1)
+
+    devices = getDevices(args)
+    print("Found {} devices".format(len(devices)))
+
+    # {device name: (result, detail)}
+    report = {}
+    ready = []
+    for device in devices:
+        if not device.platform or not device.platform.napalm_driver:
+            report[device.name] = [('connect', False, "Device has no platform with NAPALM driver")]
+        elif not device.primary_ip:
+            report[device.name] = [('connect', False, "Device has no primary IP")]
         else:
+            ready.append(device)
+
+    iface_regex = re.compile(args.iface_regex) if args.iface_regex else None
+
+    # {device name: time of start collecting}
+    started = {}
+
+    def collect(device):
+        started[device.name] = time.time()
+        return collectDevice(device, args.user, password, args.timeout, not args.no_interfaces,
+                             not args.no_inventory)
+
+    start = time.time()
+    # Daemon threads do not block exit of script - thread of device dropped by deadline
+    # is killed with script, its data is not saved
+    results = startCollecting(ready, args.workers, collect)
+    pending = {device.name for device in ready}
+    while pending:
+        # Data is saved in main thread while other devices are still collecting
+        try:
+            device, data, error = results.get(timeout=1)
+        except queue.Empty:
             pass
-          # print("Interface {} not matched - pass".format(if_name))
-
-
-def sync_inventory(device, conn, parser):
-    ''' Get list of parsed inventory commands
-        And add it into netbox device inventory
-    '''
-    command = {'Command': 'sh inventory'}
-    output = conn.cli([command['Command']])
-    output = output[command['Command']]
-
-    # print("Output is {}".format(output))
-    if output:
-        parser.ParseCmd(output, command)
-        result = [list(row) for row in parser]
-
-        if result:
-            for item in result:
-                name = item[0]
-                descr = item[1]
-                pid = item[2]
-                serial = item[4]
-
-                # Check, if this item exists (by device, name and serial)
-                item = InventoryItem.objects.filter(device = device, name = name, serial = serial)
-
-                if item:
-                    print("Device {} alredy have a item {}".format(device.name, name))
-                    continue
-                else:
-                    print("Tries to add a item {} on device {}".format(device.name, name))
-                    item = InventoryItem()
-                    item.manufacturer = device.device_type.manufacturer
-                    item.name = name.strip('"')
-                    item.part_id = pid
-                    item.serial = serial
-                    item.description = descr.strip('"')
-                    item.device = device
-                    item.save()
         else:
-            print("Cannot parse output of command")
-    else:
-        print("Cannot do a command {} on device".format(command))
-
-
-def connect_interface(interface):
-    ''' Get iface connection from iface description
-        Description should be like "server|port"
-    '''
-    desc_regex = "^(.*)+\|(.*)+"
-    desc_regex = re.compile(desc_regex)
-
-    iface_descr = interface.description
-
-    if desc_regex.match(iface_descr):
-        asset_tag, server_port = iface_descr.split('|')
-
-        server = Device.objects.filter(asset_tag = asset_tag)
-        if server:
-            server = server[0]
-            server_name = server.name
-
-            # Find and compare ports
-            for iface in server.interfaces.all():
-                if compareInterfaces(iface.name, server_port):
-                    port = iface
-                else:
-                    port = None
-
-            port = server.interfaces.filter(name = server_port) 
-            if port:
-                conn = InterfaceConnection()
-                conn.interface_a = interface
-                conn.interface_b = port[0]
-                try:
-                    conn.save()
-                except Exception as e:
-                    print("Cannot do a connection {} to {} on {} - error is {}".format(interface.name, server_name, server_port, e))
-                    return
-                print("Successfully connected interface {} to server {} on port {}".format(interface.name, server_name, server_port))
+            if device.name not in pending:
+                # Device was dropped by deadline
+                continue
+            pending.discard(device.name)
+            if error is not None:
+                print("Cannot collect data from device {}, error is {}".format(device.name, error))
+                report[device.name] = [('connect', False, str(error))]
             else:
-                print("Cannot found interface {} on server {}".format(server_port, server_name))
-        else:
-            print("Cannot find server by AssetTag {}".format(asset_tag))
-    else:
-        print("Incorrect or None description on interface {} - cannot connect anything".format(interface.name))
-
-
-if __name__ == '__main__': 
-    ''' Sync network device interfaces with netbox
+                report[device.name] = syncDevice(parser, device, data, iface_regex)
+                for what, result, detail in report[device.name]:
+                    print("{} {}: {}".format(device.name, what, detail))
+
+        # Driver timeout is per command - device with many slow commands is dropped by deadline
+        now = time.time()
+        for name in list(pending):
+            if name in started and now - started[name] > args.device_timeout:
+                pending.discard(name)
+                detail = "Data was not collected in {} seconds".format(args.device_timeout)
+                print("Cannot collect data from device {}, error is {}".format(name, detail))
+                report[name] = [('connect', False, detail)]
+
+    printReport(report, time.time() - start)
+    return all(result for results in report.values() for _, result, _ in results)
+
+
+def printReport(report, elapsed):
+    failed = {name: results for name, results in report.items()
+              if not all(result for _, result, _ in results)}
+
+    print()
+    print("Synced {} devices in {:.1f} seconds: {} ok, {} failed".format(len(report), elapsed,
+                                                                         len(report) - len(failed), len(failed)))
+    for name in sorted(failed):
+        for what, result, detail in failed[name]:
+            if not result:
+                print("  {} {}: {}".format(name, what, detail))
+
+
+if __name__ == '__main__':
+    ''' Sync network devices info (interfaces, inventory) with netbox
     '''
-    if len(sys.argv) < 3:
-        print("Script syncing cisco devices info (interface, inventory) with netbox")
-        print("Usage {} <device_name> <user> [ifaces regex]".format(os.path.basename(__file__)))
-        print("Iface regex is a custom option, if set - will sync only a matched regex interfaces")
-        print("By default interfaces match '.*' regex")
-        exit(0)
+    parser = ArgumentParser(description="Script syncing network devices info (interfaces, inventory) with netbox",
+                            epilog="Old form '<device_name> <user> [ifaces regex]' is supported too, "
+                                   "but is deprecated - use '<user> -d <device_name> -i <ifaces regex>'")
+    parser.add_argument('user', help="User for connect to devices")
+    parser.add_argument('old_args', nargs='*', help=SUPPRESS)
+    parser.add_argument('-d', '--device', action='append', help="Device name, can be used many times")
+    parser.add_argument('-s', '--site', help="Sync all devices of site (slug)")
+    parser.add_argument('-r', '--role', help="Sync all devices with role (slug)")
+    parser.add_argument('-p', '--platform', help="Sync all devices with platform (slug)")
+    parser.add_argument('-w', '--workers', type=int, default=16, help="Count of devices collected at once")
+    parser.add_argument('-t', '--timeout', type=int, default=60,
+                        help="Timeout of NAPALM driver for connect and every command in seconds")
+    parser.add_argument('-T', '--device-timeout', type=int, default=300,
+                        help="Max time for collect data from one device in seconds")
+    parser.add_argument('-i', '--iface-regex', help="Sync only interfaces matched this regex")
+    parser.add_argument('--no-interfaces', action='store_true', help="Do not sync interfaces")
+    parser.add_argument('--no-inventory', action='store_true', help="Do not sync inventory")
+    args = parser.parse_args()
+
+    if args.old_args:
+        # Old form: <device_name> <user> [ifaces regex]
+        if len(args.old_args) > 2 or args.device or args.iface_regex:
+            parser.error("unrecognized arguments: {}".format(" ".join(args.old_args)))
+        args.device = [args.user]
+        args.user = args.old_args[0]
+        if len(args.old_args) > 1:
+            args.iface_regex = args.old_args[1]
+        print("Deprecated form of arguments, use: {} {} -d {}{}".format(
+            os.path.basename(__file__), args.user, args.device[0],
+            " -i '{}'".format(args.iface_regex) if args.iface_regex else ''))
+
+    if not (args.device or args.site or args.role or args.platform):
+        parser.error("Set a device or filter by site, role or platform")
+
+    password = getpass.getpass("Password:")
 
     # Init django enviroment
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "netbox.settings")
     django.setup()
-    from dcim.models import Device, Interface, InterfaceConnection, InventoryItem
-
-    # Init args
-    dev_name = sys.argv[1]
-    user = sys.argv[2]
-    if len(sys.argv) > 3:
-        iface_regex = sys.argv[3]
-    else:
-        iface_regex = '.*'
-    password = getpass.getpass("Password:")
-
-    # Tries to init parser module
-    parser = initParser()
-    if parser == None:
-        print("Cannot work without parser - exiting...")
-        exit(-1)
-
-    # Run sync
-    device = Device.objects.get(name = dev_name)
-    conn = connectToDevice(device, user, password)
-    if conn == 0:
-        print("Cannot sync without connection - exiting...")
-        exit(-1)
-    # sync_interfaces(device, conn, iface_regex)
-
-    # sync inventory items
-    sync_inventory(device, conn, parser)
+    from dcim.models import Device
+    from collector import collector
 
-    conn.close()
\ No newline at end of file
+    if not syncDevices(args, password):
+        exit(1)
@@ -2,11 +2,12 @@ from rest_framework.decorators import api_view, renderer_classes, permission_cla
 from rest_framework.response import Response
 from rest_framework import permissions,authentication
 from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
-from collector import collector
+from django.http import HttpResponse
+from collector import changelog, collector, ingest, jobs, metrics
+from collector.models import Job
+from collector.settings import ASYNC_QUERIES
 import logging.config
-import json
 
-parser = collector.init_parser()
 # Init logginig config
 logger = logging.getLogger('collector')
 
@@ -20,11 +21,43 @@ def index(request):
     # try:
     if request.method == "POST":
         try:
-            data = json.loads(request.body.decode())
+            metrics.start_request()
+            # Request id is set by NetBox change logging middleware
+            changelog.set_author(request.user, getattr(request, 'id', None))
+            # Hosts are read from body one by one while syncing
+            with metrics.stage('decode'):
+                data = ingest.read_query(request)
+
+            # Queue a query for worker and return job id
+            if data.get('action') == 'sync' and (data.get('async') or ASYNC_QUERIES):
+                data['data'] = list(data.get('data') or [])
+                job = jobs.enqueue_query(data)
+                return Response({"result": True,
+                                 "detail": "Query was queued as job {}".format(job.pk),
+                                 "job": job.pk
+                                 })
+
+            # Parser is not thread-safe - get a parser for this thread
+            parser = collector.get_parser()
+            if not parser:
+                return Response({"result": False,
+                                 "detail": "Collector parser is not initialized - see a log for details"
+                                 })
             result, detail = collector.parse_query(parser, data)
-            return Response({"result": result,
-                             "detail": detail
-                             })
+            response = {"result": result,
+                        "detail": detail
+                        }
+            timings = metrics.get_timings()
+            if data.get('timings'):
+                response['timings'] = timings
+            return Response(response)
+        except ingest.RequestError as e:
+            response = {"result": False,
+                        "detail": str(e)
+                        }
+            if e.results:
+                response['hosts'] = e.results
+            return Response(response)
         except Exception as e:
             return Response({"result": False,
                             "detail": str(e)
@@ -35,5 +68,21 @@ def index(request):
                         })
 
 
+@api_view(['GET'])
+@renderer_classes((JSONRenderer,))
+@permission_classes([permissions.IsAuthenticated])
+def job_status(request, job_id):
+    try:
+        job = Job.objects.get(pk=job_id)
+    except Job.DoesNotExist:
+        return Response({"result": False,
+                         "detail": "Not found job {}".format(job_id)
+                         }, status=404)
+    return Response(jobs.get_job_status(job))
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def metrics_view(request):
+    # Prometheus text format
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')